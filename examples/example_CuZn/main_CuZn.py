@@ -1,10 +1,11 @@
 from MCSPS.utilities import create_supercell
+from MCSPS.server import EvaluationServer
 from multiprocessing import Process,Manager
 from MCSPS.mcsps import sps_fixed
 import numpy as np
 
 # Probe the order-disorder phase transition in CuZn
-#  Trajectories are performed in parallel
+#  Trajectories are performed in parallel, sharing a single MEGNet model
 
 # Create the GaAs unit lattice and atomic basis
 unit_lattice = 2.955 * np.eye(3)
@@ -23,9 +24,9 @@ nswaps = ntemp * [nstep]
 temps = np.linspace(4.0, 1.8, ntemp)
 
 # Start SPS with multiprocessing
-def start_sps ( fn_swap, fn_smin ):
+def start_sps ( fn_swap, fn_smin, calculator ):
   sps_fixed(lattice, species, positions, temps, nswaps,
-            swap_fname=fn_swap, emin_fname=fn_smin)
+            swap_fname=fn_swap, emin_fname=fn_smin, calculator=calculator)
 
 # Start multiprocess manager
 manager = Manager()
@@ -35,6 +36,10 @@ dos = manager.dict()
 nproc = 4
 procs = []
 
+# Start the evaluation server, which loads the model once and batches requests from each process
+server = EvaluationServer(nclients=nproc)
+server.start()
+
 # Create the annealing processes
 for i in range(nproc):
 
@@ -42,10 +47,12 @@ for i in range(nproc):
   fname = f'swaps.{i}.out'
   fn_smin = f'structure.emin.{i}.txt'
 
-  p = Process(target=start_sps, args=(fname, fn_smin))
+  p = Process(target=start_sps, args=(fname, fn_smin, server.client(i)))
   procs.append(p)
   procs[-1].start()
 
 # Join processes
 for p in procs:
   p.join()
+
+server.stop()
@@ -0,0 +1,41 @@
+from MCSPS.calculators import ClusterExpansionCalculator, MEGNet_Calculator
+from MCSPS.utilities import create_supercell
+from MCSPS.mcsps import sps_replicas
+import numpy as np
+
+# Probe the order-disorder phase transition in CuZn
+#  Hundreds of replicas are advanced together with a cluster expansion fit to MEGNet energies
+
+# Seed the trajectory for reproducibility
+np.random.seed(4321)
+
+# Create the CuZn unit lattice and atomic basis
+unit_lattice = 2.955 * np.eye(3)
+
+unit_species = ['Cu', 'Zn']
+unit_positions = np.array([[0,0,0], [0.5,0.5,0.5]])
+
+# Create a 5x5x5 supercell
+supercell_dimensions = [5, 5, 5]
+lattice, positions, species = create_supercell(unit_lattice, unit_positions, unit_species, supercell_dimensions)
+
+# Fit the cluster expansion to MEGNet energies of random configurations
+megnet = MEGNet_Calculator()
+expansion = ClusterExpansionCalculator(lattice, positions, species)
+samples = [list(np.random.permutation(species)) for _ in range(2*expansion.nfeature)]
+for s,e in zip(samples, megnet.predict_many(lattice, samples, positions)):
+  expansion.add_sample(s, e)
+expansion.fit()
+
+# 200 replicas at each of 12 temperatures, equilibrated independently
+ntemp = 12
+nrep = 200
+nstep = 25000
+temps = np.repeat(np.linspace(4.0, 1.8, ntemp), nrep)
+
+result = sps_replicas(lattice, species, positions, [temps], [nstep], nreplicas=ntemp*nrep, calculator=expansion)
+
+# Mean and standard error of the final energy at each temperature
+enes = result['energies'].reshape(ntemp, nrep)
+for t,e in zip(temps[::nrep], enes):
+  print(f'{t:.3f} {e.mean():.6f} {e.std()/np.sqrt(nrep):.6f}')
@@ -0,0 +1,29 @@
+from MCSPS.utilities import create_supercell
+from MCSPS.mcsps import sps_parallel_tempering
+import numpy as np
+
+# Probe the order-disorder phase transition in CuZn
+#  Replicas at each temperature exchange configurations through parallel tempering
+
+# Seed the trajectory for reproducibility
+np.random.seed(4321)
+
+# Create the CuZn unit lattice and atomic basis
+unit_lattice = 2.955 * np.eye(3)
+
+unit_species = ['Cu', 'Zn']
+unit_positions = np.array([[0,0,0], [0.5,0.5,0.5]])
+
+# Create a 5x5x5 supercell
+supercell_dimensions = [5, 5, 5]
+lattice, positions, species = create_supercell(unit_lattice, unit_positions, unit_species, supercell_dimensions)
+
+# One replica at each temperature, attempting exchanges every 500 swaps
+temps = np.linspace(4.0, 1.8, 12)
+nstep = 25000
+
+# Start SPS with 4 worker processes
+if __name__ == '__main__':
+  sps_parallel_tempering(lattice, species, positions, temps, nstep,
+                         exchange_interval=500, nproc=4,
+                         swap_fname='swaps.pt.{}.out', emin_fname='structure.pt.emin.{}.xyz')
@@ -0,0 +1,328 @@
+from .calculators import Calculator
+import numpy as np
+
+# Example systems used as benchmark fixtures, and the supercell of each example
+FIXTURES = ('CuZn', 'GaAs', 'Cs2SnI6', 'Rb8Ga27Sb19')
+EXAMPLE_NSC = {'CuZn':(5,5,5), 'GaAs':(4,4,4), 'Cs2SnI6':(2,2,2), 'Rb8Ga27Sb19':(1,1,1)}
+
+
+def fixture ( name, nsc=None ):
+  '''
+    Structure of one of the example systems, with the species ordered as in the examples directory.
+
+    Arguments:
+      name (str): One of CuZn, GaAs, Cs2SnI6, or Rb8Ga27Sb19
+      nsc (tuple, list, or ndarray): Number of unit cells in each direction. Defaults to the size used by the example.
+
+    Returns:
+      (dict): Lattice, positions, species, and number of fixed sites (nfixed). Cs2SnI6 has fewer species than sites, and is run with sps_vacancy (vacancy).
+  '''
+  from .utilities import create_supercell
+
+  if name not in FIXTURES:
+    raise ValueError(f'Unknown fixture {name}. Available fixtures are {", ".join(FIXTURES)}.')
+  nsc = EXAMPLE_NSC[name] if nsc is None else nsc
+
+  vacancy,nfixed = False,0
+  if name == 'CuZn':
+    lattice,positions,species = create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], nsc)
+
+  elif name == 'GaAs':
+    fcc = 0.5 * np.array([[-1,0,1],[0,1,1],[-1,1,0]], dtype=float)
+    lattice,positions,species = create_supercell(5.75*fcc, np.array([[0,0,0],[0.25,0.25,0.25]]), ['Ga','As'], nsc)
+
+  elif name == 'Cs2SnI6':
+    unit_positions = 0.5 * np.array([[0,0,0],[1,1,1],[1,1,0],[1,0,1],[0,1,1]], dtype=float)
+    lattice,positions = create_supercell(6.29*np.eye(3), unit_positions, nsc=nsc)
+    # Half of the B sites of the perovskite are vacant, as in the example
+    ncell = int(np.prod(nsc))
+    species = (ncell//2) * (2*['Cs'] + ['Sn'] + 6*['I'])
+    vacancy = True
+
+  else:
+    from ase.spacegroup import crystal
+
+    # Type-I clathrate, with Rb on the guest sites (2a, 6d) and Ga and Sb on the framework sites (6c, 16i, 24k)
+    basis = [(0,0,0), (0.25,0.5,0), (0.25,0,0.5), (0.1837,0.1837,0.1837), (0,0.3077,0.1175)]
+    atoms = crystal(['Rb','Rb','Si','Si','Si'], basis=basis, spacegroup=223, cellpar=[11.7,11.7,11.7,90,90,90])
+    lattice,positions,index,_ = create_supercell(atoms.cell[:], atoms.get_scaled_positions(), nsc=nsc, return_mapping=True)
+    # Order the guest sites of every cell first, to be fixed
+    guest = np.array([s == 'Rb' for s in atoms.get_chemical_symbols()])[index]
+    positions = np.concatenate([positions[guest], positions[~guest]])
+    nfixed = int(guest.sum())
+    species = nfixed*['Rb'] + (nfixed//8) * (27*['Ga'] + 19*['Sb'])
+
+  return {'lattice':np.array(lattice), 'positions':np.array(positions), 'species':list(species), 'nfixed':nfixed, 'vacancy':vacancy}
+
+
+
+class MockCalculator (Calculator):
+  '''
+    Inexpensive calculator for measuring the overhead of the SPS routines. The energy is the fraction
+    of consecutive sites with equal species, and the time spent in the calculator is recorded.
+  '''
+
+  def __init__ ( self ):
+    self.calls = 0
+    self.time = 0.
+
+  def predict_formation_energy ( self, lattice, species, positions ):
+    from time import perf_counter
+
+    start = perf_counter()
+    ene = sum(a == b for a,b in zip(species, species[1:])) / len(species)
+    self.calls += 1
+    self.time += perf_counter() - start
+    return ene
+
+
+
+def _best_time ( func, number=1, repeat=3 ):
+  '''
+    Minimum time, in seconds, of one call to func over repeat runs of number calls.
+  '''
+  from time import perf_counter
+
+  best = np.inf
+  for _ in range(repeat):
+    start = perf_counter()
+    for _ in range(number):
+      func()
+    best = min(best, (perf_counter()-start)/number)
+  return best
+
+
+
+def bench_sps_swap ( systems=FIXTURES, nswaps=(1,4), number=2000 ):
+  '''
+    Rate of trial proposals with sps_swap and SitePools.propose.
+
+    Returns:
+      (list): Proposals per second for each system and number of swaps per trial
+  '''
+  from .sites import SitePools
+  from .mcsps import sps_swap
+
+  results = []
+  for name in systems:
+    fix = fixture(name)
+    if fix['vacancy']:
+      continue
+    species,nfixed = fix['species'],fix['nfixed']
+    pools = SitePools(species, nfixed)
+    for n in nswaps:
+      results.append({'system':name, 'nsite':len(species), 'nswap':n,
+                      'sps_swap':1/_best_time(lambda: sps_swap(species, nfixed, n), number),
+                      'SitePools.propose':1/_best_time(lambda: pools.propose(n), number)})
+  return results
+
+
+
+def bench_loop ( systems=FIXTURES, nsteps=2000, batch_sizes=(1,8), directory=None ):
+  '''
+    Iteration rate of sps_fixed, or sps_vacancy for systems with vacancies, with MockCalculator.
+    The time spent outside the calculator is reported as the overhead per iteration.
+
+    Arguments:
+      directory (str): Directory for the output files. Defaults to a temporary directory.
+
+    Returns:
+      (list): Iterations per second and overhead per iteration, in seconds, for each system and batch size
+  '''
+  from .mcsps import sps_fixed, sps_vacancy
+  from tempfile import TemporaryDirectory
+  from time import perf_counter
+  from os.path import join
+
+  results = []
+  with TemporaryDirectory(dir=directory) as tmp:
+    for name in systems:
+      fix = fixture(name)
+      for bs in batch_sizes:
+        if fix['vacancy'] and bs != 1:
+          continue
+        calc = MockCalculator()
+        swap_fname,emin_fname = join(tmp, f'swaps.{name}.{bs}.out'),join(tmp, f'emin.{name}.{bs}.xyz')
+        np.random.seed(0)
+        start = perf_counter()
+        if fix['vacancy']:
+          sps_vacancy(fix['lattice'], fix['species'], fix['positions'], [0.1], [nsteps], calculator=calc,
+                      swap_fname=swap_fname, emin_fname=emin_fname)
+        else:
+          sps_fixed(fix['lattice'], fix['species'], fix['positions'], [0.1], [nsteps], nfixed=fix['nfixed'],
+                    calculator=calc, batch_size=bs, swap_fname=swap_fname, emin_fname=emin_fname)
+        elapsed = perf_counter() - start
+        results.append({'system':name, 'routine':'sps_vacancy' if fix['vacancy'] else 'sps_fixed',
+                        'nsite':len(fix['positions']), 'batch_size':bs, 'steps':nsteps,
+                        'steps_per_second':nsteps/elapsed, 'overhead_per_step':(elapsed-calc.time)/nsteps})
+  return results
+
+
+
+def bench_megnet ( systems=FIXTURES, sizes=(1,2), batch_sizes=(1,8,32), repeat=3 ):
+  '''
+    Latency of MEGNet_Calculator for single structures and batches, versus the number of sites.
+    Each size multiplies the supercell of the example in every direction. The benchmark is skipped
+    if MEGNet cannot be loaded.
+
+    Returns:
+      (list or dict): Seconds per structure for each system, supercell size, and batch size, or the reason the benchmark was skipped
+  '''
+  try:
+    from .calculators import MEGNet_Calculator
+    calc = MEGNet_Calculator()
+  except Exception as err:
+    return {'skipped':f'{type(err).__name__}: {err}'}
+
+  results = []
+  for name in systems:
+    for n in sizes:
+      fix = fixture(name, n*np.array(EXAMPLE_NSC[name]))
+      if fix['vacancy']:
+        continue
+      lattice,positions,species = fix['lattice'],fix['positions'],fix['species']
+      # The first call builds the graph topology, which is reused by later calls
+      first = _best_time(lambda: calc.predict_formation_energy(lattice, species, positions), 1, 1)
+      for bs in batch_sizes:
+        batch = [list(np.random.permutation(species)) for _ in range(bs)]
+        if bs == 1:
+          t = _best_time(lambda: calc.predict_formation_energy(lattice, batch[0], positions), 1, repeat)
+        else:
+          t = _best_time(lambda: calc.predict_many(lattice, batch, positions), 1, repeat)
+        results.append({'system':name, 'nsite':len(species), 'batch_size':bs, 'first_call':first,
+                        'seconds_per_structure':t/bs})
+  return results
+
+
+
+def bench_supercell ( sizes=(4,8,16,32,64), repeat=3 ):
+  '''
+    Time of create_supercell for a two-site unit cell, versus the number of cells.
+
+    Returns:
+      (list): Seconds per call for each supercell size
+  '''
+  from .utilities import create_supercell
+
+  lattice,positions,species = 2.955*np.eye(3),np.array([[0,0,0],[0.5,0.5,0.5]]),['Cu','Zn']
+  results = []
+  for n in sizes:
+    t = _best_time(lambda: create_supercell(lattice, positions, species, (n,n,n)), 1, repeat)
+    results.append({'nsc':n, 'nsite':2*n**3, 'seconds':t})
+  return results
+
+
+
+def bench_io ( nrecords=100000, directory=None ):
+  '''
+    Throughput of the trajectory output files, writing and reading the swaps trajectory in both formats
+    and writing the configuration log.
+
+    Arguments:
+      directory (str): Directory for the output files. Defaults to a temporary directory.
+
+    Returns:
+      (dict): Records per second for each format and operation
+  '''
+  from .file_io import ConfigurationLogWriter, SwapTrajectoryWriter, read_swap_trajectory
+  from tempfile import TemporaryDirectory
+  from time import perf_counter
+  from os.path import join
+
+  results = {}
+  with TemporaryDirectory(dir=directory) as tmp:
+    for binary in (False, True):
+      fmt = 'binary' if binary else 'text'
+      fname = join(tmp, f'swaps.{fmt}.out')
+      start = perf_counter()
+      with SwapTrajectoryWriter(fname, 'w', binary=binary) as writer:
+        for i in range(nrecords):
+          writer.write(i, 1, 0.1, -0.5+1e-6*i)
+      results[f'swaps_{fmt}_write'] = nrecords / (perf_counter()-start)
+      start = perf_counter()
+      read_swap_trajectory(fname)
+      results[f'swaps_{fmt}_read'] = nrecords / (perf_counter()-start)
+
+    fix = fixture('CuZn')
+    nsite = len(fix['species'])
+    sites = np.random.randint(nsite, size=(nrecords,2)).tolist()
+    start = perf_counter()
+    with ConfigurationLogWriter(join(tmp, 'configurations.log'), fix['lattice'], fix['positions'], fix['species']) as log:
+      for i,s in enumerate(sites):
+        log.write(i, s, ['Zn','Cu'])
+    results['configuration_log_write'] = nrecords / (perf_counter()-start)
+  return results
+
+
+
+# Benchmarks run by run_benchmarks, with the reduced arguments used by the quick option
+BENCHMARKS = {'sps_swap':(bench_sps_swap, {'number':200}),
+              'loop':(bench_loop, {'nsteps':200}),
+              'megnet':(bench_megnet, {'sizes':(1,), 'batch_sizes':(1,8), 'repeat':1}),
+              'supercell':(bench_supercell, {'sizes':(2,4,8)}),
+              'io':(bench_io, {'nrecords':10000})}
+
+
+def run_benchmarks ( fname=None, benchmarks=None, quick=False ):
+  '''
+    Run the benchmarks and collect the results with a description of the environment.
+
+    Arguments:
+      fname (str): File name for the results, written as JSON
+      benchmarks (list): Names of the benchmarks to run, from BENCHMARKS. Defaults to all.
+      quick (bool): Run each benchmark with fewer iterations and smaller systems
+
+    Returns:
+      (dict): Environment description (environment) and the results of each benchmark (results)
+  '''
+  from time import perf_counter, strftime
+  import platform
+  import json
+
+  try:
+    from importlib.metadata import version
+    mcsps_version = version('MC-SPS')
+  except Exception:
+    mcsps_version = None
+
+  if benchmarks is None:
+    benchmarks = list(BENCHMARKS)
+  for name in benchmarks:
+    if name not in BENCHMARKS:
+      raise ValueError(f'Unknown benchmark {name}. Available benchmarks are {", ".join(BENCHMARKS)}.')
+
+  report = {'environment':{'mcsps':mcsps_version, 'python':platform.python_version(), 'numpy':np.__version__,
+                           'platform':platform.platform(), 'processor':platform.processor(),
+                           'date':strftime('%Y-%m-%dT%H:%M:%S'), 'quick':quick},
+            'results':{}}
+
+  state = np.random.get_state()
+  try:
+    for name in benchmarks:
+      func,kwargs = BENCHMARKS[name]
+      start = perf_counter()
+      report['results'][name] = func(**(kwargs if quick else {}))
+      report['environment'][f'{name}_seconds'] = perf_counter() - start
+  finally:
+    np.random.set_state(state)
+
+  if fname is not None:
+    with open(fname, 'w') as f:
+      json.dump(report, f, indent=1)
+  return report
+
+
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  import json
+
+  parser = ArgumentParser(description='Benchmark the MCSPS routines, writing the results as JSON.')
+  parser.add_argument('-o', '--output', default=None, help='File name for the results. Printed if omitted.')
+  parser.add_argument('-b', '--benchmarks', nargs='+', default=None, choices=list(BENCHMARKS), help='Benchmarks to run')
+  parser.add_argument('-q', '--quick', action='store_true', help='Use fewer iterations and smaller systems')
+  args = parser.parse_args()
+
+  report = run_benchmarks(args.output, args.benchmarks, args.quick)
+  if args.output is None:
+    print(json.dumps(report, indent=1))
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class EnergyCache:
+  '''
+    Bounded least-recently-used cache of configuration energies. Configurations are keyed by
+    a 16 byte digest of their site occupation, so each entry occupies roughly 200 bytes,
+    including the dictionary overhead, regardless of the number of sites.
+  '''
+
+  def __init__ ( self, max_entries=100000, symmetry=None ):
+    '''
+      Arguments:
+        max_entries (int): Maximum number of stored energies. The least recently used entry is discarded when the cache is full.
+        symmetry (SiteSymmetry): Site symmetry of the geometry. If provided, occupations are mapped to their canonical representative, so symmetry-equivalent configurations share a single entry.
+    '''
+    if max_entries < 1:
+      raise ValueError('max_entries must be a positive integer')
+
+    self.max_entries = max_entries
+    self.symmetry = symmetry
+    self.energies = OrderedDict()
+    self.codes = {None:0}
+    self.hits = 0
+    self.misses = 0
+
+
+  def __len__ ( self ):
+    return len(self.energies)
+
+
+  def occupation ( self, species ):
+    '''
+      Encode a list of atomic symbols as an integer occupation array. Vacant sites are represented by None.
+
+      Arguments:
+        species (list): Atomic symbol, or None, for each site
+
+      Returns:
+        (ndarray): Integer code for each site
+    '''
+    for s in set(species).difference(self.codes):
+      self.codes[s] = len(self.codes)
+    return np.array([self.codes[s] for s in species], dtype=np.int16)
+
+
+  def key ( self, species, symbols=None ):
+    '''
+      Compute the cache key for a configuration.
+
+      Arguments:
+        species (list or ndarray): Atomic symbol, or None, for each site, or an integer species index for each site
+        symbols (list): Atomic symbol, or None, of each species index, required for integer species. Index -1 refers to the last symbol.
+
+      Returns:
+        (bytes): Digest of the site occupation
+    '''
+    from hashlib import blake2b
+
+    # Integer species are mapped through the cache's own codes, so that they share keys with the same configuration
+    # given as symbols, whatever the order of symbols used by the caller
+    if isinstance(species, np.ndarray) and species.dtype.kind in 'iu':
+      if symbols is None:
+        raise ValueError('symbols must be provided to key integer species')
+      occupation = self.occupation(list(symbols))[species]
+    else:
+      occupation = self.occupation(species)
+    if self.symmetry is not None:
+      occupation = self.symmetry.canonical(occupation)
+    return blake2b(occupation.tobytes(), digest_size=16).digest()
+
+
+  def get ( self, key ):
+    '''
+      Retrieve a stored energy, marking it as recently used.
+
+      Arguments:
+        key (bytes): Configuration key from EnergyCache.key
+
+      Returns:
+        (float): The stored energy, or None if the configuration has not been stored
+    '''
+    ene = self.energies.get(key)
+    if ene is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self.energies.move_to_end(key)
+    return ene
+
+
+  def put ( self, key, energy ):
+    '''
+      Store the energy of a configuration, discarding the least recently used entry if the cache is full.
+
+      Arguments:
+        key (bytes): Configuration key from EnergyCache.key
+        energy (float): Energy of the configuration
+    '''
+    self.energies[key] = energy
+    self.energies.move_to_end(key)
+    if len(self.energies) > self.max_entries:
+      self.energies.popitem(last=False)
+
+
+  def summary ( self ):
+    '''
+      Returns:
+        (str): Hit and miss counts for the cache
+    '''
+    nlookup = self.hits + self.misses
+    rate = self.hits / nlookup if nlookup > 0 else 0
+    return f'Energy cache: {self.hits} hits, {self.misses} misses ({100*rate:.1f}% hit rate), {len(self)} of {self.max_entries} entries used'
@@ -1,20 +1,446 @@
-from pymatgen.core.structure import Structure
+import numpy as np
 
 class Calculator:
 
+  # Whether predict_delta is evaluated locally, in time independent of the number of sites
+  local_delta = False
+
+  # PhaseProfiler charged with the time of the calculator's own phases, set by the SPS routines
+  profiler = None
+
   def __init__ ( self ):
     pass
 
   def predict_formation_energy ( self, lattice, species, positions ):
     pass
 
+  def predict_many ( self, lattice, species_batch, positions ):
+    '''
+      Predict the formation energy of several species arrangements on a shared lattice and basis.
+      The default implementation evaluates each arrangement individually. Calculators that can
+      evaluate a batch together override this method.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species_batch (list or ndarray): List of M species lists, or an MxN array, with one atomic symbol per site
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+
+      Returns:
+        (ndarray): M predicted energies, one for each species list
+    '''
+    if isinstance(species_batch, np.ndarray):
+      species_batch = species_batch.tolist()
+    return np.array([self.predict_formation_energy(lattice, s, positions) for s in species_batch])
+
+  def predict_delta ( self, lattice, species, positions, swaps, energy=None ):
+    '''
+      Predict the energy change from swapping the species of pairs of sites, in order.
+      The default implementation evaluates the full structure after the swaps, and before the swaps
+      if energy is not provided. Calculators with a local energy change override this method and set local_delta.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species (list): List of atomic symbols for each site before the swaps
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+        swaps (list): Pairs of site indices (i,j) to interchange
+        energy (float): Energy of the configuration before the swaps, if known
+
+      Returns:
+        (float): Energy change
+    '''
+    t_species = list(species)
+    for i,j in swaps:
+      t_species[i],t_species[j] = t_species[j],t_species[i]
+    if energy is None:
+      energy = self.predict_formation_energy(lattice, species, positions)
+    return self.predict_formation_energy(lattice, t_species, positions) - energy
+
+  def predict_deltas ( self, lattice, species, positions, swaps, energy=None ):
+    '''
+      Predict the energy change of each of several single swaps from the same configuration.
+      The default implementation calls predict_delta for each swap. Calculators with a vectorized local energy change override this method.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species (list): List of atomic symbols for each site
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+        swaps (ndarray): Kx2 site index pairs, each interchanged separately
+        energy (float): Energy of the configuration, if known
+
+      Returns:
+        (ndarray): Energy change of each swap
+    '''
+    return np.array([self.predict_delta(lattice, species, positions, [(i,j)], energy) for i,j in swaps], dtype=float)
+
+
+
+class ClusterExpansionCalculator (Calculator):
+  '''
+    Cluster expansion on a fixed lattice. The energy per atom is linear in the number of pairs of each
+    species combination in the first pair_shells neighbor shells, and the number of triangles of each
+    species combination with edges in the first triplet_shells shells. The effective interactions are
+    fit by ridge regression to energies from another calculator, which can be collected during a run
+    with add_sample. The energy change of a swap only involves the neighborhood of the swapped sites.
+  '''
+
+  local_delta = True
+
+  def __init__ ( self,
+                 lattice,
+                 positions,
+                 symbols,
+                 pair_shells=3,
+                 triplet_shells=2,
+                 alpha=1e-6,
+                 min_samples=None,
+                 refit_interval=50,
+                 neighbors=None ):
+    '''
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+        symbols (list): Atomic symbols which may occupy the sites
+        pair_shells (int): Number of neighbor shells with pair interactions
+        triplet_shells (int): Number of neighbor shells spanned by the edges of triplet clusters
+        alpha (float): Ridge regularization of the fit, relative to the number of samples
+        min_samples (int): Number of samples required before the first fit. Defaults to twice the number of interactions.
+        refit_interval (int): Number of new samples between successive fits
+        neighbors (NeighborIndex): Precomputed neighbor index of the lattice with at least max(pair_shells, triplet_shells) shells. Built from lattice and positions if not provided.
+    '''
+    from itertools import combinations_with_replacement, permutations
+    from .utilities import neighbor_shells
+
+    self.symbols = sorted(set(symbols))
+    self.index = {s:i for i,s in enumerate(self.symbols)}
+    self.nat = len(positions)
+    nspec = len(self.symbols)
+
+    if neighbors is None:
+      rows,cols,shells,_ = neighbor_shells(lattice, positions, nshells=max(pair_shells, triplet_shells))
+    else:
+      if len(neighbors) != self.nat:
+        raise ValueError(f'The neighbor index has {len(neighbors)} sites, but there are {self.nat} positions')
+      rows,cols,shells = neighbors.pairs(max(pair_shells, triplet_shells))
+
+    # Index of each unordered species pair and triplet
+    self.pair_type = np.zeros((nspec,nspec), dtype=int)
+    for t,(a,b) in enumerate(combinations_with_replacement(range(nspec), 2)):
+      self.pair_type[a,b] = self.pair_type[b,a] = t
+    self.triplet_type = np.zeros((nspec,nspec,nspec), dtype=int)
+    for t,abc in enumerate(combinations_with_replacement(range(nspec), 3)):
+      for perm in permutations(abc):
+        self.triplet_type[perm] = t
+    self.npair = pair_shells * (nspec*(nspec+1)//2)
+    self.nfeature = self.npair + nspec*(nspec+1)*(nspec+2)//6
+
+    # Pair neighbor lists, with the feature offset of each shell
+    pmask = shells < pair_shells
+    self.pair_rows,self.pair_cols,self.pair_shells = rows[pmask],cols[pmask],shells[pmask]
+    self.pair_offset = self.pair_shells * (nspec*(nspec+1)//2)
+
+    # Triangles of mutual neighbors, and the triangles containing each site
+    tmask = shells < triplet_shells
+    nbrs = [set() for _ in range(self.nat)]
+    for i,j in zip(rows[tmask], cols[tmask]):
+      if i != j:
+        nbrs[i].add(j)
+    tris = [(i,j,k) for i in range(self.nat) for j in nbrs[i] if j > i for k in nbrs[i] & nbrs[j] if k > j]
+    self.triangles = np.array(tris, dtype=int).reshape(-1,3)
+
+    # Neighborhood of each site, with its pairs and triangles indexed into the neighborhood
+    pair_ptr = np.searchsorted(self.pair_rows, np.arange(self.nat+1))
+    site_tris = [[] for _ in range(self.nat)]
+    for t,tri in enumerate(self.triangles):
+      for k in range(3):
+        site_tris[tri[k]].append(np.delete(tri, k))
+    self.hoods,self.hood_pairs,self.hood_tris = [],[],[]
+    for u in range(self.nat):
+      pcols = self.pair_cols[pair_ptr[u]:pair_ptr[u+1]]
+      others = np.array(site_tris[u], dtype=int).reshape(-1,2)
+      hood = np.unique(np.concatenate([[u], pcols, others.ravel()]))
+      self.hoods.append(hood)
+      self.hood_pairs.append((np.searchsorted(hood, pcols), self.pair_shells[pair_ptr[u]:pair_ptr[u+1]], pcols == u))
+      self.hood_tris.append(np.searchsorted(hood, others))
+
+    # Neighborhood of each site as padded arrays of site indices, for configurations changed in parallel.
+    # Padding entries point back to the site with zero weight.
+    npad = max(len(h[0]) for h in self.hood_pairs)
+    tpad = max(len(t) for t in self.hood_tris)
+    self.pad_pairs = np.repeat(np.arange(self.nat)[:,None], npad, axis=1)
+    self.pad_shells = np.zeros((self.nat,npad), dtype=int)
+    self.pad_weights = np.zeros((self.nat,npad))
+    self.pad_tris = np.repeat(np.arange(self.nat)[:,None,None], tpad, axis=1).repeat(2, axis=2)
+    self.pad_tri_mask = np.zeros((self.nat,tpad))
+    for u in range(self.nat):
+      pinds,pshells,pself = self.hood_pairs[u]
+      self.pad_pairs[u,:len(pinds)] = self.hoods[u][pinds]
+      self.pad_shells[u,:len(pinds)] = pshells
+      self.pad_weights[u,:len(pinds)] = np.where(pself, 1, 2)
+      self.pad_tris[u,:len(self.hood_tris[u])] = self.hoods[u][self.hood_tris[u]]
+      self.pad_tri_mask[u,:len(self.hood_tris[u])] = 1
+
+    # Fit data and effective interactions
+    self.alpha = alpha
+    self.min_samples = 2*self.nfeature if min_samples is None else min_samples
+    self.refit_interval = refit_interval
+    self.nsample = 0
+    self.nfit = 0
+
+    # Running means, and sums of centered products, of the samples' features and energies
+    self.feature_mean = np.zeros(self.nfeature)
+    self.energy_mean = 0.
+    self.feature_moment = np.zeros((self.nfeature,self.nfeature))
+    self.energy_moment = np.zeros(self.nfeature)
+    self.coef = None
+    self.intercept = 0
+    self.pair_coef = None
+    self.triplet_coef = None
+
+
+  @property
+  def fitted ( self ):
+    return self.coef is not None
+
+
+  def encode ( self, species, sites=None ):
+    '''
+      Species index of each requested site. Integer arrays are taken to index the sorted symbols already.
+    '''
+    if sites is None:
+      sites = range(len(species))
+    if isinstance(species, np.ndarray) and species.dtype.kind in 'iu':
+      return species[sites]
+    return np.array([self.index[species[k]] for k in sites], dtype=int)
+
+
+  def cluster_counts ( self, occ, pair_rows, pair_cols, pair_offset, pair_weights, triangles ):
+    '''
+      Count the clusters of each species combination, given the species index of every site.
+    '''
+    pf = pair_offset + self.pair_type[occ[pair_rows], occ[pair_cols]]
+    tf = self.npair + self.triplet_type[occ[triangles[:,0]], occ[triangles[:,1]], occ[triangles[:,2]]]
+    return np.bincount(pf, weights=pair_weights, minlength=self.nfeature) + np.bincount(tf, minlength=self.nfeature)
+
+
+  def features ( self, species ):
+    '''
+      Count the pairs and triangles of each species combination, per atom.
+
+      Arguments:
+        species (list or ndarray): Atomic symbol, or species index, for each site
+
+      Returns:
+        (ndarray): Cluster counts per atom. Pairs are counted once in each direction.
+    '''
+    occ = self.encode(species)
+    counts = self.cluster_counts(occ, self.pair_rows, self.pair_cols, self.pair_offset, None, self.triangles)
+    return counts / self.nat
+
+
+  def site_delta ( self, species, site, new, changed ):
+    '''
+      Energy change from replacing the species of a single site.
+
+      Arguments:
+        species (list or ndarray): Atomic symbol, or species index, for each site
+        site (int): Index of the site to change
+        new (int): New species index of the site
+        changed (dict): Species index overriding the species of some sites
+
+      Returns:
+        (float): Energy change
+    '''
+    hood = self.hoods[site]
+    occ = self.encode(species, hood)
+    for k,c in changed.items():
+      occ[hood == k] = c
+    old = occ[np.searchsorted(hood, site)]
+
+    # Pairs with other sites are counted from both ends. Periodic images of the site itself change at both ends.
+    pinds,pshells,pself = self.hood_pairs[site]
+    before = np.where(pself, old, occ[pinds])
+    after = np.where(pself, new, occ[pinds])
+    weights = np.where(pself, 1, 2)
+    dE = np.sum(weights * (self.pair_coef[pshells,new,after] - self.pair_coef[pshells,old,before]))
+
+    tinds = self.hood_tris[site]
+    o1,o2 = occ[tinds[:,0]],occ[tinds[:,1]]
+    dE += np.sum(self.triplet_coef[new,o1,o2] - self.triplet_coef[old,o1,o2])
+    return dE / self.nat
+
+
+  def site_delta_many ( self, occupations, rows, sites, new ):
+    '''
+      Energy change from replacing the species of one site in each of several configurations.
+
+      Arguments:
+        occupations (ndarray): MxN species index of each site of M configurations
+        rows (ndarray): Index of each changed configuration
+        sites (ndarray): Index of the site changed in each configuration
+        new (ndarray): New species index of each changed site
+
+      Returns:
+        (ndarray): Energy change of each changed configuration
+    '''
+    old = occupations[rows,sites]
+    rows,old,new = rows[:,None],old[:,None],np.asarray(new)[:,None]
+
+    # Pairs with periodic images of the site itself change at both ends
+    nbrs = self.pad_pairs[sites]
+    pself = nbrs == sites[:,None]
+    occ = occupations[rows,nbrs]
+    before = np.where(pself, old, occ)
+    after = np.where(pself, new, occ)
+    shells = self.pad_shells[sites]
+    dE = np.sum(self.pad_weights[sites] * (self.pair_coef[shells,new,after] - self.pair_coef[shells,old,before]), axis=1)
+
+    tris = self.pad_tris[sites]
+    o1,o2 = occupations[rows,tris[:,:,0]],occupations[rows,tris[:,:,1]]
+    dE += np.sum(self.pad_tri_mask[sites] * (self.triplet_coef[new,o1,o2] - self.triplet_coef[old,o1,o2]), axis=1)
+    return dE / self.nat
+
+
+  def add_sample ( self, species, energy ):
+    '''
+      Record the energy of a configuration for fitting, refitting the interactions every refit_interval samples.
+      Only the running sums needed by the fit are kept, updated in time and memory independent of the number of samples.
+
+      Arguments:
+        species (list or ndarray): Atomic symbol, or species index, for each site
+        energy (float): Energy of the configuration
+    '''
+    x = self.features(species)
+    self.nsample += 1
+
+    # Welford updates of the means and centered sums
+    dx,dy = x-self.feature_mean,energy-self.energy_mean
+    self.feature_mean += dx/self.nsample
+    self.energy_mean += dy/self.nsample
+    self.feature_moment += np.outer(dx, x-self.feature_mean)
+    self.energy_moment += dx*(energy-self.energy_mean)
+
+    if self.nsample >= self.min_samples and self.nsample - self.nfit >= self.refit_interval:
+      self.fit()
+
+
+  def fit ( self ):
+    '''
+      Fit the effective interactions to the recorded samples by ridge regression, solving the
+      normal equations of the centered features and energies.
+    '''
+    xm,ym = self.feature_mean,self.energy_mean
+    A = self.feature_moment + self.alpha*self.nsample*np.eye(self.nfeature)
+    coef = np.linalg.solve(A, self.energy_moment)
+    self.set_interactions(coef, ym - xm@coef)
+    self.nfit = self.nsample
+
+
+  def set_interactions ( self, coef, intercept ):
+    '''
+      Assign the effective interactions.
+
+      Arguments:
+        coef (ndarray): Energy per atom of each cluster count, ordered as in features
+        intercept (float): Energy per atom with no clusters
+    '''
+    self.coef = np.array(coef, dtype=float)
+    self.intercept = intercept
+
+    # Interaction of each cluster, indexed by the species of its sites
+    npt = len(self.pair_type[np.triu_indices(len(self.symbols))])
+    nshell = self.npair // npt
+    self.pair_coef = self.coef[:self.npair].reshape(nshell,npt)[:,self.pair_type]
+    self.triplet_coef = self.coef[self.npair+self.triplet_type]
+
+
+  def predict_formation_energy ( self, lattice, species, positions ):
+    if not self.fitted:
+      raise RuntimeError('The cluster expansion has not been fit')
+    return self.intercept + self.features(species)@self.coef
+
+
+  def predict_delta ( self, lattice, species, positions, swaps, energy=None ):
+    '''
+      Predict the energy change from swapping the species of pairs of sites, in order.
+      Only the clusters containing the swapped sites are recounted.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species (list or ndarray): Atomic symbol, or species index, for each site before the swaps
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+        swaps (list): Pairs of site indices (i,j) to interchange
+        energy (float): Energy of the configuration before the swaps. Unused.
+
+      Returns:
+        (float): Energy change
+    '''
+    if not self.fitted:
+      raise RuntimeError('The cluster expansion has not been fit')
+
+    # Each swap is applied as two single-site changes
+    dE = 0
+    changed = {}
+    for i,j in swaps:
+      ci = changed[i] if i in changed else self.encode(species, [i])[0]
+      cj = changed[j] if j in changed else self.encode(species, [j])[0]
+      dE += self.site_delta(species, i, cj, changed)
+      changed[i] = cj
+      dE += self.site_delta(species, j, ci, changed)
+      changed[j] = ci
+    return dE
+
+
+  def predict_deltas ( self, lattice, species, positions, swaps, energy=None ):
+    '''
+      Predict the energy change of each of several single swaps from the same configuration, with
+      site_delta_many on copies of the configuration, in blocks of swaps.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species (list or ndarray): Atomic symbol, or species index, for each site
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+        swaps (ndarray): Kx2 site index pairs, each interchanged separately
+        energy (float): Energy of the configuration. Unused.
+
+      Returns:
+        (ndarray): Energy change of each swap
+    '''
+    if not self.fitted:
+      raise RuntimeError('The cluster expansion has not been fit')
+
+    occ = self.encode(species)
+    swaps = np.asarray(swaps, dtype=int).reshape(-1,2)
+    dE = np.empty(len(swaps))
+    block = max(1, 2**20 // self.nat)
+    for start in range(0, len(swaps), block):
+      i,j = swaps[start:start+block].T
+      rows = np.arange(len(i))
+      occupations = np.repeat(occ[None,:], len(i), axis=0)
+      ci,cj = occ[i],occ[j]
+      d = self.site_delta_many(occupations, rows, i, cj)
+      occupations[rows,i] = cj
+      d += self.site_delta_many(occupations, rows, j, ci)
+      dE[start:start+len(i)] = d
+    return dE
+
+
+
+# MEGNet graph converters whose bond features depend only on the geometry, and those whose bond features depend on the species
+GEOMETRY_GRAPH_CONVERTERS = ('CrystalGraph', 'StructureGraphFixedRadius')
+SPECIES_GRAPH_CONVERTERS = ('CrystalGraphWithBondTypes',)
 
 
 class MEGNet_Calculator (Calculator):
 
   model = None
 
-  def __init__ ( self, model='Eform_MP_2019', model_fname=None ):
+  def __init__ ( self, model='Eform_MP_2019', model_fname=None, reuse_graph=True ):
+    '''
+      Arguments:
+        model (str): Name of the pretrained MEGNet model to load
+        model_fname (str): File name of a saved MEGNet model. Overrides model if provided.
+        reuse_graph (bool): Build the crystal graph (neighbor list and bond distances) once for a fixed lattice and set of positions, replacing only the atom types for each new species arrangement. Reuse is disabled for graph converters whose atom or bond features depend on more than the atomic numbers and geometry.
+    '''
 
     if model_fname is None:
       from megnet.utils.models import load_model
@@ -24,7 +450,201 @@ class MEGNet_Calculator (Calculator):
       from megnet.models import MEGNetModel
       self.model = MEGNetModel.from_file(model_fname)
 
+    self.reuse_graph = reuse_graph
+    self.graph = None
+    self.graph_key = None
+    self.graph_bonds = None
+    self.graph_species = None
+    self.graph_checked = False
+    self.atomic_numbers = {}
+
+
+  def crystal_graph ( self, lattice, species, positions ):
+    '''
+      Construct the MEGNet input graph for a structure. The graph topology depends only on the
+      lattice and positions, so the most recent topology is retained and only the atom types
+      are replaced when the geometry is unchanged. Unless the graph converter is known to have
+      geometry-only bond features, the first reused graph with new species is compared with the
+      converter's own graph, and reuse is disabled if they differ.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species (list): List of atomic symbols for each constituent site
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+
+      Returns:
+        (dict): MEGNet graph dictionary
+    '''
+
+    profiler = self.profiler
+    if profiler is not None:
+      tick = profiler.now()
+
+    if not self.reuse_graph:
+      from pymatgen.core.structure import Structure
+      pymatgen_struct = Structure(lattice, species, positions)
+      if profiler is not None:
+        tick = profiler.lap('structure', tick)
+      graph = self.model.graph_converter.convert(pymatgen_struct)
+      if profiler is not None:
+        profiler.lap('graph', tick)
+      return graph
+
+    key = (np.asarray(lattice, dtype=float).tobytes(), np.asarray(positions, dtype=float).tobytes())
+    if key != self.graph_key:
+      from pymatgen.core.structure import Structure
+      pymatgen_struct = Structure(lattice, species, positions)
+      if profiler is not None:
+        tick = profiler.lap('structure', tick)
+      self.graph = self.model.graph_converter.convert(pymatgen_struct)
+      self.graph_key = key
+      self.graph_bonds = None
+      self.graph_species = list(species)
+      for s,z in zip(species, self.graph['atom']):
+        self.atomic_numbers[s] = z
+
+      # Converters with richer atom features than the atomic number, or with bond features depending on the species, cannot be reused
+      converter = type(self.model.graph_converter).__name__
+      self.graph_checked = converter in GEOMETRY_GRAPH_CONVERTERS
+      if list(self.graph['atom']) != [site.specie.Z for site in pymatgen_struct] or converter in SPECIES_GRAPH_CONVERTERS:
+        self.reuse_graph = False
+      if profiler is not None:
+        profiler.lap('graph', tick)
+      return self.graph
+
+    for s in set(species).difference(self.atomic_numbers):
+      from pymatgen.core.periodic_table import Element
+      self.atomic_numbers[s] = Element(s).Z
+
+    graph = self.graph.copy()
+    graph['atom'] = [self.atomic_numbers[s] for s in species]
+
+    if not self.graph_checked and list(species) != self.graph_species:
+      from pymatgen.core.structure import Structure
+      full = self.model.graph_converter.convert(Structure(lattice, species, positions))
+      self.graph_checked = True
+      if any(not np.array_equal(np.asarray(full[k]), np.asarray(graph[k])) for k in ('atom', 'bond', 'state', 'index1', 'index2')):
+        self.reuse_graph = False
+        graph = full
+
+    if profiler is not None:
+      profiler.lap('graph', tick)
+    return graph
+
 
   def predict_formation_energy ( self, lattice, species, positions ):
-    pymatgen_struct = Structure(lattice, species, positions)
-    return self.model.predict_structure(pymatgen_struct).ravel()[0]
+    graph = self.crystal_graph(lattice, species, positions)
+    if self.profiler is not None:
+      tick = self.profiler.now()
+    ene = self.model.predict_graph(graph).ravel()[0]
+    if self.profiler is not None:
+      self.profiler.lap('inference', tick)
+    return ene
+
+  def predict_many ( self, lattice, species_batch, positions ):
+    '''
+      Predict the formation energy of several species arrangements on a shared lattice and basis.
+      When the graph topology is reused, the batch is assembled directly from one copy of the
+      topology, with the bond features expanded once, and evaluated in a single forward pass.
+      Otherwise a graph is built for each arrangement and the graphs are evaluated together.
+
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        species_batch (list or ndarray): List of M species lists, or an MxN array, with one atomic symbol per site
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+
+      Returns:
+        (ndarray): M predicted energies, one for each species list
+    '''
+    if len(species_batch) == 0:
+      return np.zeros(0)
+    species = np.array(species_batch, dtype=object)
+
+    if self.reuse_graph and species.ndim == 2:
+      graph = self.crystal_graph(lattice, species[0].tolist(), positions)
+
+      # Check the reused topology with an arrangement other than the one it was built from
+      for row in species:
+        if self.graph_checked or not self.reuse_graph:
+          break
+        if row.tolist() != self.graph_species:
+          self.crystal_graph(lattice, row.tolist(), positions)
+
+      if self.reuse_graph:
+        return self._predict_batch(graph, species)
+
+    # MEGNet's batch generator does not apply the atom converter, so the features are converted here
+    graphs = [self.crystal_graph(lattice, list(s), positions) for s in species_batch]
+    graphs = [dict(g, atom=self._atom_features(g['atom'])) for g in graphs]
+    if self.profiler is not None:
+      tick = self.profiler.now()
+    enes = self.model.predict_graphs(graphs, batch_size=len(graphs)).ravel()
+    if self.profiler is not None:
+      self.profiler.lap('inference', tick)
+    return enes
+
+
+  def _atom_features ( self, atoms ):
+    '''
+      Convert atomic numbers to the model's atom features with the graph converter's atom converter, as in graph_to_input.
+    '''
+    atom_converter = getattr(self.model.graph_converter, 'atom_converter', None)
+    if atom_converter is None:
+      return np.asarray(atoms)
+    return np.asarray(atom_converter.convert(atoms))
+
+
+  def _predict_batch ( self, graph, species ):
+    '''
+      Evaluate several species arrangements on the topology of graph in one forward pass. The inputs
+      follow the layout of MEGNet's GraphBatchGenerator: atom, bond, and state features, bond indices
+      offset by the atoms of the preceding structures, and the structure index of each atom and bond.
+      The atom and bond features are converted as in the graph converter's graph_to_input.
+
+      Arguments:
+        graph (dict): MEGNet graph dictionary of the shared lattice and positions
+        species (ndarray): MxN array of atomic symbols
+
+      Returns:
+        (ndarray): M predicted energies
+    '''
+    profiler = self.profiler
+    if profiler is not None:
+      tick = profiler.now()
+
+    for s in set(species.ravel()).difference(self.atomic_numbers):
+      from pymatgen.core.periodic_table import Element
+      self.atomic_numbers[s] = Element(s).Z
+
+    # The bond features are expanded once for each topology
+    if self.graph_bonds is None:
+      bond_converter = getattr(self.model.graph_converter, 'bond_converter', None)
+      bonds = np.array(graph['bond'])
+      self.graph_bonds = bonds if bond_converter is None else bond_converter.convert(bonds)
+
+    nbatch,nat = species.shape
+    atoms = np.array(graph['atom'])
+    symbols,inverse = np.unique(species, return_inverse=True)
+    table = np.array([self.atomic_numbers[s] for s in symbols], dtype=atoms.dtype)
+    index1 = np.array(graph['index1'], dtype=np.int32)
+    index2 = np.array(graph['index2'], dtype=np.int32)
+    offset = nat * np.arange(nbatch, dtype=np.int32)[:,None]
+    state = np.array(graph['state'])
+
+    atoms = table[inverse.ravel()].reshape(nbatch*nat, *atoms.shape[1:])
+    inputs = [self._atom_features(atoms),
+              np.tile(self.graph_bonds, (nbatch,) + (1,)*(self.graph_bonds.ndim-1)),
+              np.tile(state, (nbatch,) + (1,)*(state.ndim-1)),
+              (index1[None,:] + offset).ravel(),
+              (index2[None,:] + offset).ravel(),
+              np.repeat(np.arange(nbatch, dtype=np.int32), nat),
+              np.repeat(np.arange(nbatch, dtype=np.int32), len(index1))]
+    inputs = [x[None,...] for x in inputs]
+    if profiler is not None:
+      tick = profiler.lap('graph', tick)
+
+    pred = self.model.predict(inputs, verbose=False)[0]
+    enes = np.array([self.model.target_scaler.inverse_transform(p, nat) for p in pred]).ravel()
+    if profiler is not None:
+      profiler.lap('inference', tick)
+    return enes
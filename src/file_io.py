@@ -1,6 +1,26 @@
+import numpy as np
+
+# Leading bytes of a binary swaps file, followed by records of swap_dtype
+SWAP_MAGIC = b'MCSPSSW1'
+swap_dtype = np.dtype([('step','<i8'), ('prev_accept','<i8'), ('temperature','<f8'), ('energy','<f8')])
 
 
 def read_swap_trajectory ( fname ):
+  '''
+    Read a swaps trajectory file, in either the text or binary format.
+
+    Arguments:
+      fname (str): File name of the trajectory
+
+    Returns:
+      (list,list,list,list): Step, steps since the previous accepted trial, temperature, and energy of each accepted trial
+  '''
+
+  with open(fname, 'rb') as f:
+    binary = f.read(len(SWAP_MAGIC)) == SWAP_MAGIC
+  if binary:
+    data = np.fromfile(fname, dtype=swap_dtype, offset=len(SWAP_MAGIC))
+    return data['step'].tolist(), data['prev_accept'].tolist(), data['temperature'].tolist(), data['energy'].tolist()
 
   inds,nswap,temps,enes = [],[],[],[]
   with open(fname, 'r') as f:
@@ -14,14 +34,338 @@ def read_swap_trajectory ( fname ):
   return inds, nswap, temps, enes
 
 
-def write_swap_accept ( fname,
-                        write_mode,
-                        step,
-                        prev_accept,
-                        temperature,
-                        energy,
-                        occupation_factors=None ):
+class SwapTrajectoryWriter:
+  '''
+    Writer for the swaps trajectory, which keeps the file open and buffers accepted trials.
+    The buffer is written when it holds buffer_size rows, when flush_interval seconds have
+    passed since the last write, and when the writer is closed. The most recent minimum
+    energy structure is written on the same schedule.
+  '''
+
+  def __init__ ( self, fname, mode='w', binary=False, buffer_size=1000, flush_interval=10. ):
+    '''
+      Arguments:
+        fname (str): File name for the trajectory output file
+        mode (str): 'w' to create a new file, or 'a' to append to an existing file
+        binary (bool): Write fixed-size binary records instead of text rows
+        buffer_size (int): Number of rows held before writing
+        flush_interval (float): Maximum time, in seconds, between writes
+    '''
+    from time import monotonic
+
+    self.fname = fname
+    self.binary = binary
+    self.buffer_size = buffer_size
+    self.flush_interval = flush_interval
+    self.rows = []
+    self.structure = None
+    self.last_flush = monotonic()
+
+    self.file = open(fname, mode+'b' if binary else mode)
+    if binary and self.file.tell() == 0:
+      self.file.write(SWAP_MAGIC)
+
+
+  def __enter__ ( self ):
+    return self
+
+
+  def __exit__ ( self, *args ):
+    self.close()
+
+
+  def write ( self, step, prev_accept, temperature, energy ):
+    '''
+      Record an accepted trial.
+
+      Arguments:
+        step (int): Iteration of the accepted trial
+        prev_accept (int): Number of iterations since the previous accepted trial
+        temperature (float): Temperature of the iteration
+        energy (float): Energy of the accepted configuration
+    '''
+    from time import monotonic
+
+    self.rows.append((step, prev_accept, temperature, energy))
+    if len(self.rows) >= self.buffer_size or monotonic()-self.last_flush >= self.flush_interval:
+      self.flush()
+
+
+  def write_structure ( self, fname, atoms ):
+    '''
+      Schedule a structure to be written, in the xyz format, at the next flush. A structure
+      scheduled later replaces one which has not been written yet.
+
+      Arguments:
+        fname (str): File name for the structure
+        atoms (Atoms): ASE Atoms object, which is copied
+    '''
+    self.structure = (fname, atoms.copy())
+
+
+  def flush ( self ):
+    '''
+      Write the buffered rows and any scheduled structure.
+    '''
+    from time import monotonic
+
+    if len(self.rows) > 0:
+      if self.binary:
+        self.file.write(np.array(self.rows, dtype=swap_dtype).tobytes())
+      else:
+        self.file.write(''.join(' '.join(map(str,row))+'\n' for row in self.rows))
+      self.rows = []
+    self.file.flush()
+
+    if self.structure is not None:
+      from ase.io import write
+      write(*self.structure)
+      self.structure = None
+
+    self.last_flush = monotonic()
+
+
+  def close ( self ):
+    '''
+      Flush and close the trajectory file.
+    '''
+    if not self.file.closed:
+      self.flush()
+      self.file.close()
+
+
+
+# Leading bytes of a configuration log, followed by the header length, a JSON header, and int32 records
+CONFIG_MAGIC = b'MCSPSCL1'
+
+
+class ConfigurationLogWriter:
+  '''
+    Compact log of every accepted configuration. The initial occupation of each site is stored once
+    in the header, and each accepted trial is recorded as the sites whose occupant changed:
+
+      [steps since the previous record, nchange, site_1, ..., site_nchange, code_1, ..., code_nchange]
+
+    as a stream of int32 values, where code is an index into the header symbols, or -1 for a vacant
+    site. Structures are reconstructed with replay_configurations.
+  '''
+
+  def __init__ ( self,
+                 fname,
+                 lattice,
+                 positions,
+                 species,
+                 fixed_species=None,
+                 fixed_positions=None,
+                 mode='w',
+                 last_step=0,
+                 buffer_size=10000,
+                 flush_interval=10. ):
+    '''
+      Arguments:
+        fname (str): File name for the configuration log
+        lattice (ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        positions (ndarray): Nx3 matrix, with the crystal 3-coordinate of each logged site
+        species (list): Initial atomic symbol, or None if vacant, of each logged site
+        fixed_species (list): Atomic symbols of framework sites, which are not logged but are included in replayed structures
+        fixed_positions (ndarray): Mx3 matrix, with the crystal 3-coordinate of each framework site
+        mode (str): 'w' to create a new log, or 'a' to append to an existing log written with the same species
+        last_step (int): Iteration of the last record in an existing log, when appending
+        buffer_size (int): Number of int32 values held before writing
+        flush_interval (float): Maximum time, in seconds, between writes
+    '''
+    from time import monotonic
+    import json
+
+    if fixed_species is None or fixed_positions is None:
+      fixed_species,fixed_positions = [],np.empty((0,3), dtype=float)
+
+    symbols = sorted(set(s for s in species if s is not None))
+    self.codes = {s:i for i,s in enumerate(symbols)}
+    self.codes[None] = -1
+    self.buffer_size = buffer_size
+    self.flush_interval = flush_interval
+    self.values = []
+    self.last_step = last_step
+    self.last_flush = monotonic()
+
+    if mode == 'a':
+      self.file = open(fname, 'ab')
+      return
+
+    header = {'symbols':symbols,
+              'lattice':np.asarray(lattice, dtype=float).tolist(),
+              'positions':np.asarray(positions, dtype=float).tolist(),
+              'occupation':[self.codes[s] for s in species],
+              'fixed_species':list(fixed_species),
+              'fixed_positions':np.asarray(fixed_positions, dtype=float).reshape(-1,3).tolist()}
+    header = json.dumps(header).encode()
+
+    self.file = open(fname, 'wb')
+    self.file.write(CONFIG_MAGIC)
+    self.file.write(np.uint64(len(header)).tobytes())
+    self.file.write(header)
+
+
+  def __enter__ ( self ):
+    return self
+
+
+  def __exit__ ( self, *args ):
+    self.close()
+
+
+  def write ( self, step, sites, species ):
+    '''
+      Record an accepted configuration by the sites whose occupant changed.
+
+      Arguments:
+        step (int): Iteration of the accepted trial
+        sites (list): Index of each changed site
+        species (list): New atomic symbol, or None if vacant, of each changed site
+    '''
+    from time import monotonic
+
+    self.values += [step-self.last_step, len(sites)]
+    self.values += list(sites)
+    self.values += [self.codes[s] for s in species]
+    self.last_step = step
+    if len(self.values) >= self.buffer_size or monotonic()-self.last_flush >= self.flush_interval:
+      self.flush()
+
+
+  def flush ( self ):
+    '''
+      Write the buffered records.
+    '''
+    from time import monotonic
+
+    if len(self.values) > 0:
+      self.file.write(np.array(self.values, dtype='<i4').tobytes())
+      self.values = []
+    self.file.flush()
+    self.last_flush = monotonic()
+
+
+  def close ( self ):
+    '''
+      Flush and close the configuration log.
+    '''
+    if not self.file.closed:
+      self.flush()
+      self.file.close()
+
+
+
+def read_configuration_log ( fname ):
+  '''
+    Read a configuration log written by ConfigurationLogWriter.
+
+    Arguments:
+      fname (str): File name of the configuration log
+
+    Returns:
+      (dict): Header, containing the symbols, lattice, logged site positions, initial occupation codes, and framework sites
+      (ndarray): Step of each record
+      (list): Changed site indices and new occupation codes of each record, as a pair of int32 arrays
+  '''
+  import json
+
+  with open(fname, 'rb') as f:
+    if f.read(len(CONFIG_MAGIC)) != CONFIG_MAGIC:
+      raise ValueError(f'{fname} is not a configuration log')
+    nheader = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+    header = json.loads(f.read(nheader).decode())
+    data = np.frombuffer(f.read(), dtype='<i4')
+
+  # Records written by an interrupted run may be incomplete
+  steps,changes = [],[]
+  i,step = 0,0
+  while i+2 <= len(data) and i+2+2*data[i+1] <= len(data):
+    n = data[i+1]
+    step += int(data[i])
+    steps.append(step)
+    changes.append((data[i+2:i+2+n], data[i+2+n:i+2+2*n]))
+    i += 2 + 2*n
+
+  return header, np.array(steps, dtype=np.int64), changes
+
+
+
+def replay_configurations ( fname, steps=None ):
+  '''
+    Reconstruct structures from a configuration log.
+
+    Arguments:
+      fname (str): File name of the configuration log
+      steps (list): Iterations at which to reconstruct the structure, which is the configuration last accepted at or before each iteration. If None, every accepted configuration is reconstructed.
+
+    Returns:
+      (generator): Yields the iteration and an ASE Atoms object for each requested structure. Framework sites come first, followed by the occupied logged sites in site order.
+  '''
+  from ase import Atoms
+
+  header,rec_steps,changes = read_configuration_log(fname)
+  symbols = np.array(header['symbols'] + [None], dtype=object)
+  lattice = np.array(header['lattice'])
+  positions = np.array(header['positions']).reshape(-1,3)
+  fixed_species = header['fixed_species']
+  fixed_positions = np.array(header['fixed_positions']).reshape(-1,3)
+  occupation = np.array(header['occupation'], dtype=np.int32)
+
+  def structure ( ):
+    occupied = np.flatnonzero(occupation >= 0)
+    spec = fixed_species + list(symbols[occupation[occupied]])
+    pos = np.concatenate([fixed_positions, positions[occupied]])
+    return Atoms(spec, positions=pos@lattice, cell=lattice, pbc=[1,1,1])
+
+  if steps is None:
+    yield 0, structure()
+    for step,(sites,codes) in zip(rec_steps, changes):
+      occupation[sites] = codes
+      yield int(step), structure()
+    return
+
+  # Apply records up to each requested iteration, in increasing order
+  k = 0
+  for step in sorted(steps):
+    while k < len(rec_steps) and rec_steps[k] <= step:
+      sites,codes = changes[k]
+      occupation[sites] = codes
+      k += 1
+    yield step, structure()
+
+
+
+def write_checkpoint ( fname, checkpoint ):
+  '''
+    Atomically write a checkpoint. The checkpoint is written to a temporary file which then
+    replaces fname, so an interruption leaves the previous checkpoint intact.
+
+    Arguments:
+      fname (str): File name of the checkpoint
+      checkpoint (dict): Picklable trajectory state
+  '''
+  from os import fsync, replace
+  import pickle
+
+  with open(fname+'.tmp', 'wb') as f:
+    pickle.dump(checkpoint, f)
+    f.flush()
+    fsync(f.fileno())
+  replace(fname+'.tmp', fname)
+
+
+
+def read_checkpoint ( fname ):
+  '''
+    Arguments:
+      fname (str): File name of the checkpoint
+
+    Returns:
+      (dict): Trajectory state written by write_checkpoint
+  '''
+  import pickle
 
-  with open(fname, write_mode) as f:
-    if occupation_factors is None:
-      f.write(' '.join(map(str,[step, prev_accept, temperature, energy]))+'\n')
+  with open(fname, 'rb') as f:
+    return pickle.load(f)
@@ -1,7 +1,10 @@
 import numpy as np
 
+# Boltzmann const in eV
+kB = 1.68e-23/1.602e-19
 
-def sps_swap ( species:list, nfixed=0, nswaps=1 ) -> dict:
+
+def sps_swap ( species:list, nfixed=0, nswaps=1, return_pairs=False ) -> dict:
   '''
     Interchange pairs in a list, stochastically
 
@@ -9,13 +12,16 @@ def sps_swap ( species:list, nfixed=0, nswaps=1 ) -> dict:
       species (list): The list of elements to interchange
       nfixed (int): The number of elements to remain fixed, which must be placed at the beginning of the list
       nswaps (int): The number of swaps to perform
+      return_pairs (bool): Also return the interchanged index pairs
 
     Returns:
       (list): The resulting list with elements exchanged
+      (list,list): The resulting list and the (i,j) index pairs, in the order they were interchanged, if return_pairs is True
   '''
 
   nat = len(species)
   t_species = species.copy()
+  pairs = []
 
   for _ in range(nswaps):
 
@@ -26,11 +32,453 @@ def sps_swap ( species:list, nfixed=0, nswaps=1 ) -> dict:
       ri2 = np.random.randint(nfixed, nat)
 
     t_species[ri1],t_species[ri2] = t_species[ri2],t_species[ri1]
+    pairs.append((ri1,ri2))
 
+  if return_pairs:
+    return t_species,pairs
   return t_species
 
 
 
+def sps_apply ( species, pairs ):
+  '''
+    Interchange the given pairs of a list, in order
+
+    Arguments:
+      species (list): The list of elements to interchange
+      pairs (list): The (i,j) index pairs to interchange
+
+    Returns:
+      (list): The resulting list with elements exchanged
+  '''
+
+  t_species = species.copy()
+  for i,j in pairs:
+    t_species[i],t_species[j] = t_species[j],t_species[i]
+  return t_species
+
+
+
+def _metropolis ( dE, temp ):
+  '''
+    Metropolis condition for a trial with energy change dE at temperature temp.
+  '''
+  boltz = False if temp==0 else np.exp(-dE/(kB*temp)) > np.random.rand()
+  return dE < 0 or boltz
+
+
+
+def _predict_energies ( calculator, lattice, species_batch, positions, cache=None, occupations=None, symbols=None ):
+  '''
+    Predict the energies of several species arrangements, evaluating only those absent from the cache.
+
+    Arguments:
+      calculator (Calculator): Calculator for evaluating the structure energy
+      lattice (ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+      species_batch (list): List of species lists to evaluate
+      positions (ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+      cache (EnergyCache): Cache of previously evaluated configurations
+      occupations (list): Integer species array of each configuration, used for the cache keys in place of the species lists
+      symbols (list): Atomic symbol of each integer species index in occupations
+
+    Returns:
+      (list): Energy of each species arrangement
+  '''
+
+  enes = [None] * len(species_batch)
+  if cache is not None:
+    keys = [cache.key(s) for s in species_batch] if occupations is None else [cache.key(o, symbols) for o in occupations]
+    enes = [cache.get(k) for k in keys]
+
+  todo = [i for i,e in enumerate(enes) if e is None]
+  if len(todo) == 1:
+    enes[todo[0]] = calculator.predict_formation_energy(lattice, species_batch[todo[0]], positions)
+  elif len(todo) > 1:
+    t_enes = calculator.predict_many(lattice, [species_batch[i] for i in todo], positions)
+    for i,e in zip(todo, t_enes):
+      enes[i] = e
+
+  if cache is not None:
+    for i in todo:
+      cache.put(keys[i], enes[i])
+
+  return enes
+
+
+
+def _init_cache ( cache ):
+  '''
+    Interpret the cache argument of the SPS routines, which may be None, a maximum number of entries, or an EnergyCache.
+  '''
+  from .cache import EnergyCache
+
+  if cache is None or isinstance(cache, EnergyCache):
+    return cache
+  return EnergyCache(max_entries=cache)
+
+
+
+def _load_checkpoint ( fname, resume, nsite, ntemp ):
+  '''
+    Read the checkpoint to resume from, or return None to start a new trajectory.
+  '''
+  from .file_io import read_checkpoint
+  from os.path import isfile
+
+  if not resume:
+    return None
+  if fname is None:
+    raise ValueError('checkpoint_fname must be provided to resume a trajectory')
+  if not isfile(fname):
+    return None
+
+  checkpoint = read_checkpoint(fname)
+  if checkpoint['nsite'] != nsite or checkpoint['ntemp'] != ntemp:
+    raise ValueError(f'Checkpoint {fname} does not match the provided sites and temperatures')
+  return checkpoint
+
+
+
+def _save_checkpoint ( fname, checkpoint, writers ):
+  '''
+    Flush the output files and atomically write a checkpoint, which records the state of the
+    random number generator and the length of each output file.
+
+    Arguments:
+      fname (str): File name of the checkpoint
+      checkpoint (dict): Picklable trajectory state
+      writers (list): SwapTrajectoryWriter, ConfigurationLogWriter, or ObservableAccumulator for each output file, or None
+  '''
+  from .file_io import write_checkpoint
+  from os import fsync
+
+  sizes = []
+  for w in writers:
+    if w is None or w.file is None:
+      sizes.append(None)
+      continue
+    w.flush()
+    fsync(w.file.fileno())
+    sizes.append(w.file.tell())
+
+  write_checkpoint(fname, dict(checkpoint, rng=np.random.get_state(), file_sizes=sizes))
+
+
+
+def _truncate_outputs ( fnames, sizes ):
+  '''
+    Discard output written after a checkpoint, which the resumed trajectory writes again.
+  '''
+  from os import truncate
+
+  for fname,size in zip(fnames, sizes):
+    if fname is not None and size is not None:
+      truncate(fname, size)
+
+
+
+def _sps_fixed_steps ( state,
+                        temp,
+                        nstep,
+                        lattice,
+                        positions,
+                        calculator,
+                        nfixed = 0,
+                        nswap = 2,
+                        nswap_inc = 1000,
+                        writer = None,
+                        emin_fname = None,
+                        write_atoms = None,
+                        batch_size = 1,
+                        cache = None,
+                        surrogate = None,
+                        stop = None,
+                        config_log = None,
+                        observables = None,
+                        schedule = None,
+                        profiler = None ):
+  '''
+    Advance a fixed-basis trajectory by nstep iterations at a single temperature.
+
+    Arguments:
+      state (dict): Trajectory state, updated in place. Contains the current species list and energy (species, ene), the minimum energy and its species list (emin, emin_species), the iteration count (itr), the iteration of the last accepted trial (last_swap_i), the current number of swaps per trial (nswap), and the SitePools of the current configuration (pools).
+      temp (float): Temperature of the Metropolis condition
+      nstep (int): Number of trial configurations to test
+      nswap (int): Number of swaps per trial restored after each accepted trial
+      writer (SwapTrajectoryWriter): Writer for the trajectory output file
+      write_atoms (Atoms): ASE Atoms object used to write the minimum energy structure to emin_fname
+      surrogate (Calculator): Inexpensive calculator with predict_delta, add_sample, and a fitted attribute, such as ClusterExpansionCalculator
+      config_log (ConfigurationLogWriter): Log of the sites changed by each accepted trial
+      observables (ObservableAccumulator): Accumulator of thermodynamic averages, which records every iteration
+      schedule (AdaptiveSchedule): Controller of the swaps per trial and iterations per temperature, which records every iteration
+      profiler (PhaseProfiler): Profiler charged with the time of each phase of the iterations
+
+      The remaining arguments are described in sps_fixed.
+
+    Returns:
+      (bool): True if the stop condition has been met
+  '''
+  # Proposals work on the integer species of the site pools. The symbol list is kept for calculators.
+  pools = state['pools']
+  species,ene,emin = list(state['species']),state['ene'],state['emin']
+  emin_species = state.get('emin_species')
+  itr,last_swap_i = state['itr'],state['last_swap_i']
+  nat = len(species)
+  sswap = nswap
+  nswap = state['nswap']
+  halt = False
+
+  while nstep > 0 and not halt:
+    if profiler is not None:
+      tick = profiler.now()
+
+    # Propose a batch of trial configurations from the current configuration
+    trials,pairs = [],[]
+    for _ in range(min(batch_size, nstep)):
+      rswap = 1 + np.random.randint(min(nat-nfixed, nswap))
+      t_pairs = pools.propose(rswap)
+      trials.append(pools.apply(t_pairs))
+      pairs.append(t_pairs)
+    if profiler is not None:
+      tick = profiler.lap('propose', tick)
+
+    # Screen the trials with the surrogate energy change. Only trials passing the screen are evaluated.
+    screen = surrogate is not None and surrogate.fitted
+    s_dEs = len(trials) * [0]
+    if screen:
+      s_dEs = [surrogate.predict_delta(lattice, species, positions, p, ene) for p in pairs]
+    evaluate = [k for k,s_dE in enumerate(s_dEs) if not screen or _metropolis(s_dE, temp)]
+    if profiler is not None and screen:
+      tick = profiler.lap('surrogate', tick)
+
+    # Calculators with a local energy change evaluate each trial from the swapped pairs alone.
+    # Otherwise, species lists are only built for the evaluated trials.
+    t_enes = len(trials) * [None]
+    if getattr(calculator, 'local_delta', False):
+      e_enes = [ene + calculator.predict_delta(lattice, species, positions, pairs[k], ene) for k in evaluate]
+    else:
+      e_species = [sps_apply(species, pairs[k]) for k in evaluate]
+      e_enes = _predict_energies(calculator, lattice, e_species, positions, cache, [trials[k] for k in evaluate], pools.symbols)
+    if profiler is not None:
+      tick = profiler.lap('evaluate', tick)
+    for k,t_ene in zip(evaluate, e_enes):
+      t_enes[k] = t_ene
+      if surrogate is not None:
+        surrogate.add_sample(pools.decode(trials[k]), t_ene)
+    if profiler is not None and surrogate is not None:
+      tick = profiler.lap('surrogate', tick)
+
+    # Test the trials in order. Each tested trial is one iteration of the trajectory.
+    for t_codes,t_pairs,t_ene,s_dE in zip(trials, pairs, t_enes, s_dEs):
+      itr += 1
+      nstep -= 1
+
+      # Screened trials pass a second Metropolis condition on the surrogate error, which preserves detailed balance
+      if t_ene is None:
+        accept = False
+      elif screen and temp != 0:
+        accept = _metropolis(t_ene-ene-s_dE, temp)
+      else:
+        accept = _metropolis(t_ene-ene, temp)
+
+      # Accept condition
+      changed = ((),())
+      if accept:
+        if config_log is not None or observables is not None:
+          sites = np.unique(t_pairs)
+          sites = sites[t_codes[sites] != pools.species[sites]]
+          changed = (sites.tolist(), pools.decode(t_codes[sites]))
+        if profiler is not None:
+          tick = profiler.lap('metropolis', tick)
+        writer.write(itr, itr-last_swap_i, temp, t_ene)
+        if config_log is not None:
+          config_log.write(itr, *changed)
+        if profiler is not None:
+          tick = profiler.lap('output', tick)
+        for i,j in t_pairs:
+          pools.swap(i, j)
+          species[i],species[j] = species[j],species[i]
+        ene = t_ene
+        nswap = sswap
+        last_swap_i = itr
+        if ene < emin:
+          emin = ene
+          emin_species = list(species)
+          if emin_fname is not None:
+            write_atoms.set_chemical_symbols(species)
+            writer.write_structure(emin_fname, write_atoms)
+
+      else:
+        if (itr-last_swap_i) % nswap_inc == 0:
+          nswap += 1
+
+      if profiler is not None:
+        tick = profiler.lap('metropolis', tick)
+      if observables is not None:
+        observables.step(temp, ene, accept, *changed)
+      if schedule is not None:
+        schedule.record(ene, accept)
+      if profiler is not None and (observables is not None or schedule is not None):
+        tick = profiler.lap('observables', tick)
+
+      if stop is not None:
+        if ene <= stop:
+          halt = True
+          break
+
+      # The remaining trials were proposed from the previous configuration
+      if last_swap_i == itr:
+        break
+
+  state.update(species=species, ene=ene, emin=emin, emin_species=emin_species, itr=itr, last_swap_i=last_swap_i, nswap=nswap)
+  return halt
+
+
+
+def _swap_energies ( pools, pairs, species, ene, lattice, positions, calculator, batch_size=1, cache=None ):
+  '''
+    Energy after each of several single swaps from the current configuration. Calculators with
+    local_delta evaluate the swaps with predict_deltas, and others in batches of batch_size configurations.
+
+    Arguments:
+      pools (SitePools): Site pools of the current configuration
+      pairs (ndarray): Kx2 site index pairs, each interchanged separately
+      species (list): Atomic symbol of each site of the current configuration
+      ene (float): Energy of the current configuration
+
+    Returns:
+      (ndarray): Energy of the configuration after each swap
+  '''
+  if getattr(calculator, 'local_delta', False):
+    return ene + calculator.predict_deltas(lattice, species, positions, pairs, ene)
+
+  enes = np.empty(len(pairs))
+  for start in range(0, len(pairs), batch_size):
+    block = pairs[start:start+batch_size]
+    e_species = [sps_apply(species, [p]) for p in block]
+    enes[start:start+len(block)] = _predict_energies(calculator, lattice, e_species, positions, cache,
+                                                     [pools.apply([p]) for p in block], pools.symbols)
+  return enes
+
+
+
+def _sps_nfold_steps ( state,
+                        temp,
+                        nstep,
+                        lattice,
+                        positions,
+                        calculator,
+                        writer = None,
+                        emin_fname = None,
+                        write_atoms = None,
+                        batch_size = 1,
+                        cache = None,
+                        stop = None,
+                        config_log = None,
+                        observables = None,
+                        schedule = None,
+                        profiler = None ):
+  '''
+    Advance a fixed-basis trajectory by nstep iterations at a single temperature without rejected trials
+    (n-fold way). The energy change of every single swap from the current configuration is evaluated,
+    and one is accepted with probability proportional to its rate, the probability that a single swap
+    trial proposes and accepts it. The iteration count advances by the number of trials up to and
+    including the accepted one, drawn from the geometric distribution with the total rate, so the
+    trajectory is distributed as one with nswap fixed at 1.
+
+    Arguments:
+      state (dict): Trajectory state, updated in place, as in _sps_fixed_steps. The energies of the swaps from the current configuration are kept in deltas, with the iteration of the last accepted trial.
+
+      The remaining arguments are described in _sps_fixed_steps and sps_fixed.
+
+    Returns:
+      (bool): True if the stop condition has been met
+  '''
+  pools = state['pools']
+  species,ene,emin = list(state['species']),state['ene'],state['emin']
+  emin_species = state.get('emin_species')
+  itr,last_swap_i = state['itr'],state['last_swap_i']
+  halt = False
+
+  while nstep > 0 and not halt:
+    if profiler is not None:
+      tick = profiler.now()
+
+    # Energy of every single swap from the current configuration, evaluated once per configuration
+    if state.get('deltas') is None or state['deltas'][0] != last_swap_i:
+      pairs,prob = pools.candidates()
+      enes = _swap_energies(pools, pairs, species, ene, lattice, positions, calculator, batch_size, cache)
+      state['deltas'] = (last_swap_i, pairs, prob, enes)
+      if profiler is not None:
+        tick = profiler.lap('evaluate', tick)
+    _,pairs,prob,enes = state['deltas']
+
+    # Rate of each swap, the probability that a single trial proposes and accepts it
+    dE = enes - ene
+    if temp == 0:
+      rates = prob * (dE < 0)
+    else:
+      rates = prob * np.exp(-np.maximum(dE, 0)/(kB*temp))
+    total = min(rates.sum(), 1.)
+
+    # Trials until the next acceptance. Without an acceptance in the remaining iterations, the
+    # configuration persists, and the trials of the next block are drawn anew.
+    gap = np.random.geometric(total) if total > 0 else nstep+1
+    if gap > nstep:
+      itr += nstep
+      if observables is not None:
+        observables.step(temp, ene, False, iterations=nstep)
+      if schedule is not None:
+        schedule.record(ene, False, nstep)
+      nstep = 0
+      if profiler is not None:
+        tick = profiler.lap('metropolis', tick)
+      break
+
+    cum = np.cumsum(rates)
+    k = min(np.searchsorted(cum, np.random.random()*cum[-1], side='right'), len(cum)-1)
+    i,j = pairs[k]
+    t_ene = enes[k]
+    itr += gap
+    nstep -= gap
+    if schedule is not None and gap > 1:
+      schedule.record(ene, False, gap-1)
+    if profiler is not None:
+      tick = profiler.lap('metropolis', tick)
+
+    sites = sorted((int(i), int(j)))
+    changed = (sites, pools.decode(pools.species[sites[::-1]]))
+    writer.write(itr, itr-last_swap_i, temp, t_ene)
+    if config_log is not None:
+      config_log.write(itr, *changed)
+    if profiler is not None:
+      tick = profiler.lap('output', tick)
+    pools.swap(i, j)
+    species[i],species[j] = species[j],species[i]
+    ene = t_ene
+    last_swap_i = itr
+    if ene < emin:
+      emin = ene
+      emin_species = list(species)
+      if emin_fname is not None:
+        write_atoms.set_chemical_symbols(species)
+        writer.write_structure(emin_fname, write_atoms)
+
+    if observables is not None:
+      observables.step(temp, ene, True, *changed, iterations=gap)
+    if schedule is not None:
+      schedule.record(ene, True)
+    if profiler is not None and (observables is not None or schedule is not None):
+      tick = profiler.lap('observables', tick)
+
+    if stop is not None and ene <= stop:
+      halt = True
+
+  state.update(species=species, ene=ene, emin=emin, emin_species=emin_species, itr=itr, last_swap_i=last_swap_i)
+  return halt
+
+
+
 def sps_fixed ( lattice,
                 species,
                 positions,
@@ -42,7 +490,23 @@ def sps_fixed ( lattice,
                 swap_fname = 'swaps.out',
                 emin_fname = 'structure.emin.xyz',
                 calculator = None,
-                stop=None ):
+                stop=None,
+                batch_size = 1,
+                cache = None,
+                surrogate = None,
+                swap_binary = False,
+                flush_interval = 10.,
+                config_fname = None,
+                checkpoint_fname = None,
+                checkpoint_interval = 1000,
+                resume = False,
+                observables = None,
+                schedule = None,
+                profiler = None,
+                sublattices = None,
+                sublattice_weights = None,
+                rejection_free = None,
+                polish = False ):
   '''
     Perform the SPS routine on a fixed atomic basis without vacant sites.
 
@@ -57,25 +521,40 @@ def sps_fixed ( lattice,
       nswap_inc (int): Number of rejected trial configurations performed before increasing nswap.
       swap_fname (str): File name for the trajectory output file.
       emin_filename (str): File name for the minimum energy structure, output in the xyz format.
-      calculator (str): Calculator for evaluating the structure energy.
+      calculator (Calculator): Calculator for evaluating the structure energy. Calculators with local_delta set evaluate each trial from the energy change of the swapped sites, without the cache.
       stop (float): Terminate the trial if the predicted structure energy is at or below the provided stop value.
+      batch_size (int): Number of trial configurations proposed from the current state and evaluated in a single calculator call. Trials are tested in order, and those remaining after an accepted trial are discarded, as they were proposed from a stale configuration.
+      cache (int or EnergyCache): Cache of configuration energies, or the maximum number of entries for a new cache. Revisited configurations are not reevaluated. An EnergyCache built with a SiteSymmetry also merges symmetry-equivalent configurations. Cache statistics are printed at the end of the run.
+      surrogate (ClusterExpansionCalculator): Inexpensive surrogate energy, fit during the run to the energies from calculator. Once fit, trials are first screened with the surrogate energy change and only those passing are evaluated with calculator. A second Metropolis condition on the surrogate error keeps the sampling exact (delayed acceptance).
+      swap_binary (bool): Write the trajectory output file as binary records rather than text. Both formats are read by file_io.read_swap_trajectory.
+      flush_interval (float): Maximum time, in seconds, that accepted trials and the minimum energy structure are buffered before being written.
+      config_fname (str): File name for a log of every accepted configuration, recorded as the sites changed by each accepted trial. Structures at any iteration are reconstructed with file_io.replay_configurations.
+      checkpoint_fname (str): File name for periodic checkpoints of the complete trajectory state, including the random number generator and the surrogate. The checkpoint is replaced atomically every checkpoint_interval iterations.
+      checkpoint_interval (int): Number of iterations between checkpoints. Each temperature is advanced in blocks of this length, so a resumed trajectory is identical to an uninterrupted one with the same checkpoint_interval.
+      resume (bool): Continue from checkpoint_fname if it exists, truncating the output files to their length at the checkpoint. Otherwise, a new trajectory is started.
+      observables (ObservableAccumulator): Accumulator of the energy moments, heat capacity, acceptance rate, and short-range order at each temperature, updated at every iteration. It is stored in checkpoints and restored on resume.
+      schedule (AdaptiveSchedule): Adaptive controller of the annealing. Each temperature is advanced in blocks, after which the number of swaps per trial is tuned toward a target acceptance rate, replacing nswap and resetting the count increased by nswap_inc. temp_swaps then gives the nominal iterations at each temperature, which are ended early once the energy is equilibrated and extended near a heat capacity peak, without exceeding the nominal total. It is stored in checkpoints, and its summary is printed at the end of the run.
+      profiler (PhaseProfiler): Profiler recording the time spent proposing, screening with the surrogate, evaluating (including the calculator's own phases), testing, writing output, accumulating observables, and checkpointing, and the iterations per second at each temperature. Its summary is reported periodically and at the end of the run.
+      sublattices (list): Sublattice label of each site, such as the Wyckoff position or the ion type. Swaps only interchange sites of the same sublattice, so that proposals which are never physically allowed are not evaluated. Sublattices occupied by a single species are left unchanged. By default, all sites after the first nfixed form one sublattice.
+      sublattice_weights (dict): Relative frequency of swaps on each sublattice, by label. Defaults to the number of swappable sites of each sublattice, so that every swappable site is drawn with equal probability.
+      rejection_free (float): Temperature at or below which the trajectory advances without rejected trials (n-fold way), for low temperatures where nearly every trial is rejected, such as 0 for a final quench or np.inf for every temperature. The energy change of every single swap from the current configuration is evaluated, in predict_deltas calls for calculators with local_delta, or otherwise in batches of batch_size configurations, and one swap is accepted with probability proportional to its rate. The iteration count advances by the number of trials that would precede the acceptance, drawn from the geometric distribution, so the trajectory is distributed as the standard trajectory with a single swap per trial. nswap and nswap_inc are unused, and surrogate is not supported.
+      polish (bool): After the last temperature, descend from the minimum energy structure with sps_polish, taking the best improving single swap until none remains. The polished structure is written to emin_fname, and a summary is printed.
   '''
-  from .file_io import write_swap_accept
+  from .file_io import ConfigurationLogWriter, SwapTrajectoryWriter
+  from .sites import SitePools
+  from time import perf_counter
   from os.path import isfile
-  from ase.io import write
-  from ase import Atoms
-
-  # Boltzmann const in eV
-  kB = 1.68e-23/1.602e-19
 
   # Trajectory variables and structure information
   itr = 0
   last_swap_i = 0
-  sswap = nswap
   nat = len(species)
   lattice = np.array(lattice)
   positions = np.array(positions)
-  write_atoms = Atoms(species, positions=positions@lattice, cell=lattice, pbc=[1,1,1])
+  write_atoms = None
+  if emin_fname is not None:
+    from ase import Atoms
+    write_atoms = Atoms(species, positions=positions@lattice, cell=lattice, pbc=[1,1,1])
 
   # Verify that the input arrays have appropriate dimensions
   if len(lattice.shape) != 2 or not (lattice.shape[0] == 3 and lattice.shape[1] == 3):
@@ -86,6 +565,12 @@ def sps_fixed ( lattice,
     raise ValueError(f'Cannot fix {nfixed} of {nat} sites. Decrease {nfixed} or provide more sites.')
   if len(set(species)) <= 1:
     raise ValueError('Species list must contain more than one type of species')
+  if batch_size < 1:
+    raise ValueError('batch_size must be a positive integer')
+  if rejection_free is not None and surrogate is not None:
+    raise ValueError('Surrogate screening is not supported with rejection_free')
+  pools = SitePools(species, nfixed, sublattices=sublattices, weights=sublattice_weights)
+  nfree = int(pools.sub_counts[pools.weights > 0].sum())
 
   # If the number of swaps per temperature is undefined, assign each to 1
   if len(temp_swaps) == 0:
@@ -98,45 +583,196 @@ def sps_fixed ( lattice,
     from .calculators import MEGNet_Calculator
     calculator = MEGNet_Calculator()
 
-  ene = emin = calculator.predict_formation_energy(lattice, species, positions)
+  cache = _init_cache(cache)
+  checkpoint = _load_checkpoint(checkpoint_fname, resume, nat, len(temperatures))
 
-  # Initialize the swaps output file. Exit if the file exists already.
-  if isfile(swap_fname):
-    raise FileExistsError(f'File {swap_fname} already exists. Will not overwrite.')
-  write_swap_accept(swap_fname, 'w', itr, itr-last_swap_i, temperatures[0], ene)
+  if checkpoint is None:
+    ene = emin = _predict_energies(calculator, lattice, [species], positions, cache, [pools.species], pools.symbols)[0]
+    if surrogate is not None:
+      surrogate.add_sample(species, ene)
+    if observables is not None:
+      observables.begin(species, ene)
 
-  # Trajectory iteration
-  for i,temp in enumerate(temperatures):
-    for _ in range(temp_swaps[i]):
-      itr += 1
+    # Initialize the swaps output file. Exit if the file exists already.
+    if isfile(swap_fname):
+      raise FileExistsError(f'File {swap_fname} already exists. Will not overwrite.')
+    writer = SwapTrajectoryWriter(swap_fname, 'w', binary=swap_binary, flush_interval=flush_interval)
+    writer.write(itr, itr-last_swap_i, temperatures[0], ene)
+    config_log = None
+    if config_fname is not None:
+      config_log = ConfigurationLogWriter(config_fname, lattice, positions, species, flush_interval=flush_interval)
 
-      rswap = 1 + np.random.randint(np.min((nat-nfixed,nswap)))
-      t_species = sps_swap(species, nfixed=nfixed, nswaps=rswap)
-      t_ene = calculator.predict_formation_energy(lattice, t_species, positions)
+    # Trajectory state, updated in place by each block of iterations
+    state = {'species':species, 'pools':pools, 'ene':ene, 'emin':emin, 'emin_species':list(species), 'itr':itr,
+             'last_swap_i':last_swap_i, 'nswap':nswap,
+             'temp_index':0, 'temp_step':0}
 
-      dE = t_ene - ene
-      boltz = False if temp==0 else np.exp(-dE/(kB*temp)) > np.random.rand()
+  else:
+    # Continue the output files from their length at the checkpoint
+    state = checkpoint['state']
+    _truncate_outputs([swap_fname, config_fname, None if observables is None else observables.fname], checkpoint['file_sizes'])
+    if surrogate is not None and checkpoint.get('surrogate') is not None:
+      surrogate.__dict__.update(checkpoint['surrogate'].__dict__)
+    elif surrogate is not None:
+      raise ValueError(f'Checkpoint {checkpoint_fname} was written without a surrogate')
+    elif checkpoint.get('surrogate') is not None:
+      raise ValueError(f'Checkpoint {checkpoint_fname} was written with a surrogate, which must be provided to resume')
+    if observables is not None and checkpoint.get('observables') is not None:
+      observables.__dict__.update(checkpoint['observables'].__dict__)
+      observables.open()
+    elif observables is not None:
+      observables.begin(state['species'], state['ene'])
+    if schedule is not None and checkpoint.get('schedule') is not None:
+      schedule.__dict__.update(checkpoint['schedule'].__dict__)
+    elif schedule is not None:
+      raise ValueError(f'Checkpoint {checkpoint_fname} was written without a schedule')
+    writer = SwapTrajectoryWriter(swap_fname, 'a', binary=swap_binary, flush_interval=flush_interval)
+    config_log = None
+    if config_fname is not None:
+      config_log = ConfigurationLogWriter(config_fname, lattice, positions, species, mode='a',
+                                          last_step=state['last_swap_i'], flush_interval=flush_interval)
+    np.random.set_state(checkpoint['rng'])
 
-      # Accept condition
-      if dE < 0 or boltz:
-        write_swap_accept(swap_fname, 'a', itr, itr-last_swap_i, temp, t_ene)
-        ene = t_ene
-        nswap = sswap
-        last_swap_i = itr
-        species = t_species
-        if ene < emin:
-          emin = ene
-          if emin_fname is not None:
-            write_atoms.set_chemical_symbols(species)
-            write(emin_fname, write_atoms)
+  def save_checkpoint ( ):
+    if profiler is not None:
+      tick = profiler.now()
+    _save_checkpoint(checkpoint_fname, {'state':state, 'surrogate':surrogate, 'observables':observables, 'schedule':schedule,
+                                        'nsite':nat, 'ntemp':len(temperatures)}, [writer, config_log, observables])
+    if profiler is not None:
+      profiler.lap('checkpoint', tick)
 
-      else:
-        if (itr-last_swap_i) % nswap_inc == 0:
-          nswap += 1
+  # The calculator records its own phases with the profiler
+  calculator_profiler = getattr(calculator, 'profiler', None)
+  if profiler is not None and hasattr(calculator, 'profiler'):
+    calculator.profiler = profiler
 
-      if stop is not None:
-        if ene <= stop:
+  try:
+    if checkpoint is None and checkpoint_fname is not None:
+      save_checkpoint()
+
+    # Trajectory iteration. With checkpointing, each temperature is advanced in blocks of checkpoint_interval iterations.
+    # The adaptive schedule further divides each temperature into its own blocks, and may change the number of iterations.
+    for i in range(state['temp_index'], len(temperatures)):
+      state['temp_index'] = i
+      if schedule is not None and state['temp_step'] == 0:
+        schedule.begin(temperatures[i], temp_swaps[i], nswap, nfree)
+        state['nswap'] = schedule.nswap
+      while state['temp_step'] < (temp_swaps[i] if schedule is None else schedule.limit):
+        nstep = (temp_swaps[i] if schedule is None else schedule.limit) - state['temp_step']
+        if checkpoint_fname is not None:
+          nstep = min(nstep, checkpoint_interval - state['temp_step'] % checkpoint_interval)
+        if schedule is not None:
+          nstep = min(nstep, schedule.block - state['temp_step'] % schedule.block)
+        start = perf_counter()
+        if rejection_free is not None and temperatures[i] <= rejection_free:
+          halt = _sps_nfold_steps(state, temperatures[i], nstep, lattice, positions, calculator,
+                                  writer=writer, emin_fname=emin_fname, write_atoms=write_atoms,
+                                  batch_size=batch_size, cache=cache, stop=stop, config_log=config_log,
+                                  observables=observables, schedule=schedule, profiler=profiler)
+        else:
+          halt = _sps_fixed_steps(state, temperatures[i], nstep, lattice, positions, calculator,
+                                  nfixed=nfixed, nswap=nswap if schedule is None else schedule.nswap,
+                                  nswap_inc=nswap_inc, writer=writer, emin_fname=emin_fname,
+                                  write_atoms=write_atoms, batch_size=batch_size, cache=cache,
+                                  surrogate=surrogate, stop=stop, config_log=config_log,
+                                  observables=observables, schedule=schedule, profiler=profiler)
+        if profiler is not None:
+          profiler.advance(temperatures[i], nstep, perf_counter()-start)
+        if halt:
           return
+        state['temp_step'] += nstep
+        if schedule is not None and (state['temp_step'] % schedule.block == 0 or state['temp_step'] >= schedule.limit):
+          schedule.update()
+          state['nswap'] = schedule.nswap
+        if checkpoint_fname is not None:
+          save_checkpoint()
+      state['temp_step'] = 0
+
+    # Certify a local minimum from the best structure of the trajectory
+    if polish:
+      best = state.get('emin_species') or state['species']
+      p_species,p_ene,p_swaps = sps_polish(lattice, best, positions, calculator, nfixed=nfixed, batch_size=batch_size,
+                                           cache=cache, sublattices=sublattices, sublattice_weights=sublattice_weights)
+      print(f'Polished the minimum energy structure with {p_swaps} swaps, from {state["emin"]} to {p_ene}')
+      if emin_fname is not None:
+        write_atoms.set_chemical_symbols(p_species)
+        writer.write_structure(emin_fname, write_atoms)
+
+  finally:
+    writer.close()
+    if config_log is not None:
+      config_log.close()
+    if observables is not None:
+      observables.close()
+    if schedule is not None:
+      if schedule.temperature is not None:
+        schedule.end()
+      print(schedule.summary())
+    if profiler is not None:
+      if hasattr(calculator, 'profiler'):
+        calculator.profiler = calculator_profiler
+      profiler.report()
+    if cache is not None:
+      print(cache.summary())
+
+
+
+def sps_polish ( lattice,
+                 species,
+                 positions,
+                 calculator,
+                 nfixed = 0,
+                 energy = None,
+                 batch_size = 1,
+                 cache = None,
+                 sublattices = None,
+                 sublattice_weights = None,
+                 max_swaps = None ):
+  '''
+    Steepest descent over single swaps. The energy after every swap of two sites with different
+    species is evaluated, and the swap with the lowest energy is applied while it lowers the energy.
+    Without a maximum number of swaps, the returned structure is a local minimum: no single swap
+    lowers its energy.
+
+    Arguments:
+      lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+      species (list): List of atomic symbols for each constituent site
+      positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+      calculator (Calculator): Calculator for evaluating the structure energy. Calculators with local_delta evaluate all swaps with predict_deltas, and others are evaluated in batches of batch_size configurations.
+      nfixed (int): Number of sites to neglect from swapping. Fixed sites must come first in the species and positions lists.
+      energy (float): Energy of the structure, if known
+      batch_size (int): Number of configurations evaluated in a single calculator call
+      cache (int or EnergyCache): Cache of configuration energies, or the maximum number of entries for a new cache
+      sublattices (list): Sublattice label of each site, restricting swaps to sites of the same sublattice, as in sps_fixed
+      sublattice_weights (dict): Sublattices with zero weight are not swapped, as in sps_fixed
+      max_swaps (int): Maximum number of swaps applied
+
+    Returns:
+      (list,float,int): Species list of the polished structure, its energy, and the number of swaps applied
+  '''
+  from .sites import SitePools
+
+  lattice = np.array(lattice)
+  positions = np.array(positions)
+  species = list(species)
+  cache = _init_cache(cache)
+  pools = SitePools(species, nfixed, sublattices=sublattices, weights=sublattice_weights)
+  if energy is None:
+    energy = _predict_energies(calculator, lattice, [species], positions, cache, [pools.species], pools.symbols)[0]
+
+  nswaps = 0
+  while max_swaps is None or nswaps < max_swaps:
+    pairs,_ = pools.candidates()
+    enes = _swap_energies(pools, pairs, species, energy, lattice, positions, calculator, batch_size, cache)
+    k = np.argmin(enes)
+    if not enes[k] < energy:
+      break
+    i,j = pairs[k]
+    pools.swap(i, j)
+    species[i],species[j] = species[j],species[i]
+    energy = enes[k]
+    nswaps += 1
+  return species,energy,nswaps
 
 
 
@@ -153,7 +789,18 @@ def sps_vacancy ( lattice,
                   emin_fname = 'structure.emin.xyz',
                   occupation_factors=None,
                   calculator = None,
-                  stop=None ):
+                  stop=None,
+                  cache = None,
+                  swap_binary = False,
+                  flush_interval = 10.,
+                  config_fname = None,
+                  checkpoint_fname = None,
+                  checkpoint_interval = 1000,
+                  resume = False,
+                  observables = None,
+                  profiler = None,
+                  neighbors = None,
+                  hop_fraction = 0.5 ):
   '''
     Perform the SPS routine on a set of atomic sites that contain some vacant sites.
 
@@ -170,16 +817,24 @@ def sps_vacancy ( lattice,
       nswap_inc (int): Number of rejected trial configurations performed before increasing nswap.
       swap_fname (str): File name for the trajectory output file.
       emin_filename (str): File name for the minimum energy structure, output in the xyz format.
+      occupation_factors: Deprecated and unused. The occupation of every site at each accepted trial is recorded with config_fname.
       calculator (str): Calculator for evaluating the structure energy.
       stop (float): Terminate the trial if the predicted structure energy is at or below the provided stop value.
+      cache (int or EnergyCache): Cache of configuration energies, or the maximum number of entries for a new cache. Configurations are keyed by the species occupying each vacancy site, and revisited configurations are not reevaluated. An EnergyCache built with a SiteSymmetry also merges symmetry-equivalent configurations. Cache statistics are printed at the end of the run.
+      swap_binary (bool): Write the trajectory output file as binary records rather than text. Both formats are read by file_io.read_swap_trajectory.
+      flush_interval (float): Maximum time, in seconds, that accepted trials and the minimum energy structure are buffered before being written.
+      config_fname (str): File name for a log of every accepted configuration, recorded as the sites changed by each accepted trial. Structures at any iteration are reconstructed with file_io.replay_configurations.
+      checkpoint_fname (str): File name for periodic checkpoints of the complete trajectory state, including the random number generator. The checkpoint is replaced atomically every checkpoint_interval iterations.
+      checkpoint_interval (int): Number of iterations between checkpoints.
+      resume (bool): Continue from checkpoint_fname if it exists, truncating the output files to their length at the checkpoint. Otherwise, a new trajectory is started.
+      observables (ObservableAccumulator): Accumulator of the energy moments, heat capacity, acceptance rate, and short-range order at each temperature, updated at every iteration. Its sites are the vacancy sites, with vacancies counted as a species. It is stored in checkpoints and restored on resume.
+      profiler (PhaseProfiler): Profiler recording the time of each phase of the iterations and the iterations per second at each temperature, as in sps_fixed
+      neighbors (NeighborIndex): Neighbors of each vacancy site, such as NeighborIndex(lattice, vacancy_positions, nshells=1). A fraction hop_fraction of the trials then move an occupant by hops to vacant neighboring sites, rather than to any site with another species.
+      hop_fraction (float): Probability that a trial is made of hops, if neighbors is provided
   '''
-  from .file_io import write_swap_accept
+  from .file_io import ConfigurationLogWriter, SwapTrajectoryWriter
+  from .sites import VacancyPools
   from os.path import isfile
-  from ase.io import write
-  from ase import Atoms
-
-  # Boltzmann const in eV
-  kB = 1.68e-23/1.602e-19
 
   # Trajectory variables
   itr = 0
@@ -208,20 +863,25 @@ def sps_vacancy ( lattice,
   if len(vacancy_positions.shape) != 2 or vacancy_positions.shape[0] < len(vacancy_species):
     msg = f'Vacancy positions shape must be (N,3), where N is greater than or equal to the number of vacancy species.'
     raise ValueError(msg)
+  if occupation_factors is not None:
+    from warnings import warn
+    warn('occupation_factors is deprecated and ignored. Use config_fname to record site occupations.', DeprecationWarning, stacklevel=2)
 
   # Static array lengths
   nvspecies = len(vacancy_species)
   nfixed = fixed_positions.shape[0]
   nvsites = vacancy_positions.shape[0]
 
-  # Set the initial vacancy occupation
-  vacancy_indices = [i for i in range(nvspecies)]
-  vacancy_occupation = {i:i for i in vacancy_indices}
-  v_positions = [vacancy_positions[i] for i in vacancy_occupation]
+  # The initial occupation places each vacancy species on the vacancy site of the same index.
+  # pools holds the site of each vacancy species, and the vacancy species on each site.
+  pools = VacancyPools(vacancy_species, nvsites, neighbors=neighbors)
 
   # Create Atoms object for output
-  positions = np.concatenate([fixed_positions, v_positions])
-  write_atoms = Atoms(species, positions=positions@lattice, cell=lattice, pbc=[1,1,1])
+  positions = np.concatenate([fixed_positions, vacancy_positions[pools.site]])
+  write_atoms = None
+  if emin_fname is not None:
+    from ase import Atoms
+    write_atoms = Atoms(species, positions=positions@lattice, cell=lattice, pbc=[1,1,1])
 
   # If there is no provided calculator, initialize the default M3GNet calculator
   if calculator is None:
@@ -234,65 +894,563 @@ def sps_vacancy ( lattice,
   if len(temperatures) != len(temp_swaps):
     raise ValueError('temperatures and temp_swaps must contain the same number of elements.')
 
-  ene = emin = calculator.predict_formation_energy(lattice, species, positions)
+  # Cache keys and the configuration log record the species occupying each vacancy site
+  cache = _init_cache(cache)
 
-  # Initialize the swaps output file. Exit if the file exists already.
-  if isfile(swap_fname):
-    raise FileExistsError(f'File {swap_fname} already exists. Will not overwrite.')
-  write_swap_accept(swap_fname, 'w', itr, itr-last_swap_i, temperatures[0], ene, occupation_factors=occupation_factors)
+  checkpoint = _load_checkpoint(checkpoint_fname, resume, nvsites, len(temperatures))
 
-  # Trajectory iteration
-  for i,temp in enumerate(temperatures):
-    for _ in range(temp_swaps[i]):
-      itr += 1
+  if checkpoint is None:
+    ene = emin = calculator.predict_formation_energy(lattice, species, positions)
+    if cache is not None:
+      cache.put(cache.key(pools.content, pools.symbols), ene)
+
+    # Initialize the swaps output file. Exit if the file exists already.
+    if isfile(swap_fname):
+      raise FileExistsError(f'File {swap_fname} already exists. Will not overwrite.')
+    writer = SwapTrajectoryWriter(swap_fname, 'w', binary=swap_binary, flush_interval=flush_interval)
+    writer.write(itr, itr-last_swap_i, temperatures[0], ene)
+
+    config_log = None
+    if config_fname is not None:
+      config_log = ConfigurationLogWriter(config_fname, lattice, vacancy_positions, pools.decode(), fixed_species,
+                                          fixed_positions, flush_interval=flush_interval)
+    if observables is not None:
+      observables.begin(pools.decode(), ene)
+    temp_index,temp_step = 0,0
+
+  else:
+    # Continue the output files from their length at the checkpoint
+    state = checkpoint['state']
+    if 'pools' in state:
+      pools = state['pools']
+    else:
+      pools = VacancyPools(vacancy_species, nvsites, sites=state['vacancy_indices'], neighbors=neighbors)
+    ene,emin,itr,last_swap_i,nswap = state['ene'],state['emin'],state['itr'],state['last_swap_i'],state['nswap']
+    temp_index,temp_step = state['temp_index'],state['temp_step']
+    positions[nfixed:,:] = vacancy_positions[pools.site]
+
+    _truncate_outputs([swap_fname, config_fname, None if observables is None else observables.fname], checkpoint['file_sizes'])
+    writer = SwapTrajectoryWriter(swap_fname, 'a', binary=swap_binary, flush_interval=flush_interval)
+    config_log = None
+    if config_fname is not None:
+      config_log = ConfigurationLogWriter(config_fname, lattice, vacancy_positions, pools.decode(), mode='a',
+                                          last_step=last_swap_i, flush_interval=flush_interval)
+    if observables is not None and checkpoint.get('observables') is not None:
+      observables.__dict__.update(checkpoint['observables'].__dict__)
+      observables.open()
+    elif observables is not None:
+      observables.begin(pools.decode(), ene)
+    np.random.set_state(checkpoint['rng'])
+
+  def save_checkpoint ( i, j ):
+    if profiler is not None:
+      tick = profiler.now()
+    state = {'pools':pools, 'ene':ene, 'emin':emin,
+             'itr':itr, 'last_swap_i':last_swap_i, 'nswap':nswap, 'temp_index':i, 'temp_step':j}
+    _save_checkpoint(checkpoint_fname, {'state':state, 'observables':observables, 'nsite':nvsites, 'ntemp':len(temperatures)},
+                     [writer, config_log, observables])
+    if profiler is not None:
+      profiler.lap('checkpoint', tick)
+
+  # The calculator records its own phases with the profiler
+  calculator_profiler = getattr(calculator, 'profiler', None)
+  if profiler is not None and hasattr(calculator, 'profiler'):
+    calculator.profiler = profiler
+
+  try:
+    if checkpoint is None and checkpoint_fname is not None:
+      save_checkpoint(0, 0)
+
+    # Trajectory iteration
+    for i in range(temp_index, len(temperatures)):
+      temp = temperatures[i]
+      for j in range(temp_step, temp_swaps[i]):
+        itr += 1
+        if profiler is not None:
+          start = tick = profiler.now()
+
+        # Move one vacancy species in place, to sites with another species or to vacant neighboring sites
+        nc = 1+np.random.randint(nswap)
+        ri = np.random.randint(nvspecies)
+        hop = neighbors is not None and np.random.random() < hop_fraction
+        moves = pools.move(ri, nc, hop)
+        positions[nfixed:,:] = vacancy_positions[pools.site]
+        if profiler is not None:
+          tick = profiler.lap('propose', tick)
+
+        # Calculate energy and evaluate Metropolis condition. A trial in which every hop was blocked is rejected.
+        t_ene = None if len(moves) > 0 else ene
+        if cache is not None and t_ene is None:
+          key = cache.key(pools.content, pools.symbols)
+          t_ene = cache.get(key)
+        if t_ene is None:
+          t_ene = calculator.predict_formation_energy(lattice, species, positions)
+          if cache is not None:
+            cache.put(key, t_ene)
+        if profiler is not None:
+          tick = profiler.lap('evaluate', tick)
+        accept = len(moves) > 0 and _metropolis(t_ene-ene, temp)
+        changed = ((),())
+        if accept:
+          if config_log is not None or observables is not None:
+            sites = pools.changed(moves)
+            changed = (sites, pools.symbols[pools.codes[pools.occupant[sites]]].tolist())
+          if profiler is not None:
+            tick = profiler.lap('metropolis', tick)
+          writer.write(itr, itr-last_swap_i, temp, t_ene)
+          if config_log is not None:
+            config_log.write(itr, *changed)
+          if profiler is not None:
+            tick = profiler.lap('output', tick)
+          ene = t_ene
+          nswap = sswap
+          last_swap_i = itr
+          if ene < emin:
+            emin = ene
+            if emin_fname is not None:
+              write_atoms.set_scaled_positions(positions)
+              writer.write_structure(emin_fname, write_atoms)
 
-      tvinds = vacancy_indices.copy()
-      tvocc = vacancy_occupation.copy()
-
-      # Perform stochastic swaps
-      ns, nc = 0, 1+np.random.randint(nswap)
-      ri = np.random.randint(nvspecies)
-      while ns < nc:
-        nri = np.random.randint(nvsites)
-        if nri in tvocc:
-          if vacancy_species[tvocc[nri]] == vacancy_species[ri]:
-            continue
-          tri = tvocc[nri]
-          tvocc[tvinds[ri]],tvocc[nri] = tvocc[nri],tvocc[tvinds[ri]]
-          tvinds[ri],tvinds[tri] = nri,tvinds[ri]
         else:
-          del tvocc[tvinds[ri]]
-          tvinds[ri] = nri
-          tvocc[nri] = ri
-        ns += 1
-
-      # Update positions arrays
-      v_positions = np.array([vacancy_positions[i] for i in tvinds])
-      positions[nfixed:,:] = v_positions
-
-      # Calculate energy and evaluate Metropolis condition
-      t_ene = calculator.predict_formation_energy(lattice, species, positions)
-      dE = t_ene - ene
-      boltz = False if temp==0 else np.exp(-dE/(kB*temp)) > np.random.rand()
-      if dE < 0 or boltz:
-        write_swap_accept(swap_fname, 'a', itr, itr-last_swap_i, temp, t_ene, occupation_factors=occupation_factors)
-        ene = t_ene
-        nswap = sswap
-        last_swap_i = itr
-        vacancy_indices = tvinds
-        vacancy_occupation = tvocc
-        if ene < emin:
-          emin = ene
-          if emin_fname is not None:
-            write_atoms.set_scaled_positions(positions)
-            write(emin_fname, write_atoms)
+          # Restore the occupation, and increase the number of swaps after nswap_inc rejections
+          pools.undo(moves)
+          if (itr-last_swap_i) % nswap_inc == 0:
+            nswap += 1
 
-      else:
-        # Increase the number of swaps after nswap_inc rejections
-        if (itr-last_swap_i) % nswap_inc == 0:
-          nswap += 1
+        if profiler is not None:
+          tick = profiler.lap('metropolis', tick)
+        if observables is not None:
+          observables.step(temp, ene, accept, *changed)
+          if profiler is not None:
+            tick = profiler.lap('observables', tick)
+        if profiler is not None:
+          profiler.advance(temp, 1, tick-start)
 
-      # Halt if stop condition is met
-      if stop is not None:
-        if ene <= stop:
-          return
+        # Halt if stop condition is met
+        if stop is not None:
+          if ene <= stop:
+            return
+
+        if checkpoint_fname is not None and itr % checkpoint_interval == 0:
+          save_checkpoint(i, j+1)
+      temp_step = 0
+
+  finally:
+    writer.close()
+    if config_log is not None:
+      config_log.close()
+    if observables is not None:
+      observables.close()
+    if profiler is not None:
+      if hasattr(calculator, 'profiler'):
+        calculator.profiler = calculator_profiler
+      profiler.report()
+    if cache is not None:
+      print(cache.summary())
+
+
+
+def _exchange_accepted ( temp1, ene1, temp2, ene2 ):
+  '''
+    Metropolis condition for exchanging the configurations of two replicas at different temperatures.
+  '''
+  beta1 = np.inf if temp1 == 0 else 1/(kB*temp1)
+  beta2 = np.inf if temp2 == 0 else 1/(kB*temp2)
+  if beta1 == beta2 or ene1 == ene2:
+    return True
+  arg = (beta1-beta2) * (ene1-ene2)
+  return arg >= 0 or np.exp(arg) > np.random.rand()
+
+
+
+def _tempering_worker ( conn, lattice, positions, calculator, replicas, seed, options ):
+  '''
+    Process target for sps_parallel_tempering. The worker owns a calculator and the trajectory
+    state of several replicas, advancing each replica at the temperature requested by the parent.
+
+    Arguments:
+      conn (Connection): Pipe to the parent process
+      calculator (callable or Calculator): Called with no arguments to create the worker's Calculator, unless it is already a Calculator instance
+      replicas (dict): Initial species, temperature, and output file names for each replica index
+      seed (int): Seed for the worker's random number generator
+      options (dict): Keyword arguments passed to _sps_fixed_steps, the observables template copied for each replica, and the sublattices of the site pools
+  '''
+  from .file_io import ConfigurationLogWriter, SwapTrajectoryWriter
+  from copy import deepcopy
+  from .sites import SitePools
+
+  np.random.seed(seed)
+  if isinstance(calculator, type) or not hasattr(calculator, 'predict_formation_energy'):
+    calculator = calculator()
+  cache = _init_cache(options.pop('cache'))
+
+  binary,flush_interval = options.pop('swap_binary'),options.pop('flush_interval')
+  template = options.pop('observables')
+  sublattices,weights = options.pop('sublattices'),options.pop('sublattice_weights')
+
+  writers,logs,observables = {},{},{}
+  try:
+    states,atoms = {},{}
+    for r,rep in replicas.items():
+      pools = SitePools(rep['species'], options['nfixed'], sublattices=sublattices, weights=weights)
+      ene = _predict_energies(calculator, lattice, [rep['species']], positions, cache, [pools.species], pools.symbols)[0]
+      writers[r] = SwapTrajectoryWriter(rep['swap_fname'], 'w', binary=binary, flush_interval=flush_interval)
+      writers[r].write(0, 0, rep['temperature'], ene)
+      logs[r] = None
+      if rep['config_fname'] is not None:
+        logs[r] = ConfigurationLogWriter(rep['config_fname'], lattice, positions, rep['species'], flush_interval=flush_interval)
+      observables[r] = None
+      if template is not None:
+        observables[r] = deepcopy(template)
+        observables[r].fname = None
+        observables[r].begin(rep['species'], ene)
+      states[r] = {'species':rep['species'], 'pools':pools, 'ene':ene, 'emin':ene,
+                   'itr':0, 'last_swap_i':0, 'nswap':options['nswap']}
+      atoms[r] = None
+      if rep['emin_fname'] is not None:
+        from ase import Atoms
+        atoms[r] = Atoms(rep['species'], positions=positions@lattice, cell=lattice, pbc=[1,1,1])
+    conn.send(({r:s['ene'] for r,s in states.items()}, False))
+
+    # Advance the replicas at the requested temperatures until the parent sends None
+    msg = conn.recv()
+    while msg is not None:
+      nstep,temps = msg
+      halt = False
+      for r,temp in temps.items():
+        halt |= _sps_fixed_steps(states[r], temp, nstep, lattice, positions, calculator,
+                                 writer=writers[r], emin_fname=replicas[r]['emin_fname'],
+                                 write_atoms=atoms[r], cache=cache, config_log=logs[r], observables=observables[r], **options)
+      conn.send(({r:states[r]['ene'] for r in temps}, halt))
+      msg = conn.recv()
+
+    # Return the accumulated observables to be combined by the parent
+    if template is not None:
+      for o in observables.values():
+        o.close()
+      conn.send(list(observables.values()))
+
+  finally:
+    for w in writers.values():
+      w.close()
+    for l in logs.values():
+      if l is not None:
+        l.close()
+    if cache is not None:
+      print(cache.summary())
+    conn.close()
+
+
+
+def sps_parallel_tempering ( lattice,
+                             species,
+                             positions,
+                             temperatures,
+                             nsteps,
+                             exchange_interval = 100,
+                             nfixed = 0,
+                             nswap = 2,
+                             nswap_inc = 1000,
+                             swap_fname = 'swaps.{}.out',
+                             emin_fname = 'structure.emin.{}.xyz',
+                             calculator = None,
+                             nproc = None,
+                             stop = None,
+                             batch_size = 1,
+                             cache = None,
+                             swap_binary = False,
+                             flush_interval = 10.,
+                             config_fname = None,
+                             observables = None,
+                             sublattices = None,
+                             sublattice_weights = None ):
+  '''
+    Perform the SPS routine on a fixed atomic basis with replica exchange (parallel tempering).
+    One replica is run at each temperature, distributed over a pool of worker processes.
+    Every exchange_interval iterations, replicas at neighboring temperatures attempt to exchange
+    temperatures according to the Metropolis condition.
+
+    Arguments:
+      lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+      species (list): List of atomic symbols for each constituent site. Every replica starts from this configuration.
+      positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+      temperatures (list or ndarray): Temperature of each replica
+      nsteps (int): Number of iterations performed by each replica
+      exchange_interval (int): Number of iterations between replica exchange attempts
+      nfixed (int): Number of sites to neglect from the swapping routine. Fixed sites must come first in the species and positions lists.
+      nswap (int): Number of swaps to be performed at each step. This value is increased after nswap_inc rejected iterations.
+      nswap_inc (int): Number of rejected trial configurations performed before increasing nswap.
+      swap_fname (str): File name pattern for the trajectory output of each replica. The replica index replaces {}. The temperature column records the temperature of the replica at each accepted trial.
+      emin_fname (str): File name pattern for the minimum energy structure of each replica, output in the xyz format.
+      calculator (callable or EvaluationServer): Calculator class, or other picklable callable returning a Calculator, instantiated once in each worker process. If a running EvaluationServer is provided, each worker instead uses one of its clients, so the model is loaded only by the server. Defaults to MEGNet_Calculator.
+      nproc (int): Number of worker processes. Defaults to the smaller of the number of replicas and the number of CPUs.
+      stop (float): Terminate all replicas if the energy of any replica is at or below the provided stop value.
+      batch_size (int): Number of trial configurations evaluated in a single calculator call, as in sps_fixed.
+      cache (int): Maximum number of entries in each worker's energy cache, shared by the replicas of that worker.
+      swap_binary (bool): Write the trajectory output files as binary records rather than text.
+      flush_interval (float): Maximum time, in seconds, that accepted trials and minimum energy structures are buffered before being written.
+      config_fname (str): File name pattern for a log of every accepted configuration of each replica, as in sps_fixed. The replica index replaces {}.
+      observables (ObservableAccumulator): Accumulator of the averages at each temperature, as in sps_fixed. Each replica is accumulated separately by its worker, and the replicas are combined at each temperature when the run ends, after which the summary lines are written.
+      sublattices (list): Sublattice label of each site, restricting swaps to sites of the same sublattice, as in sps_fixed.
+      sublattice_weights (dict): Relative frequency of swaps on each sublattice, by label, as in sps_fixed.
+  '''
+  from multiprocessing import Pipe, Process
+  from .sites import SitePools
+  from .server import EvaluationServer
+  from os import cpu_count
+  from os.path import isfile
+
+  nrep = len(temperatures)
+  lattice = np.array(lattice)
+  positions = np.array(positions)
+
+  # Verify the input arrays and output files
+  if len(lattice.shape) != 2 or not (lattice.shape[0] == 3 and lattice.shape[1] == 3):
+    raise ValueError('Lattice shape must be (3,3)')
+  if len(positions.shape) != 2 or positions.shape[0] != len(species) or positions.shape[1] != 3:
+    raise ValueError('Positions shape must be (N,3), where N is the number of provided species')
+  if nfixed > positions.shape[0]-2:
+    raise ValueError(f'Cannot fix {nfixed} of {len(species)} sites. Decrease {nfixed} or provide more sites.')
+  if len(set(species)) <= 1:
+    raise ValueError('Species list must contain more than one type of species')
+  if nrep < 2:
+    raise ValueError('Parallel tempering requires at least two temperatures')
+
+  # Verify the sublattices before starting the workers
+  SitePools(species, nfixed, sublattices=sublattices, weights=sublattice_weights)
+  for r in range(nrep):
+    if isfile(swap_fname.format(r)):
+      raise FileExistsError(f'File {swap_fname.format(r)} already exists. Will not overwrite.')
+
+  if calculator is None:
+    from .calculators import MEGNet_Calculator
+    calculator = MEGNet_Calculator
+  if nproc is None:
+    nproc = min(nrep, cpu_count())
+
+  # Current temperature of each replica
+  temps = list(temperatures)
+  options = {'nfixed':nfixed, 'nswap':nswap, 'nswap_inc':nswap_inc, 'batch_size':batch_size, 'cache':cache, 'stop':stop,
+             'swap_binary':swap_binary, 'flush_interval':flush_interval, 'observables':observables,
+             'sublattices':sublattices, 'sublattice_weights':sublattice_weights}
+
+  # Assign the replicas to the workers in turn
+  conns,procs,owned = [],[],[]
+  for w in range(nproc):
+    reps = {r:{'species':list(species), 'temperature':temps[r], 'swap_fname':swap_fname.format(r),
+               'emin_fname':None if emin_fname is None else emin_fname.format(r),
+               'config_fname':None if config_fname is None else config_fname.format(r)} for r in range(w, nrep, nproc)}
+    parent,child = Pipe()
+    wcalc = calculator.client(w) if isinstance(calculator, EvaluationServer) else calculator
+    args = (child, lattice, positions, wcalc, reps, np.random.randint(2**31), dict(options))
+    procs.append(Process(target=_tempering_worker, args=args))
+    procs[-1].start()
+    child.close()
+    conns.append(parent)
+    owned.append(list(reps))
+
+  try:
+    enes = {}
+    for c in conns:
+      enes.update(c.recv()[0])
+
+    nround = int(np.ceil(nsteps/exchange_interval))
+    for rnd in range(nround):
+      nstep = min(exchange_interval, nsteps-rnd*exchange_interval)
+      for c,reps in zip(conns, owned):
+        c.send((nstep, {r:temps[r] for r in reps}))
+
+      halt = False
+      for c in conns:
+        t_enes,t_halt = c.recv()
+        enes.update(t_enes)
+        halt |= t_halt
+      if halt:
+        break
+
+      # Attempt exchanges between neighboring temperatures, alternating between even and odd pairs
+      ladder = np.argsort(temps, kind='stable')
+      for k in range(rnd%2, nrep-1, 2):
+        r1,r2 = ladder[k],ladder[k+1]
+        if _exchange_accepted(temps[r1], enes[r1], temps[r2], enes[r2]):
+          temps[r1],temps[r2] = temps[r2],temps[r1]
+
+  finally:
+    # A worker which has exited, such as after an error, has closed its end of the pipe. The other
+    # workers are still stopped, and any exception propagating from the loop is not replaced.
+    for c in conns:
+      try:
+        c.send(None)
+      except (BrokenPipeError, OSError):
+        pass
+    if observables is not None:
+      for c in conns:
+        try:
+          for o in c.recv():
+            observables.merge(o)
+        except (EOFError, OSError):
+          pass
+    for p in procs:
+      p.join(timeout=60)
+      if p.is_alive():
+        p.terminate()
+        p.join()
+
+  if observables is not None:
+    observables.open()
+    for t in sorted(observables.stats):
+      observables.write(t)
+    observables.close()
+
+
+
+def sps_replicas ( lattice,
+                   species,
+                   positions,
+                   temperatures,
+                   temp_swaps=[],
+                   nreplicas = 1,
+                   nfixed = 0,
+                   nswap = 2,
+                   nswap_inc = 1000,
+                   swap_fname = None,
+                   calculator = None,
+                   swap_binary = False,
+                   flush_interval = 10. ):
+  '''
+    Perform the SPS routine on many independent replicas of a fixed atomic basis, advanced in lock-step.
+    Swap proposals, energy changes, and Metropolis conditions are evaluated for all replicas at once
+    on an MxN array of integer species. Each replica follows the sps_fixed algorithm with batch_size 1.
+
+    Calculators providing site_delta_many, such as a fitted ClusterExpansionCalculator, evaluate the
+    energy changes of all replicas in a few vectorized operations. Other calculators evaluate every
+    replica in a single predict_many call at each iteration.
+
+    Arguments:
+      lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+      species (list): List of atomic symbols for each constituent site, shared by every replica, or one such list for each replica
+      positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate for each of N atomic sites
+      temperatures (list or ndarray): Temperature trajectory for simulated annealing trials. Each entry is either one temperature for every replica, or a list with the temperature of each replica.
+      temp_swaps (list or ndarray): Number of swaps to perform at each temperature in the trajectory. (Must contain one number for each provided temperature.
+      nreplicas (int): Number of replicas, if a single species list is provided
+      nfixed (int): Number of sites to neglect from the swapping routine. Fixed sites must come first in the species and positions lists.
+      nswap (int): Number of swaps to be performed at each step. This value is increased after nswap_inc rejected iterations of a replica.
+      nswap_inc (int): Number of rejected trial configurations performed before increasing nswap.
+      swap_fname (str): File name pattern for the trajectory output of each replica. The replica index replaces {}. If None, no trajectory output is written.
+      calculator (Calculator): Calculator for evaluating the structure energy.
+      swap_binary (bool): Write the trajectory output files as binary records rather than text.
+      flush_interval (float): Maximum time, in seconds, that accepted trials are buffered before being written.
+
+    Returns:
+      (dict): Final species lists (species) and energies (energies), and the minimum energies (emin) and their species lists (emin_species), of every replica
+  '''
+  from .file_io import SwapTrajectoryWriter
+  from .sites import ReplicaPools
+  from os.path import isfile
+
+  lattice = np.array(lattice)
+  positions = np.array(positions)
+  if len(species) > 0 and isinstance(species[0], str):
+    species = nreplicas * [species]
+  nrep,nat = len(species),len(species[0])
+
+  # Verify that the input arrays have appropriate dimensions
+  if len(lattice.shape) != 2 or not (lattice.shape[0] == 3 and lattice.shape[1] == 3):
+    raise ValueError('Lattice shape must be (3,3)')
+  if len(positions.shape) != 2 or positions.shape[0] != nat or positions.shape[1] != 3:
+    raise ValueError('Positions shape must be (N,3), where N is the number of provided species')
+  if nfixed > nat-2:
+    raise ValueError(f'Cannot fix {nfixed} of {nat} sites. Decrease {nfixed} or provide more sites.')
+
+  # If the number of swaps per temperature is undefined, assign each to 1
+  if len(temp_swaps) == 0:
+    temp_swaps = np.ones(len(temperatures), dtype=np.short)
+  if len(temperatures) != len(temp_swaps):
+    raise ValueError('temperatures and temp_swaps must contain the same number of elements.')
+
+  # If there is no provided calculator, initialize the default M3GNet calculator
+  if calculator is None:
+    from .calculators import MEGNet_Calculator
+    calculator = MEGNet_Calculator()
+
+  # Local energy changes index the calculator's species directly
+  local = hasattr(calculator, 'site_delta_many')
+  if local and not getattr(calculator, 'fitted', True):
+    raise ValueError('The calculator must be fit before sps_replicas. Call fit or set_interactions first.')
+  pools = ReplicaPools(species, nfixed, calculator.symbols if local else None)
+  occ = pools.species
+  nfree = nat - nfixed
+
+  ene = np.array(calculator.predict_many(lattice, pools.symbols[occ], positions), dtype=float)
+  emin,emin_species = ene.copy(),occ.copy()
+  last_swap_i = np.zeros(nrep, dtype=int)
+  rnswap = np.full(nrep, nswap)
+  itr = 0
+
+  writers = []
+  if swap_fname is not None:
+    for m in range(nrep):
+      if isfile(swap_fname.format(m)):
+        raise FileExistsError(f'File {swap_fname.format(m)} already exists. Will not overwrite.')
+    temp = np.broadcast_to(np.asarray(temperatures[0], dtype=float), (nrep,))
+    for m in range(nrep):
+      writers.append(SwapTrajectoryWriter(swap_fname.format(m), 'w', binary=swap_binary, flush_interval=flush_interval))
+      writers[m].write(itr, 0, temp[m], ene[m])
+
+  try:
+    # Trajectory iteration
+    for i,temp in enumerate(temperatures):
+      temp = np.broadcast_to(np.asarray(temp, dtype=float), (nrep,))
+      for _ in range(temp_swaps[i]):
+        itr += 1
+
+        # Every swap of each trial is proposed from the current configurations
+        rswap = 1 + (np.random.random(nrep) * np.minimum(nfree, rnswap)).astype(int)
+        swaps = []
+        for s in range(rswap.max()):
+          rows = np.flatnonzero(rswap > s)
+          swaps.append((rows,) + pools.propose(rows))
+
+        # Apply the swaps in order, each as two single-site changes
+        if local:
+          dE = np.zeros(nrep)
+          for rows,a,b in swaps:
+            sa,sb = occ[rows,a],occ[rows,b]
+            dE[rows] += calculator.site_delta_many(occ, rows, a, sb)
+            occ[rows,a] = sb
+            dE[rows] += calculator.site_delta_many(occ, rows, b, sa)
+            occ[rows,a] = sa
+            pools.swap(rows, a, b)
+        else:
+          for rows,a,b in swaps:
+            pools.swap(rows, a, b)
+          dE = np.array(calculator.predict_many(lattice, pools.symbols[occ], positions)) - ene
+
+        # Metropolis condition, with one uniform draw per replica
+        with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+          boltz = np.exp(-dE/(kB*temp)) > np.random.random(nrep)
+        accept = (dE < 0) | ((temp != 0) & boltz)
+
+        # Undo the swaps of rejected trials in reverse order
+        for rows,a,b in reversed(swaps):
+          rej = ~accept[rows]
+          pools.swap(rows[rej], a[rej], b[rej])
+
+        acc = np.flatnonzero(accept)
+        ene[acc] += dE[acc]
+        for m in acc if len(writers) > 0 else []:
+          writers[m].write(itr, itr-last_swap_i[m], temp[m], ene[m])
+        last_swap_i[acc] = itr
+        rnswap[acc] = nswap
+        rnswap[~accept & ((itr-last_swap_i) % nswap_inc == 0)] += 1
+
+        lower = ene < emin
+        emin[lower] = ene[lower]
+        emin_species[lower] = occ[lower]
+
+  finally:
+    for w in writers:
+      w.close()
+
+  return {'species':[pools.decode(m) for m in range(nrep)], 'energies':ene,
+          'emin':emin, 'emin_species':[pools.symbols[e].tolist() for e in emin_species]}
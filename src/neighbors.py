@@ -0,0 +1,267 @@
+import numpy as np
+
+# Leading bytes of a saved NeighborIndex, followed by a JSON header and the arrays
+NEIGHBOR_MAGIC = b'MCSPSNB1'
+
+
+class NeighborIndex:
+  '''
+    Periodic neighbors of every site of a fixed lattice within the first nshells distinct neighbor
+    distances, found once with a cell list. The neighbors are stored in compressed sparse row form:
+    the neighbors of site i are entries ptr[i] to ptr[i+1] of indices, distances, shells, and images.
+    Each pair is listed from both sites, and once for every periodic image within range, ordered by
+    neighbor index and then by image.
+
+    An index can be saved and loaded with its arrays memory-mapped, so that worker processes share
+    a single copy. An index loaded this way is pickled as its file name, and mapped again when unpickled.
+  '''
+
+  def __init__ ( self, lattice, positions, nshells=2, tol=1e-3, cutoff=None ):
+    '''
+      Arguments:
+        lattice (ndarray): 3x3 matrix with the lattice vectors
+        positions (ndarray): Nx3 matrix containing the crystal coordinates of each site
+        nshells (int): Number of neighbor shells to include
+        tol (float): Tolerance, in Angstrom, for assigning distances to the same shell
+        cutoff (float): Initial search radius, in Angstrom, which is increased until nshells shells are complete. Defaults to an estimate from the density of sites.
+    '''
+    self.lattice = np.array(lattice, dtype=float)
+    self.positions = np.array(positions, dtype=float)
+    self.nshells = nshells
+    self.tol = tol
+    self.fname = None
+
+    nsite = len(self.positions)
+    if cutoff is None:
+      cutoff = (1 + 0.5*nshells) * (abs(np.linalg.det(self.lattice)) / nsite)**(1/3)
+
+    # The shells around a subset of the sites bound the shells of the full lattice from above, so the
+    # outermost shell of a probe gives a search radius for all sites. The probe radius is increased
+    # until it finds nshells complete shells.
+    probe = np.unique(np.linspace(0, nsite-1, min(nsite, 256)).astype(int))
+    while True:
+      shell_dists = self._shells(self._search(cutoff, probe)[3])
+      if len(shell_dists) == nshells and shell_dists[-1] + 2*tol <= cutoff:
+        break
+      cutoff *= 1.5
+    cutoff = shell_dists[-1] + 2*tol
+
+    rows,cols,images,dists = self._search(cutoff)
+    shell_dists = self._shells(dists)
+    shell = np.minimum(np.searchsorted(shell_dists + 2*tol, dists), nshells-1)
+    keep = np.abs(dists - shell_dists[shell]) <= 2*tol
+    rows,cols,images,dists,shell = rows[keep],cols[keep],images[keep],dists[keep],shell[keep]
+
+    # Order by site, neighbor, and image
+    span = images.max(axis=0) - images.min(axis=0) + 1 if len(images) > 0 else np.ones(3, dtype=int)
+    if float(nsite)**2 * np.prod(span) < 2**62:
+      code = np.ravel_multi_index((images - images.min(axis=0)).T, span) if len(images) > 0 else 0
+      order = np.argsort((rows.astype(np.int64)*nsite + cols) * int(np.prod(span)) + code, kind='stable')
+    else:
+      order = np.lexsort((images[:,2], images[:,1], images[:,0], cols, rows))
+    self.ptr = np.searchsorted(rows[order], np.arange(nsite+1)).astype(np.int64)
+    self.indices = cols[order]
+    self.distances = dists[order]
+    self.shells = shell[order].astype(np.int16)
+    self.images = images[order]
+    self.shell_distances = shell_dists
+
+
+  def _search ( self, cutoff, sites=None ):
+    '''
+      Find every pair of sites, including periodic images, separated by more than tol and at most cutoff.
+
+      Arguments:
+        cutoff (float): Search radius, in Angstrom
+        sites (ndarray): Sites from which to search. Defaults to all.
+
+      Returns:
+        (ndarray,ndarray,ndarray,ndarray): Site, neighbor, image translation, and distance of each pair
+    '''
+    lattice,tol = self.lattice,self.tol
+    frac = self.positions % 1
+    cart = frac @ lattice
+    itype = np.int32 if len(cart) < 2**31 else np.int64
+    if sites is None:
+      sites = np.arange(len(cart))
+
+    # Bins no narrower than the cutoff. Sites within the cutoff lie in bins within m bins in each direction.
+    volume = abs(np.linalg.det(lattice))
+    heights = volume / np.linalg.norm(np.cross(lattice[[1,2,0]], lattice[[2,0,1]]), axis=1)
+    nbin = np.maximum(1, np.floor(heights/cutoff).astype(int))
+    m = np.ceil(cutoff / (heights/nbin) - 1e-12).astype(int)
+    bins = np.minimum(np.floor(frac*nbin).astype(int), nbin-1)
+    bin_id = np.ravel_multi_index(bins.T, nbin)
+    order = np.argsort(bin_id, kind='stable').astype(itype)
+    counts = np.bincount(bin_id, minlength=np.prod(nbin))
+    starts = np.cumsum(counts) - counts
+
+    offsets = np.array([[a,b,c] for a in range(-m[0],m[0]+1) for b in range(-m[1],m[1]+1) for c in range(-m[2],m[2]+1)])
+    rows,cols,images,dists = [],[],[],[]
+    block = max(1, 2**21 // (len(offsets) * max(1, int(np.ceil(counts.mean())))))
+    for start in range(0, len(sites), block):
+      src = sites[start:start+block].astype(itype)
+      for off in offsets:
+        target = bins[src] + off
+        image = np.floor_divide(target, nbin)
+        tbin = np.ravel_multi_index((target - image*nbin).T, nbin)
+
+        # Every site of the target bin is a candidate neighbor
+        c = counts[tbin]
+        first = np.repeat(starts[tbin] - (np.cumsum(c) - c), c)
+        j = order[first + np.arange(c.sum())]
+        keep = np.repeat(np.arange(len(src)), c)
+        d = np.linalg.norm(cart[j] - (cart[src] - image@lattice)[keep], axis=1)
+        within = (d > tol) & (d <= cutoff)
+        keep = keep[within]
+        rows.append(src[keep])
+        cols.append(j[within])
+        images.append(image[keep].astype(np.int16))
+        dists.append(d[within])
+
+    return np.concatenate(rows),np.concatenate(cols),np.concatenate(images).reshape(-1,3),np.concatenate(dists)
+
+
+  def _shells ( self, dists ):
+    '''
+      Group distances into shells separated by more than twice tol.
+
+      Returns:
+        (ndarray): Distance of each of the first nshells shells
+    '''
+    tol = self.tol
+    udist = np.unique(np.round(dists/tol) * tol)
+    return udist[np.concatenate([[True], np.diff(udist) > 2*tol])][:self.nshells]
+
+
+  def __len__ ( self ):
+    return len(self.ptr) - 1
+
+
+  @property
+  def rows ( self ):
+    '''
+      Site index of each neighbor entry
+    '''
+    return np.repeat(np.arange(len(self)), np.diff(self.ptr))
+
+
+  def neighbors ( self, site, nshells=None ):
+    '''
+      Arguments:
+        site (int): Site index
+        nshells (int): Number of shells to include. Defaults to all.
+
+      Returns:
+        (ndarray,ndarray,ndarray): Neighbor index, distance, and shell index of each neighbor of the site
+    '''
+    s = slice(self.ptr[site], self.ptr[site+1])
+    indices,distances,shells = self.indices[s],self.distances[s],self.shells[s]
+    if nshells is not None and nshells < self.nshells:
+      keep = shells < nshells
+      indices,distances,shells = indices[keep],distances[keep],shells[keep]
+    return indices,distances,shells
+
+
+  def pairs ( self, nshells=None ):
+    '''
+      Arguments:
+        nshells (int): Number of shells to include. Defaults to all.
+
+      Returns:
+        (ndarray,ndarray,ndarray): Site index, neighbor index, and shell index of every neighbor entry, as returned by utilities.neighbor_shells
+    '''
+    if nshells is not None and nshells > self.nshells:
+      raise ValueError(f'The neighbor index contains {self.nshells} shells, fewer than the {nshells} requested')
+    rows,cols,shells = self.rows,np.asarray(self.indices, dtype=int),np.asarray(self.shells, dtype=int)
+    if nshells is not None and nshells < self.nshells:
+      keep = shells < nshells
+      rows,cols,shells = rows[keep],cols[keep],shells[keep]
+    return rows,cols,shells
+
+
+  def matches ( self, lattice, positions ):
+    '''
+      Returns:
+        (bool): Whether the index was built for the given lattice and positions
+    '''
+    positions = np.asarray(positions, dtype=float)
+    return positions.shape == self.positions.shape and np.allclose(lattice, self.lattice) and np.allclose(positions, self.positions)
+
+
+  def save ( self, fname ):
+    '''
+      Write the index to a file, which may be memory-mapped by load.
+
+      Arguments:
+        fname (str): File name of the index
+    '''
+    import json
+
+    arrays = {name:np.ascontiguousarray(getattr(self, name)) for name in ('positions', 'ptr', 'indices', 'distances', 'shells', 'images')}
+    header = {'nshells':self.nshells, 'tol':self.tol, 'lattice':self.lattice.tolist(),
+              'shell_distances':self.shell_distances.tolist(), 'arrays':{}}
+
+    # Each array starts on an 8 byte boundary after the header, so the offsets depend on the header length
+    offset = 0
+    for name,a in arrays.items():
+      header['arrays'][name] = {'dtype':a.dtype.str, 'shape':list(a.shape), 'offset':offset}
+      offset += -(-a.nbytes // 8) * 8
+    text = json.dumps(header).encode()
+    start = -(-(len(NEIGHBOR_MAGIC) + 8 + len(text)) // 8) * 8
+    text += b' ' * (start - len(NEIGHBOR_MAGIC) - 8 - len(text))
+
+    with open(fname, 'wb') as f:
+      f.write(NEIGHBOR_MAGIC)
+      f.write(np.uint64(len(text)).tobytes())
+      f.write(text)
+      for name,a in arrays.items():
+        f.seek(start + header['arrays'][name]['offset'])
+        f.write(a.tobytes())
+
+
+  @classmethod
+  def load ( cls, fname, mmap=True ):
+    '''
+      Read an index written by save.
+
+      Arguments:
+        fname (str): File name of the index
+        mmap (bool): Memory-map the arrays read-only rather than reading them into memory
+
+      Returns:
+        (NeighborIndex): The neighbor index
+    '''
+    import json
+
+    with open(fname, 'rb') as f:
+      if f.read(len(NEIGHBOR_MAGIC)) != NEIGHBOR_MAGIC:
+        raise ValueError(f'{fname} is not a neighbor index file')
+      length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+      header = json.loads(f.read(length))
+    start = len(NEIGHBOR_MAGIC) + 8 + length
+
+    index = cls.__new__(cls)
+    index.nshells,index.tol = header['nshells'],header['tol']
+    index.lattice = np.array(header['lattice'])
+    index.shell_distances = np.array(header['shell_distances'])
+    index.fname = fname if mmap else None
+    for name,a in header['arrays'].items():
+      dtype,shape = np.dtype(a['dtype']),tuple(a['shape'])
+      if mmap and np.prod(shape) > 0:
+        setattr(index, name, np.memmap(fname, dtype=dtype, mode='r', offset=start+a['offset'], shape=shape))
+      else:
+        setattr(index, name, np.fromfile(fname, dtype=dtype, count=int(np.prod(shape)), offset=start+a['offset']).reshape(shape))
+    return index
+
+
+  def __getstate__ ( self ):
+    if self.fname is not None:
+      return {'fname':self.fname}
+    return self.__dict__.copy()
+
+
+  def __setstate__ ( self, state ):
+    if 'ptr' not in state:
+      state = NeighborIndex.load(state['fname']).__dict__
+    self.__dict__.update(state)
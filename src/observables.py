@@ -0,0 +1,280 @@
+import numpy as np
+
+
+class ObservableAccumulator:
+  '''
+    Streaming thermodynamic averages over a Monte Carlo trajectory, accumulated separately at each
+    temperature with memory independent of the trajectory length. Each iteration contributes the
+    configuration present after its Metropolis test, so a configuration is weighted by the number of
+    iterations it persists. The accumulated quantities are the mean and variance of the energy, the
+    heat capacity, the acceptance rate, and Warren-Cowley short-range order parameters
+
+      alpha_s(a,b) = 1 - P_s(b|a) / c_b
+
+    where P_s(b|a) is the probability that a neighbor in shell s of an a site is a b site, and c_b is the
+    concentration of b. Energies are taken to be per site, as predicted by the calculators, so the heat
+    capacity per site, in units of kB, is N var(E) / (kB T)^2.
+  '''
+
+  def __init__ ( self, lattice=None, positions=None, nshells=2, fname=None, neighbors=None ):
+    '''
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]. Short-range order is only accumulated if lattice and positions are provided.
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate of each site in the configurations passed to begin
+        nshells (int): Number of neighbor shells with short-range order parameters
+        fname (str): File name for a summary line, written each time the trajectory leaves a temperature and when the accumulator is closed
+        neighbors (NeighborIndex): Precomputed neighbor index of the sites with at least nshells shells, used in place of lattice and positions
+    '''
+    self.nsite = None
+    self.nshells = nshells
+    self.rows = None
+    if neighbors is not None:
+      self.rows,self.cols,self.shells = neighbors.pairs(nshells)
+      self.ptr = np.searchsorted(self.rows, np.arange(len(neighbors)+1))
+      self.nsite = len(neighbors)
+    elif lattice is not None and positions is not None:
+      from .utilities import neighbor_shells
+      self.rows,self.cols,self.shells,_ = neighbor_shells(lattice, positions, nshells=nshells)
+      self.ptr = np.searchsorted(self.rows, np.arange(len(positions)+1))
+      self.nsite = len(positions)
+
+    self.fname = fname
+    self.file = None
+    self.stats = {}
+    self.temperature = None
+
+
+  def __getstate__ ( self ):
+    state = self.__dict__.copy()
+    state['file'] = None
+    return state
+
+
+  def begin ( self, species, energy ):
+    '''
+      Set the initial configuration of the trajectory.
+
+      Arguments:
+        species (list): Atomic symbol, or None if vacant, of each site
+        energy (float): Energy of the configuration
+    '''
+    symbols = sorted(set(s for s in species if s is not None))
+    if None in species:
+      symbols.append(None)
+    self.symbols = symbols
+    self.index = {s:i for i,s in enumerate(symbols)}
+    self.occupation = np.array([self.index[s] for s in species], dtype=int)
+    self.nsite = len(species)
+    self.energy = energy
+    self.dwell = 0
+    self.counts = None
+    if self.rows is not None:
+      nspec = len(symbols)
+      self.counts = np.zeros((self.nshells,nspec,nspec))
+      np.add.at(self.counts, (self.shells, self.occupation[self.rows], self.occupation[self.cols]), 1)
+    self.open()
+
+
+  def step ( self, temperature, energy, accepted=False, sites=(), species=(), iterations=1 ):
+    '''
+      Record one iteration, or several iterations of which only the last may be accepted.
+
+      Arguments:
+        temperature (float): Temperature of the iteration
+        energy (float): Energy of the configuration after the Metropolis test
+        accepted (bool): Whether the trial configuration was accepted
+        sites (list): Index of each site whose occupant changed, if the trial was accepted
+        species (list): New atomic symbol, or None if vacant, of each changed site
+        iterations (int): Number of iterations recorded
+    '''
+    if temperature != self.temperature:
+      self.accumulate()
+      self.write(self.temperature)
+      self.temperature = temperature
+      self.stats.setdefault(temperature, {'iterations':0, 'accepted':0, 'weight':0, 'mean':0., 'm2':0., 'counts':0})
+
+    stats = self.stats[temperature]
+    stats['iterations'] += iterations
+    self.dwell += iterations - 1
+    if accepted:
+      stats['accepted'] += 1
+      self.accumulate()
+      self.change(sites, species)
+      self.energy = energy
+    self.dwell += 1
+
+
+  def change ( self, sites, species ):
+    '''
+      Replace the occupants of some sites, recounting the neighbor pairs that contain them.
+    '''
+    sites = np.asarray(sites, dtype=int)
+    new = np.array([self.index[s] for s in species], dtype=int)
+    if self.counts is None:
+      self.occupation[sites] = new
+      return
+
+    pairs = np.concatenate([np.arange(self.ptr[i], self.ptr[i+1]) for i in sites]) if len(sites) > 0 else np.empty(0, dtype=int)
+    r,c,s = self.rows[pairs],self.cols[pairs],self.shells[pairs]
+
+    # Pairs leaving the changed sites are listed from those sites. Pairs returning from unchanged sites are added explicitly.
+    out = ~np.isin(c, sites)
+    def tally ( sign ):
+      occ = self.occupation
+      np.add.at(self.counts, (s, occ[r], occ[c]), sign)
+      np.add.at(self.counts, (s[out], occ[c[out]], occ[r[out]]), sign)
+    tally(-1)
+    self.occupation[sites] = new
+    tally(1)
+
+
+  def accumulate ( self ):
+    '''
+      Add the current configuration, weighted by the number of iterations it has persisted, to the averages at the current temperature.
+    '''
+    if self.temperature is None or self.dwell == 0:
+      return
+    stats = self.stats[self.temperature]
+    weight = stats['weight'] + self.dwell
+    delta = self.energy - stats['mean']
+    stats['mean'] += delta * self.dwell / weight
+    stats['m2'] += delta * (self.energy - stats['mean']) * self.dwell
+    stats['weight'] = weight
+    if self.counts is not None:
+      stats['counts'] = stats['counts'] + self.dwell * self.counts
+    self.dwell = 0
+
+
+  def merge ( self, other ):
+    '''
+      Add the averages of another accumulator, such as one following another replica over the same temperatures.
+
+      Arguments:
+        other (ObservableAccumulator): Accumulator over configurations with the same sites and composition
+    '''
+    other.accumulate()
+    if not hasattr(self, 'symbols'):
+      self.symbols,self.index,self.nsite = other.symbols,other.index,other.nsite
+      self.occupation,self.counts = other.occupation.copy(),other.counts
+
+    for temp,o in other.stats.items():
+      stats = self.stats.setdefault(temp, {'iterations':0, 'accepted':0, 'weight':0, 'mean':0., 'm2':0., 'counts':0})
+      stats['iterations'] += o['iterations']
+      stats['accepted'] += o['accepted']
+      weight = stats['weight'] + o['weight']
+      if weight == 0:
+        continue
+      delta = o['mean'] - stats['mean']
+      stats['mean'] += delta * o['weight'] / weight
+      stats['m2'] += o['m2'] + delta**2 * stats['weight'] * o['weight'] / weight
+      stats['weight'] = weight
+      stats['counts'] = stats['counts'] + o['counts']
+
+
+  def results ( self, temperature ):
+    '''
+      Arguments:
+        temperature (float): Temperature of the averages
+
+      Returns:
+        (dict): Number of iterations (iterations), acceptance rate (acceptance), mean and variance of the energy (energy, variance), heat capacity per site in units of kB (heat_capacity), and short-range order parameters indexed by shell and species index (sro), with species indexing symbols
+    '''
+    from .mcsps import kB
+
+    if temperature == self.temperature:
+      self.accumulate()
+    stats = self.stats[temperature]
+    var = stats['m2'] / stats['weight'] if stats['weight'] > 0 else np.nan
+    res = {'iterations':stats['iterations'],
+           'acceptance':stats['accepted'] / max(stats['iterations'], 1),
+           'energy':stats['mean'],
+           'variance':var,
+           'heat_capacity':self.nsite * var / (kB*temperature)**2 if temperature > 0 else np.nan,
+           'sro':None}
+
+    if self.counts is not None and stats['weight'] > 0:
+      counts = stats['counts'] / stats['weight']
+      conc = np.bincount(self.occupation, minlength=len(self.symbols)) / self.nsite
+      with np.errstate(divide='ignore', invalid='ignore'):
+        prob = counts / counts.sum(axis=2, keepdims=True)
+        res['sro'] = 1 - prob / conc[None,None,:]
+    return res
+
+
+  def header ( self ):
+    '''
+      Returns:
+        (str): Column labels of the summary lines
+    '''
+    cols = ['temperature', 'iterations', 'acceptance', 'energy', 'variance', 'heat_capacity']
+    if self.counts is not None:
+      names = ['vacancy' if s is None else s for s in self.symbols]
+      for s in range(self.nshells):
+        cols += [f'alpha{s+1}({names[a]}-{names[b]})' for a in range(len(names)) for b in range(a+1, len(names))]
+    return '# ' + ' '.join(cols)
+
+
+  def line ( self, temperature ):
+    '''
+      Returns:
+        (str): Summary of the averages at a temperature
+    '''
+    res = self.results(temperature)
+    vals = [temperature, res['iterations'], res['acceptance'], res['energy'], res['variance'], res['heat_capacity']]
+    if self.counts is not None:
+      nspec = len(self.symbols)
+      for s in range(self.nshells):
+        vals += [np.nan if res['sro'] is None else res['sro'][s,a,b] for a in range(nspec) for b in range(a+1, nspec)]
+    return ' '.join(map(str, vals))
+
+
+  def open ( self ):
+    '''
+      Open the output file for appending, writing the column labels if the file is new.
+    '''
+    from os.path import getsize, isfile
+
+    if self.fname is None or self.file is not None:
+      return
+    new = not isfile(self.fname) or getsize(self.fname) == 0
+    self.file = open(self.fname, 'a')
+    if new:
+      self.file.write(self.header()+'\n')
+
+
+  def write ( self, temperature ):
+    '''
+      Append the summary line of a temperature to the output file.
+    '''
+    if self.file is None or temperature is None:
+      return
+    self.file.write(self.line(temperature)+'\n')
+    self.file.flush()
+
+
+  def summary ( self ):
+    '''
+      Returns:
+        (str): Summary lines of every temperature visited
+    '''
+    return '\n'.join([self.header()] + [self.line(t) for t in self.stats])
+
+
+  def flush ( self ):
+    '''
+      Flush the output file.
+    '''
+    if self.file is not None:
+      self.file.flush()
+
+
+  def close ( self ):
+    '''
+      Write the summary line of the current temperature and close the output file.
+    '''
+    self.accumulate()
+    self.write(self.temperature)
+    self.temperature = None
+    if self.file is not None:
+      self.file.close()
+      self.file = None
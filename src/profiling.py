@@ -0,0 +1,102 @@
+from time import perf_counter
+
+
+class PhaseProfiler:
+  '''
+    Cumulative wall time and call count of each phase of an SPS run, and the iteration rate at each
+    temperature. The routines mark the end of each phase with lap, which charges the time since the
+    previous mark to that phase. Calculators with a profiler attribute also record their own phases,
+    such as structure construction, graph building, and model inference, within the evaluate phase.
+  '''
+
+  def __init__ ( self, interval=None, fname=None ):
+    '''
+      Arguments:
+        interval (float): Time, in seconds, between summaries reported during the run. By default, the summary is only reported at the end of the run.
+        fname (str): File name to which summaries are appended. Summaries are printed if not provided.
+    '''
+    self.interval = interval
+    self.fname = fname
+    self.times = {}
+    self.calls = {}
+    self.temperatures = {}
+    self.start = self.last_report = perf_counter()
+
+
+  def now ( self ):
+    '''
+      Returns:
+        (float): Current time, used to mark the start of a phase
+    '''
+    return perf_counter()
+
+
+  def lap ( self, phase, tick ):
+    '''
+      Charge the time since tick to a phase.
+
+      Arguments:
+        phase (str): Name of the phase
+        tick (float): Time at which the phase started
+
+      Returns:
+        (float): Current time, which marks the start of the next phase
+    '''
+    now = perf_counter()
+    self.times[phase] = self.times.get(phase, 0.) + now - tick
+    self.calls[phase] = self.calls.get(phase, 0) + 1
+    return now
+
+
+  def add ( self, phase, seconds, calls=1 ):
+    '''
+      Charge a measured time to a phase.
+    '''
+    self.times[phase] = self.times.get(phase, 0.) + seconds
+    self.calls[phase] = self.calls.get(phase, 0) + calls
+
+
+  def advance ( self, temperature, nstep, seconds ):
+    '''
+      Record iterations completed at a temperature, reporting the summary if interval has passed since the last report.
+
+      Arguments:
+        temperature (float): Temperature of the iterations
+        nstep (int): Number of iterations
+        seconds (float): Wall time of the iterations
+    '''
+    steps = self.temperatures.setdefault(temperature, [0, 0.])
+    steps[0] += nstep
+    steps[1] += seconds
+    if self.interval is not None and perf_counter() - self.last_report >= self.interval:
+      self.report()
+
+
+  def summary ( self ):
+    '''
+      Returns:
+        (str): Time, share of the elapsed time, calls, and time per call of each phase, followed by the iterations per second at each temperature
+    '''
+    elapsed = perf_counter() - self.start
+    lines = [f'Elapsed time: {elapsed:.3f} s',
+             f'{"phase":>12} {"seconds":>10} {"share":>7} {"calls":>10} {"us/call":>10}']
+    for phase in sorted(self.times, key=self.times.get, reverse=True):
+      t,n = self.times[phase],self.calls[phase]
+      lines.append(f'{phase:>12} {t:10.3f} {100*t/elapsed:6.1f}% {n:10d} {1e6*t/max(n,1):10.2f}')
+
+    lines.append(f'{"temperature":>12} {"steps":>10} {"steps/s":>10}')
+    for temp,(n,t) in self.temperatures.items():
+      lines.append(f'{temp:12.5g} {n:10d} {n/t if t > 0 else float("nan"):10.1f}')
+    return '\n'.join(lines)
+
+
+  def report ( self ):
+    '''
+      Print the summary, or append it to fname.
+    '''
+    self.last_report = perf_counter()
+    if self.fname is None:
+      print(self.summary(), flush=True)
+    else:
+      with open(self.fname, 'a') as f:
+        f.write(self.summary()+'\n\n')
@@ -0,0 +1,176 @@
+import numpy as np
+
+
+class AdaptiveSchedule:
+  '''
+    Controller for the number of swaps per trial and the number of iterations at each temperature
+    of an annealing trajectory. Each temperature is advanced in blocks, and after every block:
+
+      - the number of swaps restored after each accepted trial is scaled by the ratio of the acceptance
+        rate of the block to target_acceptance, limited to a factor of two
+      - the temperature ends early once the mean energies of the blocks show no drift, comparing the
+        earlier and later halves, unless its heat capacity exceeds the average of the previous temperatures
+      - a temperature whose heat capacity exceeds that average is extended past its nominal number of
+        iterations, up to max_factor times, using the iterations saved by ending other temperatures early
+
+    The total number of iterations never exceeds the nominal total, and iterations are moved toward
+    the temperatures with the largest energy fluctuations, near a heat capacity peak.
+  '''
+
+  def __init__ ( self, target_acceptance=0.3, block=100, min_blocks=4, tolerance=1., max_factor=4., nswap_max=None ):
+    '''
+      Arguments:
+        target_acceptance (float): Acceptance rate targeted by tuning the number of swaps per trial
+        block (int): Number of iterations between updates
+        min_blocks (int): Minimum number of blocks at each temperature before it may end early
+        tolerance (float): A temperature ends early when the difference between the mean energies of the earlier and later halves of its blocks is within tolerance standard errors
+        max_factor (float): Maximum ratio of the iterations at a temperature to its nominal number
+        nswap_max (int): Maximum number of swaps per trial. Defaults to the number of swappable sites.
+    '''
+    if block < 1:
+      raise ValueError('block must be a positive integer')
+    self.target_acceptance = target_acceptance
+    self.block = block
+    self.min_blocks = min_blocks
+    self.tolerance = tolerance
+    self.max_factor = max_factor
+    self.nswap_max = nswap_max
+
+    self.nswap = None
+    self.nsite = None
+    self.bank = 0
+    self.temperature = None
+    self.history = []
+
+
+  def begin ( self, temperature, nominal, nswap, nsite ):
+    '''
+      Start a temperature, returning the iterations it did not use to the shared balance.
+
+      Arguments:
+        temperature (float): Temperature of the Metropolis condition
+        nominal (int): Nominal number of iterations at the temperature
+        nswap (int): Number of swaps per trial, used only at the first temperature
+        nsite (int): Number of swappable sites
+    '''
+    if self.temperature is not None:
+      self.end()
+    if self.nswap is None:
+      self.nswap = nswap
+      self.nsite = nsite
+      if self.nswap_max is None:
+        self.nswap_max = nsite
+
+    self.temperature = temperature
+    self.nominal = nominal
+    self.limit = nominal
+    self.extended = False
+    self.steps = 0
+    self.blocks = []
+    self.block_energy = 0.
+    self.block_accepted = 0
+    self.block_steps = 0
+    self.accepted = 0
+    self.mean = 0.
+    self.m2 = 0.
+
+
+  def record ( self, energy, accepted, iterations=1 ):
+    '''
+      Record iterations at the current temperature with the same energy.
+
+      Arguments:
+        energy (float): Energy of the configuration after the Metropolis test
+        accepted (bool): Whether the trial configuration of one of the iterations was accepted
+        iterations (int): Number of iterations
+    '''
+    self.steps += iterations
+    self.block_steps += iterations
+    self.block_energy += energy * iterations
+    if accepted:
+      self.block_accepted += 1
+      self.accepted += 1
+    delta = energy - self.mean
+    self.mean += delta * iterations / self.steps
+    self.m2 += delta * (energy - self.mean) * iterations
+
+
+  def heat_capacity ( self ):
+    '''
+      Returns:
+        (float): Heat capacity per site, in units of kB, from the energies recorded at the current temperature, or nan at zero temperature
+    '''
+    from .mcsps import kB
+
+    if self.temperature == 0 or self.steps == 0:
+      return np.nan
+    return self.nsite * (self.m2/self.steps) / (kB*self.temperature)**2
+
+
+  def reference ( self ):
+    '''
+      Returns:
+        (float): Mean heat capacity of the previous temperatures, or nan if none is defined
+    '''
+    cap = [h['heat_capacity'] for h in self.history if np.isfinite(h['heat_capacity'])]
+    return np.mean(cap) if len(cap) > 0 else np.nan
+
+
+  def update ( self ):
+    '''
+      Complete a block, tuning the number of swaps and the iteration limit of the current temperature.
+    '''
+    if self.block_steps == 0:
+      return
+
+    # Larger moves lower the acceptance rate. The number of swaps changes by at most a factor of two per block.
+    acceptance = self.block_accepted / self.block_steps
+    scale = self.nswap * min(max(acceptance/self.target_acceptance, 0.5), 2.)
+    if acceptance > self.target_acceptance:
+      self.nswap = min(int(np.ceil(scale)), self.nswap_max)
+    elif acceptance < self.target_acceptance:
+      self.nswap = max(int(scale), 1)
+    self.blocks.append(self.block_energy / self.block_steps)
+    self.block_energy,self.block_accepted,self.block_steps = 0.,0,0
+
+    cap,ref = self.heat_capacity(),self.reference()
+    peak = np.isfinite(cap) and np.isfinite(ref) and cap > ref
+
+    # End the temperature once the block means no longer drift
+    nblock = len(self.blocks)
+    if not peak and nblock >= self.min_blocks and self.steps < self.limit:
+      half = nblock // 2
+      early,late = self.blocks[:nblock-half],self.blocks[nblock-half:]
+      drift = abs(np.mean(late) - np.mean(early))
+      if drift <= self.tolerance * np.std(self.blocks) / np.sqrt(nblock):
+        self.limit = self.steps
+
+    # Extend a temperature with a large heat capacity from the balance of unused iterations
+    if peak and not self.extended and self.steps >= self.limit:
+      self.extended = True
+      extra = int(round(self.nominal * (min(cap/ref, self.max_factor) - 1)))
+      extra = min(extra, self.bank)
+      self.limit += extra
+      self.bank -= extra
+
+
+  def end ( self ):
+    '''
+      Finish the current temperature, recording its summary and returning unused iterations to the balance.
+    '''
+    self.bank += max(self.nominal - self.steps, 0)
+    self.history.append({'temperature':self.temperature, 'nominal':self.nominal, 'iterations':self.steps,
+                         'acceptance':self.accepted / max(self.steps, 1), 'nswap':self.nswap,
+                         'heat_capacity':self.heat_capacity()})
+    self.temperature = None
+
+
+  def summary ( self ):
+    '''
+      Returns:
+        (str): Nominal and performed iterations, acceptance rate, final number of swaps, and heat capacity at each completed temperature
+    '''
+    lines = ['# temperature nominal iterations acceptance nswap heat_capacity']
+    for h in self.history:
+      lines.append(' '.join(map(str, [h['temperature'], h['nominal'], h['iterations'], h['acceptance'], h['nswap'], h['heat_capacity']])))
+    return '\n'.join(lines)
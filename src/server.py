@@ -0,0 +1,176 @@
+from .calculators import Calculator
+import numpy as np
+
+
+def _serve ( calculator, requests, responses, max_batch, wait ):
+  '''
+    Process target for EvaluationServer. Pending requests from all clients are combined, grouped by
+    geometry, and evaluated with one predict_many call per group.
+
+    Arguments:
+      calculator (callable): Called with no arguments to create the Calculator owned by this process
+      requests (Queue): Shared queue of (client, request, lattice, species_batch, positions) tuples, or None to stop
+      responses (list): Response queue of each client
+      max_batch (int): Maximum number of structures combined into a single evaluation
+      wait (float): Time, in seconds, to wait for additional requests before evaluating a partial batch
+  '''
+  from queue import Empty
+
+  calculator = calculator()
+
+  running = True
+  while running:
+
+    # Block for one request, then collect any others that arrive within the wait time
+    req = requests.get()
+    if req is None:
+      break
+    pending,nstruct = [req],len(req[3])
+    while nstruct < max_batch:
+      try:
+        req = requests.get(timeout=wait)
+      except Empty:
+        break
+      if req is None:
+        running = False
+        break
+      pending.append(req)
+      nstruct += len(req[3])
+
+    # Group the requests that share a lattice and set of positions
+    groups = {}
+    for req in pending:
+      key = (req[2].tobytes(), req[4].tobytes())
+      groups.setdefault(key, []).append(req)
+
+    for reqs in groups.values():
+      species_batch = [s for req in reqs for s in req[3]]
+      try:
+        enes = calculator.predict_many(reqs[0][2], species_batch, reqs[0][4])
+      except Exception as err:
+        for client,rid,_,_,_ in reqs:
+          responses[client].put((rid, err))
+        continue
+
+      start = 0
+      for client,rid,_,sb,_ in reqs:
+        responses[client].put((rid, np.asarray(enes[start:start+len(sb)])))
+        start += len(sb)
+
+
+
+class RemoteCalculator (Calculator):
+  '''
+    Calculator that forwards energy evaluations to an EvaluationServer. Instances are created by
+    EvaluationServer.client and passed to walker processes as Process arguments.
+  '''
+
+  def __init__ ( self, requests, responses, client ):
+    self.requests = requests
+    self.responses = responses
+    self.client = client
+    self.nrequest = 0
+
+
+  def predict_formation_energy ( self, lattice, species, positions ):
+    return self.predict_many(lattice, [species], positions)[0]
+
+
+  def predict_many ( self, lattice, species_batch, positions ):
+    self.nrequest += 1
+    lattice = np.asarray(lattice, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    self.requests.put((self.client, self.nrequest, lattice, [list(s) for s in species_batch], positions))
+
+    # Discard responses to earlier requests that were abandoned
+    rid,enes = self.responses.get()
+    while rid != self.nrequest:
+      rid,enes = self.responses.get()
+
+    if isinstance(enes, Exception):
+      raise enes
+    return enes
+
+
+
+class EvaluationServer:
+  '''
+    One or more inference processes which own the energy model and serve many lightweight walker
+    processes. Requests pending from all walkers are evaluated together in batches, so the model
+    is loaded once per server process rather than once per walker.
+
+    Example:
+      server = EvaluationServer(MEGNet_Calculator, nclients=16)
+      server.start()
+      walkers = [Process(target=sps_fixed, args=(...), kwargs={'calculator':server.client(i)}) for i in range(16)]
+      ...
+      server.stop()
+  '''
+
+  def __init__ ( self, calculator=None, nclients=1, nservers=1, max_batch=256, wait=0.002 ):
+    '''
+      Arguments:
+        calculator (callable): Calculator class, or other picklable callable returning a Calculator, instantiated once in each server process. Defaults to MEGNet_Calculator.
+        nclients (int): Number of clients, each of which must be used by only one walker process
+        nservers (int): Number of inference processes sharing the request queue
+        max_batch (int): Maximum number of structures combined into a single evaluation
+        wait (float): Time, in seconds, to wait for additional requests before evaluating a partial batch
+    '''
+    from multiprocessing import Queue
+
+    if calculator is None:
+      from .calculators import MEGNet_Calculator
+      calculator = MEGNet_Calculator
+
+    self.calculator = calculator
+    self.nservers = nservers
+    self.max_batch = max_batch
+    self.wait = wait
+    self.requests = Queue()
+    self.responses = [Queue() for _ in range(nclients)]
+    self.procs = []
+
+
+  def __enter__ ( self ):
+    self.start()
+    return self
+
+
+  def __exit__ ( self, *args ):
+    self.stop()
+
+
+  def client ( self, index ):
+    '''
+      Arguments:
+        index (int): Client index, less than nclients
+
+      Returns:
+        (RemoteCalculator): Calculator forwarding evaluations to this server
+    '''
+    if not 0 <= index < len(self.responses):
+      raise ValueError(f'Client index must be between 0 and {len(self.responses)-1}')
+    return RemoteCalculator(self.requests, self.responses[index], index)
+
+
+  def start ( self ):
+    '''
+      Start the inference processes.
+    '''
+    from multiprocessing import Process
+
+    for _ in range(self.nservers):
+      args = (self.calculator, self.requests, self.responses, self.max_batch, self.wait)
+      self.procs.append(Process(target=_serve, args=args, daemon=True))
+      self.procs[-1].start()
+
+
+  def stop ( self ):
+    '''
+      Stop the inference processes after the pending requests are evaluated.
+    '''
+    for _ in self.procs:
+      self.requests.put(None)
+    for p in self.procs:
+      p.join()
+    self.procs = []
@@ -0,0 +1,416 @@
+import numpy as np
+
+
+class SitePools:
+  '''
+    Integer species representation of a configuration, with the swappable sites grouped by sublattice
+    and then by species. The swappable site indices are stored in a single array in this order, so
+    the sites of a sublattice are contiguous, and the sites of that sublattice with any other species
+    form at most two contiguous ranges. A swap between sites of the same sublattice with different
+    species is then proposed with two vectorized draws, without string comparisons or rejected draws.
+    Sublattices with a single species are never drawn.
+  '''
+
+  def __init__ ( self, species, nfixed=0, symbols=None, sublattices=None, weights=None ):
+    '''
+      Arguments:
+        species (list): Atomic symbol for each site
+        nfixed (int): Number of sites excluded from swaps, which must be placed at the beginning of the list
+        symbols (list): Atomic symbol of each species index. Defaults to the sorted symbols present in species.
+        sublattices (list): Sublattice label of each site. Swaps only interchange sites of the same sublattice. By default, all swappable sites form one sublattice.
+        weights (dict): Relative frequency of swaps on each sublattice, by label. Defaults to the number of swappable sites of each sublattice.
+    '''
+    if symbols is None:
+      symbols = sorted(set(species))
+    index = {s:i for i,s in enumerate(symbols)}
+    if sublattices is None:
+      sublattices = len(species) * [0]
+    if len(sublattices) != len(species):
+      raise ValueError('sublattices must contain one label for each site')
+
+    self.nfixed = nfixed
+    self.symbols = np.array(symbols, dtype=object)
+    self.species = np.array([index[s] for s in species], dtype=np.int8 if len(symbols) < 128 else np.int16)
+    self.labels = sorted(set(sublattices[nfixed:]), key=str)
+    label_index = {l:i for i,l in enumerate(self.labels)}
+    self.sublattice = np.array([label_index.get(l, -1) for l in sublattices], dtype=np.intp)
+    self.sublattice[:nfixed] = -1
+    nspec,nsub = len(symbols),len(self.labels)
+
+    # Swappable sites grouped by sublattice and species, and the slot of each site in that ordering
+    key = self.sublattice[nfixed:]*nspec + self.species[nfixed:]
+    self.order = nfixed + np.argsort(key, kind='stable')
+    self.slot = np.zeros(len(species), dtype=np.intp)
+    self.slot[self.order] = np.arange(len(self.order))
+    self.counts = np.bincount(key, minlength=nsub*nspec)
+    self.offsets = np.cumsum(self.counts) - self.counts
+    self.sub_counts = self.counts.reshape(nsub,nspec).sum(axis=1)
+    self.sub_offsets = np.cumsum(self.sub_counts) - self.sub_counts
+
+    # Probability of drawing each sublattice, which is zero for sublattices without two species
+    swappable = np.count_nonzero(self.counts.reshape(nsub,nspec), axis=1) > 1
+    if not np.any(swappable):
+      raise ValueError('The swappable sites of at least one sublattice must contain more than one species')
+    if weights is None:
+      weights = dict(zip(self.labels, self.sub_counts))
+    if any(l not in label_index for l in weights):
+      raise ValueError(f'weights contains sublattices not among the swappable sites: {[l for l in weights if l not in label_index]}')
+    self.weights = np.array([float(weights.get(l, 0.)) for l in self.labels]) * swappable
+    if np.any(self.weights < 0) or self.weights.sum() <= 0:
+      raise ValueError('The weights of the swappable sublattices must be non-negative, and not all zero')
+    self.weights /= self.weights.sum()
+    self.bounds = np.cumsum(self.weights)
+    self.bounds[np.flatnonzero(self.weights)[-1]:] = 1.
+
+
+  def __len__ ( self ):
+    return len(self.species)
+
+
+  def decode ( self, species=None ):
+    '''
+      Arguments:
+        species (ndarray): Species index of each site. Defaults to the current configuration.
+
+      Returns:
+        (list): Atomic symbol of each site
+    '''
+    if species is None:
+      species = self.species
+    return self.symbols[species].tolist()
+
+
+  def propose ( self, nswaps=1 ):
+    '''
+      Draw swaps between sites of the same sublattice with different species. The sublattice of each
+      pair is drawn with probability given by the weights, the first site is uniform over the sites of
+      the sublattice, and the second is uniform over those with another species. With a single
+      sublattice, this is the distribution of sps_swap. As in sps_swap, every pair is drawn from the
+      current configuration.
+
+      Arguments:
+        nswaps (int): Number of swaps
+
+      Returns:
+        (list): The (i,j) site index pairs
+    '''
+    r = np.random.random((2,nswaps))
+    pairs = np.empty((nswaps,2), dtype=np.intp)
+
+    # The first draw selects the sublattice, and its position within the sublattice's share selects the first site
+    sub = np.minimum(np.searchsorted(self.bounds, r[0], side='right'), len(self.bounds)-1)
+    start,nsub = self.sub_offsets[sub],self.sub_counts[sub]
+    fslot = np.minimum(((r[0] - (self.bounds[sub] - self.weights[sub])) / self.weights[sub] * nsub).astype(np.intp), nsub-1)
+    pairs[:,0] = self.order[start + fslot]
+    key = sub*len(self.symbols) + self.species[pairs[:,0]]
+    count = self.counts[key]
+
+    # Skip over the range of the first site's species
+    u = (r[1]*(nsub-count)).astype(np.intp)
+    u += (u >= self.offsets[key] - start) * count
+    pairs[:,1] = self.order[start + u]
+    return pairs.tolist()
+
+
+  def candidates ( self ):
+    '''
+      Every swap that propose can draw from the current configuration, for rejection-free sampling.
+
+      Returns:
+        (ndarray,ndarray): Kx2 site index pairs, and the probability that a single swap drawn by propose interchanges each pair
+    '''
+    nspec = len(self.symbols)
+    pairs,prob = [np.empty((0,2), dtype=np.intp)],[np.empty(0)]
+    for s in np.flatnonzero(self.weights):
+      n = self.sub_counts[s]
+      for a in range(nspec):
+        for b in range(a+1, nspec):
+          ka,kb = s*nspec+a,s*nspec+b
+          if self.counts[ka] == 0 or self.counts[kb] == 0:
+            continue
+
+          # Either site may be drawn first, and the second is drawn from the sites of the other species
+          sa = self.order[self.offsets[ka]:self.offsets[ka]+self.counts[ka]]
+          sb = self.order[self.offsets[kb]:self.offsets[kb]+self.counts[kb]]
+          pairs.append(np.stack(np.meshgrid(sa, sb, indexing='ij'), axis=-1).reshape(-1,2))
+          q = self.weights[s] / n * (1/(n-self.counts[ka]) + 1/(n-self.counts[kb]))
+          prob.append(np.full(len(sa)*len(sb), q))
+    return np.concatenate(pairs),np.concatenate(prob)
+
+
+  def apply ( self, pairs ):
+    '''
+      Arguments:
+        pairs (list): Site index pairs to interchange, in order
+
+      Returns:
+        (ndarray): Species index of each site after the swaps. The current configuration is unchanged.
+    '''
+    species = self.species.copy()
+    for i,j in pairs:
+      species[i],species[j] = species[j],species[i]
+    return species
+
+
+  def swap ( self, i, j ):
+    '''
+      Interchange the species of two sites in place.
+    '''
+    si,sj = self.slot[i],self.slot[j]
+    self.species[i],self.species[j] = self.species[j],self.species[i]
+    self.order[si],self.order[sj] = j,i
+    self.slot[i],self.slot[j] = sj,si
+
+
+
+class ReplicaPools:
+  '''
+    Integer species of M configurations with a common composition, stored as an MxN array, with the
+    swappable sites of each configuration grouped by species as in SitePools. Swaps are proposed
+    and applied for many configurations at once.
+  '''
+
+  def __init__ ( self, species_batch, nfixed=0, symbols=None ):
+    '''
+      Arguments:
+        species_batch (list): Atomic symbol for each site of each of M configurations
+        nfixed (int): Number of sites excluded from swaps, which must be placed at the beginning of each list
+        symbols (list): Atomic symbol of each species index. Defaults to the sorted symbols present in species_batch.
+    '''
+    if symbols is None:
+      symbols = sorted(set(s for species in species_batch for s in species))
+    index = {s:i for i,s in enumerate(symbols)}
+
+    self.nfixed = nfixed
+    self.symbols = np.array(symbols, dtype=object)
+    self.species = np.array([[index[s] for s in species] for species in species_batch],
+                            dtype=np.int8 if len(symbols) < 128 else np.int16)
+
+    free = self.species[:,nfixed:]
+    self.counts = np.bincount(free[0], minlength=len(symbols))
+    if any(np.any(np.bincount(f, minlength=len(symbols)) != self.counts) for f in free):
+      raise ValueError('Every configuration must have the same composition on the swappable sites')
+    if np.count_nonzero(self.counts) < 2:
+      raise ValueError('The swappable sites must contain more than one species')
+    self.offsets = np.cumsum(self.counts) - self.counts
+
+    # Swappable sites of each configuration grouped by species, the slot of each site, and the species of each slot
+    self.order = nfixed + np.argsort(free, axis=1, kind='stable')
+    self.slot = np.zeros(self.species.shape, dtype=np.intp)
+    np.put_along_axis(self.slot, self.order, np.arange(self.order.shape[1])[None,:], axis=1)
+    self.slot_species = np.repeat(np.arange(len(symbols)), self.counts)
+
+
+  def __len__ ( self ):
+    return len(self.species)
+
+
+  def decode ( self, row ):
+    '''
+      Arguments:
+        row (int): Index of a configuration
+
+      Returns:
+        (list): Atomic symbol of each site of the configuration
+    '''
+    return self.symbols[self.species[row]].tolist()
+
+
+  def propose ( self, rows ):
+    '''
+      Draw one swap between swappable sites of different species in each of several configurations,
+      with the same distribution as SitePools.propose.
+
+      Arguments:
+        rows (ndarray): Index of each configuration
+
+      Returns:
+        (ndarray,ndarray): First and second site of each swap
+    '''
+    nfree = self.order.shape[1]
+    r = np.random.random((2,len(rows)))
+    fslot = (r[0]*nfree).astype(np.intp)
+    spec = self.slot_species[fslot]
+    count = self.counts[spec]
+
+    # Skip over the range of the first site's species
+    u = (r[1]*(nfree-count)).astype(np.intp)
+    u += (u >= self.offsets[spec]) * count
+    return self.order[rows,fslot],self.order[rows,u]
+
+
+  def swap ( self, rows, i, j ):
+    '''
+      Interchange the species of one pair of sites in each of several configurations, in place.
+      Repeating a swap restores the configurations.
+
+      Arguments:
+        rows (ndarray): Index of each configuration, without repeats
+        i (ndarray): First site of each swap
+        j (ndarray): Second site of each swap
+    '''
+    si,sj = self.slot[rows,i],self.slot[rows,j]
+    self.species[rows,i],self.species[rows,j] = self.species[rows,j],self.species[rows,i]
+    self.order[rows,si],self.order[rows,sj] = j,i
+    self.slot[rows,i],self.slot[rows,j] = sj,si
+
+
+
+class VacancyPools:
+  '''
+    Occupation of a set of sites by distinguishable occupants, with the remaining sites vacant. The
+    occupant of each site and the site of each occupant are stored as integer arrays, and the sites
+    are grouped by the species of their content, counting vacant sites as one more species, as in
+    SitePools. Moves interchange the contents of two sites in place, so a trial is undone by
+    repeating its moves in reverse, without copying the occupation.
+
+    A move draws its target either uniformly over the sites with a different species from the moved
+    occupant, or, as a hop, uniformly over the neighbor slots of its site, where only vacant neighbors
+    are moved to. The hop proposal is symmetric because every site is given the same number of slots,
+    the largest number of neighbors, and slots past the neighbors of a site leave the occupant in place.
+  '''
+
+  def __init__ ( self, occupants, nsite, sites=None, symbols=None, neighbors=None ):
+    '''
+      Arguments:
+        occupants (list): Atomic symbol of each occupant
+        nsite (int): Number of sites, which must be at least the number of occupants
+        sites (ndarray): Initial site of each occupant. Defaults to the first sites, in order.
+        symbols (list): Atomic symbol of each species index. Defaults to the sorted symbols present in occupants.
+        neighbors (NeighborIndex): Neighbors of each site, which enables hops
+    '''
+    if symbols is None:
+      symbols = sorted(set(occupants))
+    index = {s:i for i,s in enumerate(symbols)}
+    if sites is None:
+      sites = np.arange(len(occupants))
+    if nsite < len(occupants):
+      raise ValueError(f'{len(occupants)} occupants cannot be placed on {nsite} sites')
+    if neighbors is not None and len(neighbors) != nsite:
+      raise ValueError(f'The neighbor index has {len(neighbors)} sites, but there are {nsite} sites')
+
+    # Species of each occupant, with the vacancy species (-1) in the last entry
+    self.symbols = np.array(list(symbols) + [None], dtype=object)
+    self.codes = np.array([index[s] for s in occupants] + [-1], dtype=np.int16)
+    self.site = np.array(sites, dtype=np.intp)
+    self.occupant = np.full(nsite, -1, dtype=np.intp)
+    self.occupant[self.site] = np.arange(len(occupants))
+
+    # Sites grouped by the species of their content, with vacant sites last, and the slot of each site in that ordering
+    group = self.content % len(self.symbols)
+    self.order = np.argsort(group, kind='stable')
+    self.slot = np.zeros(nsite, dtype=np.intp)
+    self.slot[self.order] = np.arange(nsite)
+    self.counts = np.bincount(group, minlength=len(self.symbols))
+    self.offsets = np.cumsum(self.counts) - self.counts
+    if np.any(self.counts[self.codes[:-1]] == nsite):
+      raise ValueError('The sites must contain more than one species, counting vacancies')
+
+    self.neighbors = neighbors
+    if neighbors is not None:
+      self.ptr = np.asarray(neighbors.ptr)
+      self.indices = np.asarray(neighbors.indices, dtype=np.intp)
+      self.nslot = int(np.diff(self.ptr).max())
+
+
+  def __len__ ( self ):
+    return len(self.occupant)
+
+
+  @property
+  def content ( self ):
+    '''
+      Species index of the occupant of each site, or -1 if vacant
+    '''
+    return self.codes[self.occupant]
+
+
+  def decode ( self ):
+    '''
+      Returns:
+        (list): Atomic symbol of the occupant of each site, or None if vacant
+    '''
+    return self.symbols[self.content].tolist()
+
+
+  def swap ( self, a, b ):
+    '''
+      Interchange the contents of two sites in place. Repeating a swap restores the occupation.
+    '''
+    occupant,slot = self.occupant,self.slot
+    oa = occupant[a]
+    ob = occupant[b]
+    occupant[a] = ob
+    occupant[b] = oa
+    if oa >= 0:
+      self.site[oa] = b
+    if ob >= 0:
+      self.site[ob] = a
+    sa = slot[a]
+    sb = slot[b]
+    self.order[sa] = b
+    self.order[sb] = a
+    slot[a] = sb
+    slot[b] = sa
+
+
+  def move ( self, occupant, nmoves=1, hop=False ):
+    '''
+      Move one occupant repeatedly, in place. Each move interchanges the contents of its site and the
+      target site, which has a different species, or is a vacant neighbor if hop is set.
+
+      Arguments:
+        occupant (int): Index of the moved occupant
+        nmoves (int): Number of moves
+        hop (bool): Draw the targets from the neighbors of the occupant's site
+
+      Returns:
+        (list): The (a,b) site pairs interchanged, in order, which may be fewer than nmoves for hops
+    '''
+    r = np.random.random(nmoves).tolist()
+    code = self.codes[occupant]
+    count,offset = int(self.counts[code]),int(self.offsets[code])
+    nother = len(self.order) - count
+    moves = []
+    for x in r:
+      a = int(self.site[occupant])
+      if hop:
+        k = int(x*self.nslot)
+        if k >= self.ptr[a+1] - self.ptr[a]:
+          continue
+        b = int(self.indices[self.ptr[a]+k])
+        if self.occupant[b] >= 0:
+          continue
+      else:
+        # Skip over the range of the occupant's species
+        u = int(x*nother)
+        if u >= offset:
+          u += count
+        b = int(self.order[u])
+      self.swap(a, b)
+      moves.append((a,b))
+    return moves
+
+
+  def undo ( self, moves ):
+    '''
+      Reverse the moves returned by move, restoring the previous occupation.
+    '''
+    for a,b in reversed(moves):
+      self.swap(a, b)
+
+
+  def changed ( self, moves ):
+    '''
+      Arguments:
+        moves (list): Site pairs interchanged since the previous occupation
+
+      Returns:
+        (list): Sorted indices of the sites whose species differs from the previous occupation
+    '''
+    current = lambda s: self.codes[self.occupant[s]]
+    content = {}
+    for a,b in reversed(moves):
+      ca,cb = content.get(a, current(a)),content.get(b, current(b))
+      content[a],content[b] = cb,ca
+    return sorted(s for s,c in content.items() if c != current(s))
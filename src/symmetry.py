@@ -0,0 +1,181 @@
+import numpy as np
+
+# Number of candidate operations below which canonical compares the full images
+CANONICAL_CANDIDATES = 8
+
+
+class SiteSymmetry:
+  '''
+    Site permutation tables for the symmetry operations of a fixed atomic geometry.
+    Occupations related by a symmetry operation have the same energy, so each occupation
+    can be replaced by a canonical representative before energy evaluation.
+
+    For sps_fixed, positions are all sites and labels are the species of the fixed sites, with
+    None for every swappable site. For sps_vacancy, positions are the vacancy sites and the
+    fixed framework is provided through fixed_positions and fixed_labels.
+  '''
+
+  def __init__ ( self,
+                 lattice,
+                 positions,
+                 labels=None,
+                 fixed_positions=None,
+                 fixed_labels=None,
+                 point_group=True,
+                 symprec=1e-3 ):
+    '''
+      Arguments:
+        lattice (list or ndarray): 3x3 matrix representing the three lattice vectors [R1, R2, R3]
+        positions (list or ndarray): Nx3 matrix, with the crystal 3-coordinate of each site whose occupation is canonicalized
+        labels (list): Label for each site. Sites are only mapped onto sites with the same label. If None, all sites are equivalent.
+        fixed_positions (list or ndarray): Mx3 matrix of framework sites, which must be preserved by each operation but are not part of the occupation
+        fixed_labels (list): Label, typically the atomic symbol, of each framework site
+        point_group (bool): Include rotations from spglib, if it is installed. Otherwise only lattice translations are used.
+        symprec (float): Tolerance, in Angstrom, for matching sites. The same tolerance is passed to spglib.
+    '''
+
+    lattice = np.array(lattice, dtype=float)
+    positions = np.array(positions, dtype=float).reshape(-1,3)
+    if labels is None:
+      labels = len(positions) * [None]
+    if fixed_positions is None or fixed_labels is None:
+      fixed_positions,fixed_labels = np.empty((0,3), dtype=float),[]
+    fixed_positions = np.array(fixed_positions, dtype=float).reshape(-1,3)
+
+    if len(labels) != len(positions):
+      raise ValueError('labels must contain one entry for each position')
+    if len(fixed_labels) != len(fixed_positions):
+      raise ValueError('fixed_labels must contain one entry for each fixed position')
+
+    # Distinguish occupied sites from framework sites carrying the same label
+    tags = [('site',l) for l in labels] + [('fixed',l) for l in fixed_labels]
+    codes = {t:i for i,t in enumerate(dict.fromkeys(tags))}
+    self.nsite = len(positions)
+    self.symprec = symprec
+    self.lattice = lattice
+    self.numbers = np.array([codes[t] for t in tags], dtype=int)
+    self.positions = np.concatenate([positions, fixed_positions]) % 1
+
+    # Sorted lookup from rounded crystal coordinate to site index. The grid along each lattice vector has a power of
+    # ten points, so that simple fractions do not fall on a boundary between grid points, with spacing of at least
+    # twice symprec, so that a site within symprec of a point rounds to its grid point or the neighbor on its side.
+    self.ngrid = 10**np.clip(np.floor(np.log10(np.linalg.norm(lattice, axis=1)/(2*symprec))), 0, 6).astype(np.int64)
+    keys = self.grid_keys(self.positions)
+    self.key_order = np.argsort(keys)
+    self.sorted_keys = keys[self.key_order]
+    if np.any(np.diff(self.sorted_keys) == 0):
+      raise ValueError('Sites are too close together to be distinguished with symprec')
+
+    operations = None
+    if point_group:
+      operations = self.spglib_operations(lattice)
+    if operations is None:
+      operations = self.translation_operations()
+
+    perms = [self.permutation(rot, trans) for rot,trans in operations]
+    perms = np.unique([p for p in perms if p is not None], axis=0)
+    self.permutations = perms[:,:self.nsite]
+
+
+  def __len__ ( self ):
+    return len(self.permutations)
+
+
+  def grid_keys ( self, positions ):
+    '''
+      Integer key for each crystal coordinate, rounded to the symprec grid.
+    '''
+    grid = np.round(positions * self.ngrid).astype(np.int64) % self.ngrid
+    return (grid[:,0] * self.ngrid[1] + grid[:,1]) * self.ngrid[2] + grid[:,2]
+
+
+  def permutation ( self, rotation, translation ):
+    '''
+      Map each site through a symmetry operation.
+
+      Arguments:
+        rotation (ndarray): 3x3 integer rotation matrix in crystal coordinates
+        translation (ndarray): Translation 3-vector in crystal coordinates
+
+      Returns:
+        (ndarray): Index of the image of each site, or None if the operation does not preserve the sites and their labels
+    '''
+    images = self.positions @ np.transpose(rotation) + translation
+    keys = self.grid_keys(images)
+    inds = np.minimum(np.searchsorted(self.sorted_keys, keys), len(keys)-1)
+    perm = self.key_order[inds]
+    d = images - self.positions[perm]
+    near = np.linalg.norm((d - np.round(d)) @ self.lattice, axis=1) <= self.symprec
+
+    # Images rounded across a grid boundary from their site are found in the neighboring grid cells
+    miss = np.flatnonzero((self.sorted_keys[inds] != keys) | ~near)
+    if len(miss) > 0:
+      grid = images[miss] * self.ngrid
+      base = np.round(grid)
+      step = np.where(grid >= base, 1, -1)
+      found = np.full(len(miss), -1)
+      for shift in np.ndindex(2, 2, 2):
+        k = self.grid_keys((base + step*np.array(shift)) / self.ngrid)
+        j = np.minimum(np.searchsorted(self.sorted_keys, k), len(self.sorted_keys)-1)
+        d = images[miss] - self.positions[self.key_order[j]]
+        near = (self.sorted_keys[j] == k) & (np.linalg.norm((d - np.round(d)) @ self.lattice, axis=1) <= self.symprec)
+        found[near] = self.key_order[j[near]]
+      if np.any(found < 0):
+        return None
+      perm[miss] = found
+
+    if np.any(self.numbers[perm] != self.numbers) or np.any(perm[:self.nsite] >= self.nsite):
+      return None
+    return perm
+
+
+  def translation_operations ( self ):
+    '''
+      Candidate pure translations, which carry a reference site onto each site with the same label.
+    '''
+    same = np.flatnonzero(self.numbers == self.numbers[0])
+    eye = np.eye(3, dtype=int)
+    return [(eye, self.positions[j]-self.positions[0]) for j in same]
+
+
+  def spglib_operations ( self, lattice ):
+    '''
+      Space group operations of the labelled sites, or None if spglib is not installed.
+    '''
+    try:
+      import spglib
+    except ImportError:
+      print('spglib is not installed. Only lattice translations will be used for site symmetry.')
+      return None
+
+    sym = spglib.get_symmetry((lattice, self.positions, self.numbers), symprec=self.symprec)
+    if sym is None:
+      return None
+    return list(zip(sym['rotations'], sym['translations']))
+
+
+  def canonical ( self, occupation ):
+    '''
+      Find the canonical representative of an occupation, the lexicographically smallest of its symmetry images.
+      The images are compared one site at a time, keeping only the operations whose image equals the
+      smallest value at each site, so that only the few columns needed to single out the minimum are built.
+
+      Arguments:
+        occupation (ndarray): Integer occupation code for each site
+
+      Returns:
+        (ndarray): Canonical occupation
+    '''
+    occupation = np.asarray(occupation)
+    perms = self.permutations
+    cand = np.arange(len(perms))
+    for k in range(self.nsite):
+      # Operations in the stabilizer of the occupation give identical images, so a few remaining candidates are compared whole
+      if len(cand) <= CANONICAL_CANDIDATES:
+        images = occupation[perms[cand]]
+        return images[np.lexsort(images.T[::-1])[0]]
+      column = occupation[perms[cand,k]]
+      cand = cand[column == column.min()]
+
+    # Every remaining operation matches the minimum at every site
+    return occupation[perms[cand[0]]]
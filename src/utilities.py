@@ -1,7 +1,7 @@
 
 
 
-def create_supercell ( lattice, positions, species=None, nsc=(2,2,2) ):
+def create_supercell ( lattice, positions, species=None, nsc=(2,2,2), return_mapping=False ):
   '''
     Create a supercell lattice and set of atomic positions from a unit arrangement.
     If species are provided, they will be duplicated accordingly.
@@ -10,32 +10,89 @@ def create_supercell ( lattice, positions, species=None, nsc=(2,2,2) ):
       lattice (ndarray): 3x3 matrix with the lattice vectors
       positions (ndarray): Nx3 matrix containing the unit positions as 3-vectors
       species (list): List of species to duplicate. If None, only lattice and positions are replicated
-      nsc (tuple, list, or ndarray): Number of cells to replicate in each direction (nx,ny,nz)
+      nsc (int, tuple, list, or ndarray): Number of cells to replicate in each direction (nx,ny,nz), or a 3x3 integer matrix M with the supercell lattice vectors M @ lattice. Sites are ordered by cell, then by unit site. Positions of non-diagonal supercells are wrapped into the supercell.
+      return_mapping (bool): Also return the unit site index and lattice translation of each supercell site
 
     Returns:
       (ndarray,ndarray): supercell lattice and positions, if species is not specified
       (ndarray,ndarray,list): supercell lattice, positions, and replicated species, if species is specified
+      (...,ndarray,ndarray): the above, followed by the unit site index of each supercell site, and its translation T as a 3-vector of integers, such that the site is at (positions[index] + T) @ lattice in Cartesian coordinates, if return_mapping is True
   '''
   import numpy as np
 
-  supercell_positions = []
+  lattice = np.array(lattice)
+  positions = np.array(positions, dtype=float)
+  nunit = len(positions)
 
-  for i in range(nsc[0]):
-    for j in range(nsc[1]):
-      for k in range(nsc[2]):
-        origin = np.array([i,j,k])
-        supercell_positions += [pos+origin for pos in positions]
+  matrix = np.array(nsc, dtype=int)
+  if matrix.ndim < 2:
+    matrix = np.diag(np.broadcast_to(matrix, 3))
+  if matrix.shape != (3,3):
+    raise ValueError('nsc must contain three integers or be a 3x3 integer matrix')
+  ncell = int(round(abs(np.linalg.det(matrix))))
+  if ncell == 0:
+    raise ValueError('The supercell matrix must be nonsingular')
+  diagonal = np.count_nonzero(matrix - np.diag(np.diagonal(matrix))) == 0 and np.all(np.diagonal(matrix) > 0)
 
-  supercell_lattice = lattice.copy()
-  supercell_positions = np.array(supercell_positions)
-  for i in range(3):
-    supercell_lattice[i] *= nsc[i]
-    supercell_positions[:,i] /= nsc[i]
+  # Lattice translations in the bounding box of the supercell, in lexicographic order
+  corners = np.array([[i,j,k] for i in (0,1) for j in (0,1) for k in (0,1)]) @ matrix
+  lo,hi = corners.min(axis=0),corners.max(axis=0)
+  translations = np.indices(hi-lo).reshape(3,-1).T + lo
 
-  if species is not None:
-    supercell_species = np.prod(nsc) * species
-    return supercell_lattice,supercell_positions,supercell_species
+  if diagonal:
+    n = np.diagonal(matrix)
+    supercell_lattice = lattice * n[:,None]
+    supercell_positions = (positions[None,:,:] + translations[:,None,:]) / n
 
   else:
-    return supercell_lattice,supercell_positions
+    # Retain the translations inside the supercell, one for each unit cell
+    inverse = np.linalg.inv(matrix)
+    frac = translations @ inverse
+    inside = np.all((frac > -1e-8) & (frac < 1-1e-8), axis=1)
+    translations = translations[inside]
+    if len(translations) != ncell:
+      raise ValueError(f'Found {len(translations)} lattice translations in a supercell of {ncell} cells')
+    supercell_lattice = matrix @ lattice
+    supercell_positions = (positions[None,:,:] + translations[:,None,:]) @ inverse
+
+  index = np.tile(np.arange(nunit), ncell)
+  translations = np.repeat(translations, nunit, axis=0)
+  supercell_positions = supercell_positions.reshape(-1, 3)
+
+  if not diagonal:
+    # Wrap each site into the supercell, moving its translation by the corresponding supercell vector
+    shift = np.floor(supercell_positions + 1e-8).astype(int)
+    supercell_positions -= shift
+    supercell_positions[np.abs(supercell_positions) < 1e-8] = 0.
+    translations -= shift @ matrix
+
+  result = [supercell_lattice, supercell_positions]
+  if species is not None:
+    result.append([species[i] for i in index] if not diagonal else ncell * list(species))
+  if return_mapping:
+    result += [index, translations]
+  return tuple(result)
+
+
+
+
+def neighbor_shells ( lattice, positions, nshells=2, tol=1e-3 ):
+  '''
+    Find the periodic neighbors of each site within the first nshells distinct neighbor distances.
+    Each neighbor pair is listed in both directions, and once for every periodic image within range.
+    The search uses a cell list through neighbors.NeighborIndex, which may be kept and shared instead.
+
+    Arguments:
+      lattice (ndarray): 3x3 matrix with the lattice vectors
+      positions (ndarray): Nx3 matrix containing the crystal coordinates of each site
+      nshells (int): Number of neighbor shells to include
+      tol (float): Tolerance, in Angstrom, for assigning distances to the same shell
+
+    Returns:
+      (ndarray,ndarray,ndarray,ndarray): Site index, neighbor index, and shell index of each neighbor pair, and the distance of each shell
+  '''
+  from .neighbors import NeighborIndex
 
+  index = NeighborIndex(lattice, positions, nshells=nshells, tol=tol)
+  rows,cols,shells = index.pairs()
+  return rows,cols,shells,index.shell_distances
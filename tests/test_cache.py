@@ -0,0 +1,19 @@
+from MCSPS.cache import EnergyCache
+import numpy as np
+import pytest
+
+
+def test_integer_keys_follow_the_symbols ( ):
+  cache = EnergyCache(10)
+  key = cache.key(['Cu', 'Zn', None, 'Cu'])
+
+  # The same configuration, indexed through different symbol orders, with -1 for the vacancy in the last entry
+  assert cache.key(np.array([0, 1, -1, 0]), ['Cu', 'Zn', None]) == key
+  assert cache.key(np.array([1, 0, 2, 1]), ['Zn', 'Cu', None]) == key
+
+  # The same indices with other symbols are another configuration
+  assert cache.key(np.array([0, 1, -1, 0]), ['Zn', 'Cu', None]) != key
+  assert cache.key(np.array([0, 1, -1, 0]), ['Ag', 'Zn', None]) != key
+
+  with pytest.raises(ValueError):
+    cache.key(np.array([0, 1, 0, 0]))
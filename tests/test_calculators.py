@@ -0,0 +1,156 @@
+from MCSPS.calculators import ClusterExpansionCalculator, MEGNet_Calculator
+from MCSPS.utilities import create_supercell
+import numpy as np
+import pytest
+
+
+def cuzn_supercell ( n=3 ):
+  return create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], [n,n,n])
+
+
+def test_running_fit_matches_full_fit ( ):
+  lattice,positions,species = cuzn_supercell()
+  ce = ClusterExpansionCalculator(lattice, positions, species, min_samples=10**9)
+
+  rng = np.random.default_rng(0)
+  X,y = [],[]
+  for _ in range(200):
+    s = rng.permutation(species).tolist()
+    energy = rng.normal()
+    ce.add_sample(s, energy)
+    X.append(ce.features(s))
+    y.append(energy)
+  ce.fit()
+
+  # Ridge regression on the full arrays of centered features and energies
+  X,y = np.array(X),np.array(y)
+  xm,ym = X.mean(axis=0),y.mean()
+  A = (X-xm).T@(X-xm) + ce.alpha*len(y)*np.eye(ce.nfeature)
+  coef = np.linalg.solve(A, (X-xm).T@(y-ym))
+
+  assert ce.nsample == 200
+  assert np.allclose(ce.coef, coef, rtol=1e-6, atol=1e-8)
+  assert np.isclose(ce.intercept, ym - xm@coef)
+
+
+class FakeGraphConverter:
+  '''
+    Crystal graph converter with the interface of MEGNet's CrystalGraph, and atom and bond converters that are not the identity.
+  '''
+
+  class AtomConverter:
+    def convert ( self, atoms ):
+      atoms = np.asarray(atoms, dtype=float)
+      return np.stack([atoms, np.sqrt(atoms)], axis=1)
+
+  class BondConverter:
+    def convert ( self, bonds ):
+      return np.exp(-np.subtract.outer(np.asarray(bonds), np.linspace(2, 6, 4))**2)
+
+  atom_converter = AtomConverter()
+  bond_converter = BondConverter()
+
+  def convert ( self, structure ):
+    index1,index2,_,bonds = structure.get_neighbor_list(4.5)
+    return {'atom':[site.specie.Z for site in structure], 'bond':bonds, 'state':[[0., 0.]], 'index1':index1, 'index2':index2}
+
+  def graph_to_input ( self, graph ):
+    return [self.atom_converter.convert(graph['atom'])[None], self.bond_converter.convert(graph['bond'])[None],
+            np.array(graph['state'])[None], np.array(graph['index1'], dtype=np.int32)[None],
+            np.array(graph['index2'], dtype=np.int32)[None], np.zeros((1,len(graph['atom'])), dtype=np.int32),
+            np.zeros((1,len(graph['index1'])), dtype=np.int32)]
+
+
+class FakeMEGNetModel:
+  '''
+    Nonlinear function of the inputs of a batch of graphs, evaluated like a MEGNet model.
+  '''
+
+  class TargetScaler:
+    def inverse_transform ( self, target, natom ):
+      return target * natom
+
+  graph_converter = FakeGraphConverter()
+  target_scaler = TargetScaler()
+
+  def predict ( self, inputs, verbose=False ):
+    atoms,bonds,state,index1,index2,gnode,gbond = [x[0] for x in inputs]
+    ngraph = gnode.max() + 1
+    pair = np.tanh(0.02 * (atoms[index1] @ np.array([0.3, -1.])) * (atoms[index2] @ np.array([-0.2, 0.7]))) * (bonds @ np.arange(1, 5))
+    site = np.bincount(gnode, weights=np.sin(atoms[:,0]) + state[gnode,0], minlength=ngraph)
+    return ((np.bincount(gbond, weights=pair, minlength=ngraph) + site) / np.bincount(gnode, minlength=ngraph))[None,:,None]
+
+  def predict_graph ( self, graph ):
+    return self.target_scaler.inverse_transform(self.predict(self.graph_converter.graph_to_input(graph))[0,0], len(graph['atom']))
+
+  def predict_graphs ( self, graphs, batch_size=128 ):
+    # Like MEGNet, the atom features of the graphs are used as given and only the bond converter is applied
+    converter = self.graph_converter
+    energies = []
+    for graph in graphs:
+      inputs = converter.graph_to_input(graph)
+      inputs[0] = np.asarray(graph['atom'], dtype=float)[None]
+      energies.append(self.target_scaler.inverse_transform(self.predict(inputs)[0,0], len(graph['atom'])))
+    return np.array(energies)
+
+
+class FakeBondTypeConverter (FakeGraphConverter):
+  '''
+    Crystal graph converter whose bond features depend on the species, like MEGNet's CrystalGraphWithBondTypes.
+  '''
+
+  def convert ( self, structure ):
+    graph = super().convert(structure)
+    numbers = np.array(graph['atom'])
+    graph['bond'] = graph['bond'] + 0.01 * (numbers[graph['index1']] + numbers[graph['index2']])
+    return graph
+
+
+def megnet_calculator ( model ):
+  calculator = MEGNet_Calculator.__new__(MEGNet_Calculator)
+  calculator.model = model
+  calculator.reuse_graph = True
+  calculator.graph,calculator.graph_key,calculator.graph_bonds = None,None,None
+  calculator.graph_species,calculator.graph_checked = None,False
+  calculator.atomic_numbers = {}
+  return calculator
+
+
+def ingaas_batch ( ):
+  lattice,positions,species = create_supercell(5.65/2*(1-np.eye(3)), np.array([[0,0,0],[0.25,0.25,0.25]]), ['Ga','As'], [2,2,2])
+  species[:4] = ['In'] * 4
+  rng = np.random.default_rng(0)
+  batch = np.array([species[:8]] * 5, dtype=object)
+  batch = np.concatenate([np.array([rng.permutation(b) for b in batch]), np.array([species[8:]] * 5, dtype=object)], axis=1)
+  return lattice,positions,batch
+
+
+def test_megnet_predict_many_matches_single ( ):
+  pytest.importorskip('pymatgen')
+
+  calculator = megnet_calculator(FakeMEGNetModel())
+  lattice,positions,batch = ingaas_batch()
+
+  single = [calculator.predict_formation_energy(lattice, s.tolist(), positions) for s in batch]
+  assert np.allclose(calculator.predict_many(lattice, batch, positions), single, rtol=0, atol=1e-6)
+  assert np.allclose(calculator.predict_many(lattice, batch.tolist(), positions), single, rtol=0, atol=1e-6)
+  assert calculator.reuse_graph
+
+
+def test_megnet_species_dependent_bonds_are_not_reused ( ):
+  pytest.importorskip('pymatgen')
+  from pymatgen.core.structure import Structure
+
+  model = FakeMEGNetModel()
+  model.graph_converter = FakeBondTypeConverter()
+  lattice,positions,batch = ingaas_batch()
+  full = np.ravel([model.predict_graph(model.graph_converter.convert(Structure(lattice, s.tolist(), positions))) for s in batch])
+
+  calculator = megnet_calculator(model)
+  assert np.allclose(calculator.predict_many(lattice, batch, positions), full, rtol=0, atol=1e-6)
+  assert not calculator.reuse_graph
+
+  calculator = megnet_calculator(model)
+  single = [calculator.predict_formation_energy(lattice, s.tolist(), positions) for s in batch]
+  assert np.allclose(single, full, rtol=0, atol=1e-6)
+  assert not calculator.reuse_graph
@@ -0,0 +1,56 @@
+from MCSPS.calculators import Calculator, ClusterExpansionCalculator
+from MCSPS.mcsps import sps_fixed
+from MCSPS.observables import ObservableAccumulator
+from MCSPS.utilities import create_supercell
+import numpy as np
+import pytest
+
+
+class Interrupted ( Exception ):
+  pass
+
+
+class InterruptedCalculator ( Calculator ):
+  '''
+    Full-structure energies from a fitted cluster expansion, raising Interrupted after limit evaluations.
+  '''
+
+  def __init__ ( self, expansion, limit=None ):
+    self.expansion = expansion
+    self.limit = limit
+    self.calls = 0
+
+  def predict_formation_energy ( self, lattice, species, positions ):
+    if self.limit is not None and self.calls >= self.limit:
+      raise Interrupted
+    self.calls += 1
+    return self.expansion.predict_formation_energy(lattice, species, positions)
+
+
+def test_resumed_run_is_identical ( tmp_path ):
+  lattice,positions,species = create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], [3,3,3])
+  rng = np.random.default_rng(0)
+  species = rng.permutation(species).tolist()
+  expansion = ClusterExpansionCalculator(lattice, positions, species)
+  expansion.set_interactions(0.02*(rng.random(expansion.nfeature)-0.5), 0.)
+
+  def run ( name, calculator, seed ):
+    surrogate = ClusterExpansionCalculator(lattice, positions, species, min_samples=30)
+    observables = ObservableAccumulator(lattice, positions, fname=str(tmp_path/f'{name}.obs'))
+    np.random.seed(seed)
+    sps_fixed(lattice, species, positions, [300, 100, 0], [150, 150, 100], emin_fname=None, calculator=calculator,
+              swap_fname=str(tmp_path/f'{name}.out'), config_fname=str(tmp_path/f'{name}.log'), observables=observables,
+              surrogate=surrogate, checkpoint_fname=str(tmp_path/f'{name}.chk'), checkpoint_interval=40, resume=True)
+    return surrogate
+
+  reference = run('a', InterruptedCalculator(expansion), 1)
+  with pytest.raises(Interrupted):
+    run('b', InterruptedCalculator(expansion, limit=120), 1)
+
+  # The random state is restored from the checkpoint, so the seed of the resumed run has no effect
+  resumed = run('b', InterruptedCalculator(expansion), 7)
+
+  for ext in ('out', 'log', 'obs'):
+    assert (tmp_path/f'a.{ext}').read_bytes() == (tmp_path/f'b.{ext}').read_bytes()
+  assert reference.fitted and resumed.nsample == reference.nsample
+  assert np.allclose(resumed.coef, reference.coef)
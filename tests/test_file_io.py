@@ -0,0 +1,53 @@
+from MCSPS.calculators import ClusterExpansionCalculator
+from MCSPS.file_io import SwapTrajectoryWriter, read_swap_trajectory, replay_configurations
+from MCSPS.mcsps import sps_fixed
+from MCSPS.utilities import create_supercell
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_swap_trajectory_round_trip ( tmp_path, binary ):
+  rng = np.random.default_rng(0)
+  steps = np.cumsum(rng.integers(1, 20, 50)).tolist()
+  prev = np.diff([0] + steps).tolist()
+  temps = np.repeat([500., 250.5], 25).tolist()
+  enes = (-3 + rng.random(50)).tolist()
+
+  fname = str(tmp_path/'swaps.out')
+  with SwapTrajectoryWriter(fname, 'w', binary=binary, buffer_size=7) as writer:
+    for row in zip(steps[:30], prev[:30], temps[:30], enes[:30]):
+      writer.write(*row)
+
+  # Appending continues the same file
+  with SwapTrajectoryWriter(fname, 'a', binary=binary) as writer:
+    for row in zip(steps[30:], prev[30:], temps[30:], enes[30:]):
+      writer.write(*row)
+
+  assert read_swap_trajectory(fname) == (steps, prev, temps, enes)
+
+
+def test_replay_reproduces_trajectory ( tmp_path ):
+  lattice,positions,species = create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], [3,3,3])
+  rng = np.random.default_rng(0)
+  species = rng.permutation(species).tolist()
+  expansion = ClusterExpansionCalculator(lattice, positions, species)
+  expansion.set_interactions(rng.random(expansion.nfeature)-0.5, 0.)
+
+  swap_fname,config_fname = str(tmp_path/'swaps.out'),str(tmp_path/'config.log')
+  np.random.seed(1)
+  sps_fixed(lattice, species, positions, [2000, 500], [200, 200], emin_fname=None, calculator=expansion,
+            swap_fname=swap_fname, config_fname=config_fname)
+
+  # Every accepted configuration is replayed, and has the energy recorded in the trajectory
+  steps,_,_,enes = read_swap_trajectory(swap_fname)
+  replayed = list(replay_configurations(config_fname))
+  assert [step for step,_ in replayed] == steps
+  for (_,atoms),ene in zip(replayed, enes):
+    assert np.isclose(expansion.predict_formation_energy(lattice, atoms.get_chemical_symbols(), positions), ene)
+
+  # Structures at requested iterations are the configurations last accepted before them
+  requested = [0, steps[len(steps)//2]+1, 400]
+  for (step,atoms),k in zip(replay_configurations(config_fname, requested), np.searchsorted(steps, requested, side='right')-1):
+    assert step in requested
+    assert atoms.get_chemical_symbols() == replayed[k][1].get_chemical_symbols()
@@ -0,0 +1,65 @@
+from MCSPS.calculators import ClusterExpansionCalculator
+from MCSPS.mcsps import kB, sps_fixed, sps_polish, sps_replicas
+from MCSPS.observables import ObservableAccumulator
+from MCSPS.utilities import create_supercell
+from itertools import combinations
+import numpy as np
+import pytest
+
+
+def cuzn_expansion ( seed=0 ):
+  '''
+    Random cluster expansion on a 2x2x2 CuZn supercell, small enough to enumerate every configuration.
+  '''
+  lattice,positions,species = create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], [2,2,2])
+  rng = np.random.default_rng(seed)
+  species = rng.permutation(species).tolist()
+  expansion = ClusterExpansionCalculator(lattice, positions, species, pair_shells=2, triplet_shells=1)
+  expansion.set_interactions(0.1*(rng.random(expansion.nfeature)-0.5), 0.)
+  return lattice,positions,species,expansion
+
+
+def test_replicas_require_fitted_cluster_expansion ( ):
+  lattice,positions,species = create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], [2,2,2])
+  calculator = ClusterExpansionCalculator(lattice, positions, species)
+  with pytest.raises(ValueError, match='must be fit'):
+    sps_replicas(lattice, species, positions, [300], [10], nreplicas=2, calculator=calculator)
+
+
+def test_rejection_free_matches_metropolis ( tmp_path ):
+  lattice,positions,species,expansion = cuzn_expansion()
+  temp = 150.
+
+  # Exact mean energy over every configuration with half of the sites Cu
+  enes = []
+  for cu in combinations(range(len(species)), len(species)//2):
+    occ = np.ones(len(species), dtype=int)
+    occ[list(cu)] = 0
+    enes.append(expansion.intercept + expansion.features(occ)@expansion.coef)
+  enes = np.array(enes)
+  weights = np.exp(-(enes-enes.min())/(kB*temp))
+  exact = np.sum(weights*enes) / np.sum(weights)
+
+  for rejection_free in (None, np.inf):
+    observables = ObservableAccumulator()
+    np.random.seed(0)
+    sps_fixed(lattice, species, positions, [temp], [5000], nswap=1, nswap_inc=10**9, emin_fname=None,
+              swap_fname=str(tmp_path/f'{rejection_free}.out'), calculator=expansion, observables=observables,
+              rejection_free=rejection_free)
+    assert abs(observables.stats[temp]['mean'] - exact) < 1e-3
+
+
+def test_polish_ends_at_local_minimum ( ):
+  lattice,positions,species,expansion = cuzn_expansion(1)
+  polished,energy,nswaps = sps_polish(lattice, species, positions, expansion)
+
+  assert nswaps > 0
+  assert sorted(polished) == sorted(species)
+  assert np.isclose(energy, expansion.predict_formation_energy(lattice, polished, positions))
+
+  # No single swap lowers the energy
+  for i,j in combinations(range(len(polished)), 2):
+    if polished[i] != polished[j]:
+      swapped = list(polished)
+      swapped[i],swapped[j] = swapped[j],swapped[i]
+      assert expansion.predict_formation_energy(lattice, swapped, positions) > energy - 1e-12
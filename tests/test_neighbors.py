@@ -0,0 +1,67 @@
+from MCSPS.neighbors import NeighborIndex
+from MCSPS.utilities import create_supercell
+import numpy as np
+import pickle
+import pytest
+
+
+def brute_force_neighbors ( lattice, positions, nshells, tol=1e-3 ):
+  '''
+    Site, neighbor, image, distance, and shell of every neighbor entry, from all pairs of sites and nearby images.
+  '''
+  frac = positions % 1
+  images = np.array([[a,b,c] for a in range(-3,4) for b in range(-3,4) for c in range(-3,4)])
+  rows,cols,imgs,dists = [],[],[],[]
+  for i in range(len(frac)):
+    for j in range(len(frac)):
+      d = np.linalg.norm((frac[j] + images - frac[i]) @ lattice, axis=1)
+      keep = d > tol
+      rows += [i]*int(keep.sum())
+      cols += [j]*int(keep.sum())
+      imgs += images[keep].tolist()
+      dists += d[keep].tolist()
+  dists = np.array(dists)
+
+  shells = []
+  for d in np.sort(dists):
+    if len(shells) == 0 or d - shells[-1] > 2*tol:
+      shells.append(d)
+  shells = np.array(shells[:nshells])
+  shell = np.argmin(np.abs(dists[:,None] - shells[None,:]), axis=1)
+  keep = np.abs(dists - shells[shell]) <= 2*tol
+  return sorted((r,c,tuple(t),s) for r,c,t,s,k in zip(rows, cols, imgs, shell, keep) if k),shells
+
+
+@pytest.fixture
+def fcc ( ):
+  # Primitive fcc cell with non-orthogonal lattice vectors and a two site basis
+  return create_supercell(3.6/2*(1-np.eye(3)), np.array([[0,0,0],[0.25,0.25,0.25]]), nsc=[3,2,2])
+
+
+def test_matches_brute_force ( fcc ):
+  lattice,positions = fcc
+  index = NeighborIndex(lattice, positions, nshells=3)
+  entries,shells = brute_force_neighbors(lattice, positions, 3)
+
+  rows = index.rows
+  found = sorted((int(r),int(c),tuple(int(x) for x in t),int(s)) for r,c,t,s in zip(rows, index.indices, index.images, index.shells))
+  assert found == entries
+  assert np.allclose(index.shell_distances, shells, atol=2e-3)
+  frac = positions % 1
+  assert np.allclose(index.distances, np.linalg.norm((frac[index.indices] + index.images - frac[rows]) @ lattice, axis=1))
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_save_load_round_trip ( fcc, tmp_path, mmap ):
+  lattice,positions = fcc
+  index = NeighborIndex(lattice, positions, nshells=2)
+  fname = str(tmp_path/'neighbors.idx')
+  index.save(fname)
+
+  loaded = NeighborIndex.load(fname, mmap=mmap)
+  for copy in (loaded, pickle.loads(pickle.dumps(loaded))):
+    assert copy.nshells == index.nshells and copy.matches(lattice, positions)
+    assert np.allclose(copy.shell_distances, index.shell_distances)
+    for name in ('positions', 'ptr', 'indices', 'distances', 'shells', 'images'):
+      assert np.array_equal(getattr(copy, name), getattr(index, name))
+      assert getattr(copy, name).dtype == getattr(index, name).dtype
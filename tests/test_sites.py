@@ -0,0 +1,66 @@
+from MCSPS.neighbors import NeighborIndex
+from MCSPS.sites import SitePools, VacancyPools
+from MCSPS.utilities import create_supercell
+import numpy as np
+
+
+def check_consistent ( pools ):
+  # The site and occupant arrays are inverse, and the grouping by species matches the contents
+  occupied = np.flatnonzero(pools.occupant >= 0)
+  assert np.array_equal(pools.site[pools.occupant[occupied]], occupied)
+  assert np.array_equal(pools.order[pools.slot], np.arange(len(pools)))
+  group = pools.content[pools.order] % len(pools.symbols)
+  assert np.array_equal(group, np.repeat(np.arange(len(pools.symbols)), pools.counts))
+
+
+def test_vacancy_moves_are_undone ( ):
+  lattice,positions = create_supercell(4.0*np.eye(3), np.array([[0,0,0],[0.5,0.5,0],[0.5,0,0.5],[0,0.5,0.5]]), nsc=[2,2,2])
+  occupants = ['Li']*10 + ['Na']*6
+  np.random.seed(0)
+  pools = VacancyPools(occupants, len(positions), sites=np.random.permutation(len(positions))[:len(occupants)],
+                       neighbors=NeighborIndex(lattice, positions, nshells=1))
+
+  for trial in range(200):
+    occupant,site,content = pools.occupant.copy(),pools.site.copy(),pools.content
+    moves = pools.move(np.random.randint(len(occupants)), nmoves=1+trial%3, hop=trial%2 == 1)
+    check_consistent(pools)
+
+    # The changed sites are exactly those whose species differs
+    assert pools.changed(moves) == np.flatnonzero(pools.content != content).tolist()
+    for a,b in moves:
+      assert a != b
+
+    # Rejected trials are undone, and accepted trials are kept
+    if trial % 4 != 0:
+      pools.undo(moves)
+      assert np.array_equal(pools.occupant, occupant) and np.array_equal(pools.site, site)
+      check_consistent(pools)
+
+
+def test_proposals_stay_within_sublattice ( ):
+  # Two fixed sites, a mixed cation sublattice, a mixed anion sublattice, and a sublattice with a single species
+  species = ['Cs']*2 + ['Sn','Pb']*6 + ['I','Br','Br']*4 + ['Rb']*4
+  sublattices = ['A']*2 + ['B']*12 + ['X']*12 + ['C']*4
+  np.random.seed(0)
+  order = 2 + np.random.permutation(len(species)-2)
+  species = species[:2] + [species[k] for k in order]
+  sublattices = sublattices[:2] + [sublattices[k] for k in order]
+  pools = SitePools(species, nfixed=2, sublattices=sublattices, weights={'B':1, 'X':3, 'C':1})
+
+  drawn = {'B':0, 'X':0}
+  for _ in range(200):
+    # Every pair of a trial is drawn from the current configuration
+    pairs = pools.propose(3)
+    for i,j in pairs:
+      assert i >= 2 and j >= 2
+      assert sublattices[i] == sublattices[j] and sublattices[i] in drawn
+      assert pools.species[i] != pools.species[j]
+      drawn[sublattices[i]] += 1
+    for i,j in pairs:
+      pools.swap(i, j)
+
+  # Sublattices are drawn in proportion to their weights, and the composition of each is unchanged
+  assert 2.4 < drawn['X']/drawn['B'] < 3.6
+  for label in ('B', 'X', 'C'):
+    sites = [k for k,l in enumerate(sublattices) if l == label]
+    assert sorted(pools.decode()[k] for k in sites) == sorted(species[k] for k in sites)
@@ -0,0 +1,16 @@
+from MCSPS.symmetry import SiteSymmetry
+from MCSPS.utilities import create_supercell
+import numpy as np
+
+
+def test_canonical_is_smallest_image ( ):
+  lattice,positions,species = create_supercell(2.955*np.eye(3), np.array([[0,0,0],[0.5,0.5,0.5]]), ['Cu','Zn'], [3,3,3])
+  sym = SiteSymmetry(lattice, positions)
+  assert len(sym) == 48 * len(positions)
+
+  rng = np.random.default_rng(0)
+  occupations = [rng.permutation(np.arange(len(positions)) % 2) for _ in range(20)]
+  occupations.append(np.arange(len(positions)) % 2)
+  for occ in occupations:
+    images = occ[sym.permutations]
+    assert np.array_equal(sym.canonical(occ), images[np.lexsort(images.T[::-1])[0]])
@@ -0,0 +1,19 @@
+from MCSPS.utilities import create_supercell
+import numpy as np
+
+
+def test_supercell_mapping_non_diagonal ( ):
+  lattice = 3.6/2*(1-np.eye(3))
+  positions = np.array([[0,0,0],[0.25,0.25,0.25]])
+  matrix = np.array([[-1,1,1],[1,-1,1],[1,1,-1]])
+  sc_lattice,sc_positions,sc_species,index,translations = create_supercell(lattice, positions, ['Ga','As'], matrix, return_mapping=True)
+
+  # The conventional cubic cell holds four primitive cells
+  assert np.allclose(sc_lattice, 3.6*np.eye(3))
+  assert len(sc_positions) == 8 and sc_species == [['Ga','As'][i] for i in index]
+  assert np.all((sc_positions >= 0) & (sc_positions < 1))
+
+  # Each site is its unit site translated by a lattice vector, and the sites are distinct
+  assert np.allclose(sc_positions @ sc_lattice, (positions[index] + translations) @ lattice)
+  assert len(np.unique(np.round(sc_positions, 8), axis=0)) == len(sc_positions)
+  assert translations.dtype.kind == 'i'